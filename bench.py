@@ -0,0 +1,272 @@
+import os
+import sys
+import json
+import types
+import timeit
+import logging
+import argparse
+import platform
+import tempfile
+import importlib.util
+
+import pras3
+from pras3 import LEDs, VFD, Color, escape_bytes, unescape_bytes
+from effects import rainbow, color_sine, pulse, theater_chase
+
+###############################################################################
+# Benchmarks, no hardware needed
+###############################################################################
+# python bench.py                  run everything and compare to the baseline
+# python bench.py --save           run and store the results as the baseline
+# python bench.py -k rainbow       only benchmarks with "rainbow" in the name
+#
+# Exits with 1 if anything got slower than baseline * threshold. Baselines
+# are per machine, re-save them when moving to a different box.
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+# the sub-10us benchmarks move by up to ~1.4x between back-to-back runs
+DEFAULT_THRESHOLD = 1.5
+
+class FakeSerial:
+    """In-memory port: writes are counted and thrown away, reads get nothing."""
+    def __init__(self, *args, **kwargs):
+        self.bytes_written = 0
+        self.cts = True
+        self.out_waiting = 0
+
+    def write(self, b):
+        self.bytes_written += len(b)
+        return len(b)
+
+    def read(self, n=1):
+        return b''
+
+    def flush(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def close(self):
+        pass
+
+def fake_device(cls):
+    "A device of class cls talking to a FakeSerial."
+    real = pras3.serial.Serial
+    pras3.serial.Serial = FakeSerial
+    try:
+        return cls("fake")
+    finally:
+        pras3.serial.Serial = real
+
+class FrameLimit:
+    """Stands in for stop_event, lets an effect run for n frames."""
+    def __init__(self, n):
+        self.n = n
+
+    def is_set(self):
+        self.n -= 1
+        return self.n < 0
+
+###############################################################################
+# The benchmarks
+###############################################################################
+BENCHMARKS = {}
+
+def bench(name, per=1):
+    """
+    Register a benchmark. The decorated function does the setup and
+    returns the callable to time; per is how many operations one call
+    does, results are per operation.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, per)
+        return setup
+    return register
+
+def _frame():
+    # a 198-byte page with some bytes that need escaping
+    return bytes((i * 37) & 0xff for i in range(66)) * 3
+
+@bench("escape_bytes 198B")
+def _():
+    frame = _frame()
+    return lambda: escape_bytes(frame)
+
+@bench("unescape_bytes 198B")
+def _():
+    escaped = escape_bytes(_frame())
+    return lambda: unescape_bytes(escaped)
+
+@bench("LEDs._build_cmd 0x82")
+def _():
+    leds = fake_device(LEDs)
+    frame = _frame()
+    return lambda: leds._build_cmd(0x82, frame)
+
+@bench("LEDs.remap_pixels")
+def _():
+    leds = fake_device(LEDs)
+    pixels = _frame()[:66]
+    return lambda: leds.remap_pixels(leds.NORMAL_MAPPING, pixels)
+
+@bench("LEDs.build_pixels")
+def _():
+    leds = fake_device(LEDs)
+    left, center, right = Color(255, 0, 0), Color(0, 255, 0), Color(0, 0, 255)
+    return lambda: leds.build_pixels(left, center, right)
+
+@bench("rainbow.rainbow")
+def _():
+    return lambda: rainbow.rainbow(22, 17)
+
+@bench("color_sine.color_sine_effect")
+def _():
+    return lambda: color_sine.color_sine_effect(22, 1.3, (255, 0, 0), (0, 0, 255), 5)
+
+# whole effect loops: render + remap + encode + write to the fake port
+EFFECT_FRAMES = 100
+
+@bench("rainbow.animate frame", per=EFFECT_FRAMES)
+def _():
+    leds = fake_device(LEDs)
+    return lambda: rainbow.animate(leds, speed=0, stop_event=FrameLimit(EFFECT_FRAMES))
+
+@bench("color_sine.animate frame", per=EFFECT_FRAMES)
+def _():
+    leds = fake_device(LEDs)
+    return lambda: color_sine.animate(leds, (255, 0, 0), (0, 0, 255),
+                                      stop_event=FrameLimit(EFFECT_FRAMES), speed=0)
+
+@bench("pulse.animate frame", per=EFFECT_FRAMES)
+def _():
+    leds = fake_device(LEDs)
+    return lambda: pulse.animate(leds, (255, 0, 255), stop_event=FrameLimit(EFFECT_FRAMES), speed=0)
+
+@bench("theater_chase.animate frame", per=EFFECT_FRAMES)
+def _():
+    leds = fake_device(LEDs)
+    return lambda: theater_chase.animate(leds, (0, 255, 255), stop_event=FrameLimit(EFFECT_FRAMES), speed=0)
+
+def _ascii_art(width=160, height=32):
+    return ["".join("#" if (x * y + x) % 3 else " " for x in range(width)) for y in range(height)]
+
+@bench("VFD.convert_ascii_art 160x32")
+def _():
+    lines = _ascii_art()
+    return lambda: VFD.convert_ascii_art(lines)
+
+@bench("VFD.rotate_bitmap 160x32")
+def _():
+    w, h, image = VFD.convert_ascii_art(_ascii_art())
+    return lambda: VFD.rotate_bitmap(image, w, h)
+
+@bench("find_game_exe_in_target_folders 500 games")
+def _():
+    # main opens the ports and its data files when imported, so point both
+    # somewhere harmless while it loads. vu_meter imports the Windows-only
+    # audio package, which nothing here calls.
+    saved_env = {key: os.environ.get(key) for key in ("HOME", "USERPROFILE")}
+    real_serial = pras3.serial.Serial
+    stub_audio = 'pyaudiowpatch' not in sys.modules and importlib.util.find_spec('pyaudiowpatch') is None
+    os.environ["HOME"] = os.environ["USERPROFILE"] = tempfile.mkdtemp(prefix="pras3-bench-")
+    pras3.serial.Serial = FakeSerial
+    if stub_audio:
+        sys.modules['pyaudiowpatch'] = types.ModuleType('pyaudiowpatch')
+    try:
+        import main
+    finally:
+        pras3.serial.Serial = real_serial
+        for key, value in saved_env.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        if stub_audio:
+            del sys.modules['pyaudiowpatch']
+    logging.disable(logging.WARNING)
+
+    config = {f"game{i}.exe": {'launch_path': f"c:\\games\\game{i}\\game{i}.exe", 'led_effect': 'solid'}
+              for i in range(500)}
+    from config_index import ConfigIndex
+    main.config_store.index = ConfigIndex(config)
+
+    # 200 processes under the target folders, the game is the last one
+    procs = [(1000 + i, f"helper{i}.exe", f"c:\\games\\tools\\helper{i}.exe") for i in range(199)]
+    procs.append((2000, "game321.exe", "c:\\games\\game321\\game321.exe"))
+    class Tracker:
+        def scan(self):
+            return procs
+    main.process_tracker = Tracker()
+    return main.find_game_exe_in_target_folders
+
+###############################################################################
+# Runner
+###############################################################################
+def run(name, repeat=5):
+    "returns: best seconds per operation"
+    setup, per = BENCHMARKS[name]
+    func = setup()
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number / per
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding='utf-8') as f:
+        return json.load(f)
+
+def machine():
+    return f"{platform.system()} {platform.machine()} python {platform.python_version()}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pras3 benchmarks against an in-memory serial port")
+    parser.add_argument("-k", dest="pattern", help="only run benchmarks whose name contains this")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="baseline file")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"fail when slower than baseline * this (default {DEFAULT_THRESHOLD})")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    baseline = load_baseline(args.baseline)
+    threshold = args.threshold or (baseline or {}).get('threshold', DEFAULT_THRESHOLD)
+    if baseline and baseline.get('machine') != machine():
+        print(f"warning: baseline is from '{baseline.get('machine')}', this is '{machine()}'")
+    previous = (baseline or {}).get('results', {})
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<45} {'us/op':>10} {'baseline':>10} {'ratio':>7}")
+    for name in BENCHMARKS:
+        if args.pattern and args.pattern not in name:
+            continue
+        try:
+            seconds = run(name, args.repeat)
+        except ImportError as e:
+            # e.g. main on a box without the audio package
+            print(f"{name:<45} {'skipped':>10}  ({e})")
+            continue
+        results[name] = seconds
+        base = previous.get(name)
+        if base:
+            ratio = seconds / base
+            flag = "  SLOWER" if ratio > threshold else ""
+            if flag:
+                regressions.append(name)
+            print(f"{name:<45} {seconds * 1e6:>10.2f} {base * 1e6:>10.2f} {ratio:>7.2f}{flag}")
+        else:
+            print(f"{name:<45} {seconds * 1e6:>10.2f} {'-':>10} {'-':>7}")
+
+    if args.save:
+        saved = dict(previous, **results)
+        with open(args.baseline, "w", encoding='utf-8') as f:
+            json.dump({'machine': machine(), 'threshold': threshold, 'results': saved}, f, indent=4, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) over {threshold}x baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
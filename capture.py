@@ -0,0 +1,269 @@
+import time
+import struct
+import argparse
+from threading import Lock
+
+import serial
+
+###############################################################################
+# Serial traffic capture / replay
+###############################################################################
+# File layout, little-endian:
+#   header:  b"PRAS3CAP" | version u8 | wall clock start f64
+#   CHANNEL: kind u8 (0) | channel u8 | name len u8 | name
+#   WRITE:   kind u8 (1) | channel u8 | us since previous record u32 | len u16 | data
+#   READ:    kind u8 (2) | ...same as WRITE
+#
+# python capture.py info run.cap
+# python capture.py compare before.cap after.cap
+# python capture.py replay run.cap --port leds=/dev/ttyS1 --port vfd=/tmp/pras3/vfd --speed 2
+MAGIC = b"PRAS3CAP"
+VERSION = 1
+HEADER = struct.Struct("<8sBd")
+CHANNEL = struct.Struct("<BBB")
+RECORD = struct.Struct("<BBIH")
+REC_CHANNEL = 0
+REC_WRITE = 1
+REC_READ = 2
+
+class CaptureLog:
+    """
+    Records what goes over the wire for any number of devices into one
+    file. Records carry the time since the previous one in microseconds,
+    so a busy LED stream costs 8 bytes of overhead per write.
+
+        capture = CaptureLog("run.cap")
+        capture.attach(leds, "leds")
+        capture.attach(vfd, "vfd")
+        ...
+        capture.close()
+    """
+    def __init__(self, path):
+        self._f = open(path, "wb")
+        self._lock = Lock()
+        self._channels = {}
+        self._last = time.perf_counter()
+        self._f.write(HEADER.pack(MAGIC, VERSION, time.time()))
+
+    def attach(self, device, name):
+        "Capture everything device writes and reads from now on."
+        with self._lock:
+            channel = self._channels.setdefault(name, len(self._channels))
+            encoded = name.encode('utf-8')
+            self._f.write(CHANNEL.pack(REC_CHANNEL, channel, len(encoded)) + encoded)
+        device.set_port_wrapper(lambda port: CapturedPort(port, self, channel))
+
+    def record(self, kind, channel, data):
+        if not data:
+            return
+        with self._lock:
+            if self._f.closed:
+                return
+            now = time.perf_counter()
+            delta = min(int((now - self._last) * 1e6), 0xffffffff)
+            self._last = now
+            for i in range(0, len(data), 0xffff):
+                chunk = data[i:i + 0xffff]
+                self._f.write(RECORD.pack(kind, channel, delta, len(chunk)) + chunk)
+                delta = 0
+
+    def flush(self):
+        with self._lock:
+            self._f.flush()
+
+    def close(self):
+        with self._lock:
+            self._f.close()
+
+class CapturedPort:
+    """Stands in for the serial port of a device, logging writes and reads."""
+    def __init__(self, port, log, channel):
+        self._port = port
+        self._log = log
+        self._channel = channel
+
+    def write(self, b):
+        n = self._port.write(b)
+        self._log.record(REC_WRITE, self._channel, bytes(b))
+        return n
+
+    def read(self, size=1):
+        b = self._port.read(size)
+        self._log.record(REC_READ, self._channel, b)
+        return b
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+def read_capture(path):
+    """
+    returns: (wall clock start, {channel id: name},
+              [(seconds since start, kind, channel name, data)])
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, started = HEADER.unpack_from(data, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a capture file")
+    names = {}
+    records = []
+    pos = HEADER.size
+    t = 0.0
+    while pos < len(data):
+        kind = data[pos]
+        if kind == REC_CHANNEL:
+            if pos + CHANNEL.size > len(data):
+                break
+            _, channel, n = CHANNEL.unpack_from(data, pos)
+            names[channel] = data[pos + CHANNEL.size:pos + CHANNEL.size + n].decode('utf-8')
+            pos += CHANNEL.size + n
+            continue
+        if pos + RECORD.size > len(data):
+            break
+        kind, channel, delta, n = RECORD.unpack_from(data, pos)
+        end = pos + RECORD.size + n
+        if end > len(data):
+            break  # cut off mid-record, e.g. the daemon was killed
+        t += delta / 1e6
+        records.append((t, kind, names.get(channel, str(channel)), data[pos + RECORD.size:end]))
+        pos = end
+    return started, names, records
+
+def summarize(records):
+    """Per channel: bytes/writes/reads, duration and write interval stats."""
+    summary = {}
+    first_write = {}
+    last_write = {}
+    for t, kind, name, data in records:
+        s = summary.setdefault(name, {'write_bytes': 0, 'writes': 0, 'read_bytes': 0, 'reads': 0,
+                                      'first': t, 'last': t, 'interval_max': 0.0})
+        s['last'] = t
+        if kind == REC_WRITE:
+            s['write_bytes'] += len(data)
+            s['writes'] += 1
+            if name in last_write:
+                s['interval_max'] = max(s['interval_max'], t - last_write[name])
+            first_write.setdefault(name, t)
+            last_write[name] = t
+        else:
+            s['read_bytes'] += len(data)
+            s['reads'] += 1
+    for name, s in summary.items():
+        s['duration'] = s['last'] - s['first']
+        s['interval_mean'] = 0.0
+        if s['writes'] > 1:
+            s['interval_mean'] = (last_write[name] - first_write[name]) / (s['writes'] - 1)
+    return summary
+
+def compare(records_a, records_b):
+    """
+    Compare two captures channel by channel.
+    returns: {channel: dict with 'same_output' (written bytes identical),
+             'first_difference' (byte offset or None) and the summaries}
+    """
+    def stream(records, name):
+        return b''.join(data for t, kind, n, data in records if n == name and kind == REC_WRITE)
+    sa, sb = summarize(records_a), summarize(records_b)
+    result = {}
+    for name in sorted(set(sa) | set(sb)):
+        a, b = stream(records_a, name), stream(records_b, name)
+        diff = None
+        if a != b:
+            diff = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+        result[name] = {'same_output': a == b, 'first_difference': diff, 'a': sa.get(name), 'b': sb.get(name)}
+    return result
+
+def replay(records, ports, speed=1.0):
+    """
+    Re-send the writes of a capture.
+    ports: {channel name: open serial port}, channels not in it are skipped
+    speed: 2.0 plays twice as fast, 0 as fast as the ports take it
+    returns: {'duration', 'bytes', 'late_max'}; late_max is how far behind
+             the original timing the replay got
+    """
+    start = time.monotonic()
+    sent = 0
+    late_max = 0.0
+    for t, kind, name, data in records:
+        port = ports.get(name)
+        if kind != REC_WRITE or port is None:
+            continue
+        if speed:
+            due = start + t / speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                late_max = max(late_max, -delay)
+        port.write(data)
+        sent += len(data)
+    return {'duration': time.monotonic() - start, 'bytes': sent, 'late_max': late_max}
+
+###############################################################################
+# CLI
+###############################################################################
+# the rtscts setting each device is opened with in pras3.py
+RTSCTS = {'vfd': True}
+
+def do_info(args):
+    started, names, records = read_capture(args.file)
+    print(f"{args.file}: started {time.ctime(started)}, {len(records)} records")
+    for name, s in summarize(records).items():
+        print(f"  {name}: {s['writes']} writes / {s['write_bytes']} bytes, {s['reads']} reads / "
+              f"{s['read_bytes']} bytes over {s['duration']:.2f}s, write interval mean "
+              f"{s['interval_mean'] * 1000:.1f} ms max {s['interval_max'] * 1000:.1f} ms")
+
+def do_compare(args):
+    _, _, a = read_capture(args.a)
+    _, _, b = read_capture(args.b)
+    same = True
+    for name, c in compare(a, b).items():
+        if c['a'] is None or c['b'] is None:
+            print(f"  {name}: only in {args.a if c['b'] is None else args.b}")
+            same = False
+            continue
+        status = "same output" if c['same_output'] else f"output differs at byte {c['first_difference']}"
+        same = same and c['same_output']
+        print(f"  {name}: {status}; bytes {c['a']['write_bytes']} => {c['b']['write_bytes']}, "
+              f"duration {c['a']['duration']:.2f}s => {c['b']['duration']:.2f}s, "
+              f"write interval max {c['a']['interval_max'] * 1000:.1f} => {c['b']['interval_max'] * 1000:.1f} ms")
+    return 0 if same else 1
+
+def do_replay(args):
+    _, _, records = read_capture(args.file)
+    ports = {}
+    for spec in args.port:
+        name, path = spec.split("=", 1)
+        ports[name] = serial.Serial(path, args.baud, rtscts=RTSCTS.get(name, False), write_timeout=5.0)
+    result = replay(records, ports, args.speed)
+    print(f"Replayed {result['bytes']} bytes in {result['duration']:.2f}s, "
+          f"at most {result['late_max'] * 1000:.1f} ms behind")
+    for port in ports.values():
+        port.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, compare and replay serial captures")
+    subparsers = parser.add_subparsers(required=True)
+
+    info_parser = subparsers.add_parser('info')
+    info_parser.add_argument("file")
+    info_parser.set_defaults(func=do_info)
+
+    compare_parser = subparsers.add_parser('compare')
+    compare_parser.add_argument("a")
+    compare_parser.add_argument("b")
+    compare_parser.set_defaults(func=do_compare)
+
+    replay_parser = subparsers.add_parser('replay')
+    replay_parser.add_argument("file")
+    replay_parser.add_argument("--port", action='append', default=[], metavar="CHANNEL=PORT",
+                               help="e.g. leds=/dev/ttyS1, repeat for more channels")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="2 = twice as fast, 0 = no delays")
+    replay_parser.add_argument("--baud", type=int, default=115200)
+    replay_parser.set_defaults(func=do_replay)
+
+    args = parser.parse_args()
+    return args.func(args) or 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
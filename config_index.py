@@ -0,0 +1,65 @@
+import re
+
+###############################################################################
+# Game config index
+###############################################################################
+def split_path(path):
+    """c:\\Games\\Foo\\foo.exe => ['c:', 'games', 'foo', 'foo.exe']"""
+    return [p for p in re.split(r"[\\/]+", path.lower()) if p]
+
+class ConfigIndex:
+    """
+    Compiled lookup over games_config, built once.
+
+    - by exe name: config key and basename of launch_path, lowercased
+    - by folder: a trie over the path components of each launch_path's
+      folder, so c:\\games\\a\\game.exe and c:\\games\\b\\game.exe can map
+      to different configs even though the exe names are the same.
+
+    Keys of games_config don't have to be exe names when launch_path is set.
+    """
+    def __init__(self, games_config):
+        self._by_name = {}
+        self._trie = {}
+        for key, cfg in games_config.items():
+            names = {key.lower()}
+            launch_path = cfg.get('launch_path')
+            if launch_path:
+                parts = split_path(launch_path)
+                names.add(parts[-1])
+                node = self._trie
+                for part in parts[:-1]:
+                    node = node.setdefault(part, {})
+                node.setdefault(None, []).append((parts[-1], key))
+            for name in names:
+                self._by_name.setdefault(name, []).append(key)
+
+    def lookup(self, name, exe=None):
+        """
+        Find the config key for a running process.
+        The deepest launch_path folder containing exe with the same exe name
+        wins; otherwise an entry from exe's own folder (e.g. a launcher next
+        to the game); otherwise the exe name alone.
+        returns: key or None
+        """
+        name = name.lower()
+        if exe:
+            folders = split_path(exe)[:-1]
+            same_name = same_folder = None
+            node = self._trie
+            for depth, part in enumerate(folders, 1):
+                node = node.get(part)
+                if node is None:
+                    break
+                for exe_name, key in node.get(None, ()):
+                    if exe_name == name:
+                        same_name = key
+                        break
+                    if depth == len(folders) and same_folder is None:
+                        same_folder = key
+            if same_name or same_folder:
+                return same_name or same_folder
+        keys = self._by_name.get(name)
+        if keys:
+            return keys[0]
+        return None
@@ -0,0 +1,185 @@
+import os
+import json
+import logging
+
+from pras3 import Color, VFD, is_bitmap_file
+from effects import rainbow, vfd_animation
+from config_index import ConfigIndex
+
+try:
+    import tomllib
+except ImportError:  # python < 3.11
+    tomllib = None
+
+###############################################################################
+# Compiled game config store
+###############################################################################
+def load_vfd_image(path):
+    """
+    Load an ascii art or .pbm/.bmp file.
+    returns: (width, height, column-major bytes) ready for draw_bitmap
+    """
+    if is_bitmap_file(path):
+        # packed 1-bit image => decoded straight to column-major
+        return VFD.load_bitmap_file(path)
+    with open(path, "r", encoding='utf-8') as f:
+        lines = f.readlines()
+    if lines and lines[-1].strip() == "":
+        lines.pop()
+    w, h, image = VFD.convert_ascii_art(lines)
+    return (w, h, VFD.rotate_bitmap(image, w, h))
+
+def validate_game(key, cfg, possible_effects):
+    """
+    Raises ValueError describing the first problem with a games_config entry.
+    Image and animation files aren't checked here, CompiledGame drops the
+    ones that don't load and keeps the rest of the entry.
+    """
+    if not isinstance(cfg, dict):
+        raise ValueError(f"'{key}': entry must be a table/dict")
+    effect = cfg.get('led_effect', 'solid')
+    if effect not in possible_effects:
+        raise ValueError(f"'{key}': unknown led_effect '{effect}'")
+    for name in ('led_color', 'led_color_2'):
+        color = cfg.get(name)
+        if color is None:
+            continue
+        if (not isinstance(color, (list, tuple)) or len(color) != 3
+                or not all(isinstance(c, int) and 0 <= c <= 255 for c in color)):
+            raise ValueError(f"'{key}': {name} must be [r, g, b] with values 0-255")
+    if not isinstance(cfg.get('scroll_text', '') or '', str):
+        raise ValueError(f"'{key}': scroll_text must be a string")
+    fps = cfg.get('ascii_animation_fps', 10)
+    if not isinstance(fps, (int, float)) or fps <= 0:
+        raise ValueError(f"'{key}': ascii_animation_fps must be > 0")
+
+class CompiledGame:
+    """
+    One games_config entry, with everything that can be prepared ahead of
+    time already in the form that gets sent to the devices.
+    """
+    def __init__(self, key, cfg, leds, vfd, scroll_text_for):
+        self.key = key
+        self.cfg = cfg
+        self.led_effect = cfg.get('led_effect', 'solid')
+        self.led_color = list(cfg.get('led_color', [255, 255, 255]))
+        self.led_color_2 = list(cfg.get('led_color_2', [0, 0, 0]))
+        self.scroll_text = cfg.get('scroll_text', '') or ''
+
+        # the frame run_led_effect fades into, 198 bytes
+        if self.led_effect == 'rainbow':
+            px = leds.remap_pixels(leds.NORMAL_MAPPING, rainbow.rainbow(22, 0))
+        else:
+            c = Color(*self.led_color)
+            px = leds.build_pixels(c, c, c)
+        self.led_frame = px * 3
+
+        # None when it needs custom glyphs, those are encoded at runtime
+        try:
+            self.scroll_bytes = vfd.encode(scroll_text_for(self.scroll_text))
+        except UnicodeEncodeError:
+            self.scroll_bytes = None
+
+        # a missing or broken image only costs the image, not the game's look
+        ascii_file = cfg.get('ascii_file')
+        self.vfd_image = None
+        if ascii_file:
+            try:
+                self.vfd_image = load_vfd_image(ascii_file)
+            except Exception as e:
+                logging.error(f"'{key}': can't load ascii_file {ascii_file}: {e}")
+
+        anim = cfg.get('ascii_animation')
+        self.animation_fps = cfg.get('ascii_animation_fps', 10)
+        self.animation = None
+        if anim:
+            try:
+                if isinstance(anim, (list, tuple)):
+                    w, h, frames = vfd_animation.load_frame_sequence(anim)
+                else:
+                    w, h, frames = vfd_animation.load_sprite_sheet(anim)
+                self.animation = vfd_animation.FrameCache(w, h, frames)
+            except Exception as e:
+                logging.error(f"'{key}': can't load ascii_animation {anim}: {e}")
+
+class ConfigStore:
+    """
+    Loads games_config from a .json or .toml file (or the games_config dict
+    from gameconfig.py if there's no file), validates every entry and
+    compiles it once.
+
+    poll() reloads when the file's mtime changes. Only entries whose config
+    changed are recompiled; a broken entry keeps its previous version. The
+    running effect is left alone, changes show up on the next game switch.
+    """
+    def __init__(self, path, fallback_config, possible_effects, leds, vfd, scroll_text_for):
+        self.path = path
+        self.possible_effects = possible_effects
+        self._leds = leds
+        self._vfd = vfd
+        self._scroll_text_for = scroll_text_for
+        self._mtime = None
+        self.games = {}
+        self.index = ConfigIndex({})
+        self.reloads = 0
+        # a file that's broken at startup leaves gameconfig.py in charge
+        # until it's fixed
+        if not (path and os.path.exists(path) and self.poll()):
+            self._update(fallback_config)
+
+    def _read(self):
+        if self.path.lower().endswith(".toml"):
+            if tomllib is None:
+                raise ValueError("TOML game configs need python 3.11+")
+            with open(self.path, "rb") as f:
+                return tomllib.load(f)
+        with open(self.path, "r", encoding='utf-8') as f:
+            return json.load(f)
+
+    def poll(self) -> bool:
+        """
+        Reload if the file changed. Returns True if anything was reloaded.
+        """
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            raw = self._read()
+            if not isinstance(raw, dict):
+                raise ValueError(f"expected an object of games, got {type(raw).__name__}")
+        except Exception as e:
+            logging.error(f"Error reading game config {self.path}: {e}")
+            return False
+        changed = self._update(raw)
+        self.reloads += 1
+        logging.info(f"Game config loaded from {self.path}: {len(self.games)} games, {changed} recompiled")
+        return True
+
+    def _update(self, raw):
+        games = {}
+        changed = 0
+        for key, cfg in raw.items():
+            old = self.games.get(key)
+            if old is not None and old.cfg == cfg:
+                games[key] = old
+                continue
+            try:
+                validate_game(key, cfg, self.possible_effects)
+                games[key] = CompiledGame(key, cfg, self._leds, self._vfd, self._scroll_text_for)
+                changed += 1
+            except Exception as e:
+                logging.error(f"Invalid game config {e}")
+                if old is not None:
+                    games[key] = old
+        self.games = games
+        self.index = ConfigIndex({key: game.cfg for key, game in games.items()})
+        return changed
+
+    def get(self, key):
+        return self.games.get(key)
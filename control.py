@@ -0,0 +1,219 @@
+import os
+import sys
+import socket
+import struct
+import logging
+from threading import Thread
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client, deliver_challenge, answer_challenge
+
+###############################################################################
+# Local control API
+###############################################################################
+# One command per message, UTF-8, words separated by spaces:
+#
+#   game <config key or exe>       switch now and stay there
+#   game auto                      back to process detection
+#   effect <name> [r,g,b] [r,g,b]  LED effect until the next game switch
+#   text [message...]              VFD scroll text until the next game switch
+#   overlay blink [r,g,b] [secs]   flash the LEDs
+#   overlay text <secs> <message>  show a message, then the game's text again
+#   status                         current game
+#
+# The reply is "ok [...]" or "error <why>" as soon as the command is
+# checked and queued; the serial work happens after.
+#
+#   python control.py game sf6.exe
+#   python control.py overlay text 5 Player 2 joined
+#
+# Windows uses a named pipe, everything else a Unix socket only its user
+# can open. Connections go through multiprocessing.connection with an
+# authkey, the random secret in KEY_FILE: the daemon creates it readable
+# by its user only, clients read it from there.
+if sys.platform == 'win32':
+    DEFAULT_ADDRESS = r'\\.\pipe\pras3-control'
+else:
+    DEFAULT_ADDRESS = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp',
+                                   f'pras3-control-{os.getuid()}.sock')
+KEY_FILE = os.path.join(os.path.expanduser("~"), ".pras3_control_key")
+
+MAX_MESSAGE = 4096
+HANDSHAKE_TIMEOUT = 2.0  # seconds a client gets to prove it has the key
+
+def parse_color(s):
+    try:
+        color = [int(c) for c in s.split(",")]
+    except ValueError:
+        color = None
+    if not color or len(color) != 3 or not all(0 <= c <= 255 for c in color):
+        raise ValueError(f"bad color '{s}', expected r,g,b with values 0-255")
+    return color
+
+def parse_seconds(s):
+    try:
+        seconds = float(s)
+    except ValueError:
+        seconds = -1
+    if not 0 < seconds <= 3600:
+        raise ValueError(f"bad duration '{s}'")
+    return seconds
+
+def parse(message, effects=()):
+    """
+    message => (verb, args). Raises ValueError if it isn't a valid command.
+    """
+    words = message.strip().split(" ")
+    verb, args = words[0], [w for w in words[1:] if w]
+    if verb == 'game':
+        if len(args) != 1:
+            # exe names with spaces
+            if not args:
+                raise ValueError("usage: game <name>|auto")
+            args = [" ".join(args)]
+        return verb, (args[0],)
+    if verb == 'effect':
+        if not args or args[0] not in effects:
+            raise ValueError(f"usage: effect <{'|'.join(effects)}> [r,g,b] [r,g,b]")
+        c1 = parse_color(args[1]) if len(args) > 1 else [255, 255, 255]
+        c2 = parse_color(args[2]) if len(args) > 2 else [0, 0, 0]
+        return verb, (args[0], c1, c2)
+    if verb == 'text':
+        return verb, (message.strip()[len('text'):].strip(),)
+    if verb == 'overlay':
+        if args and args[0] == 'blink':
+            color = parse_color(args[1]) if len(args) > 1 else [255, 255, 255]
+            seconds = parse_seconds(args[2]) if len(args) > 2 else 0.3
+            return verb, ('blink', color, seconds)
+        if len(args) >= 3 and args[0] == 'text':
+            return verb, ('text', parse_seconds(args[1]), " ".join(args[2:]))
+        raise ValueError("usage: overlay blink [r,g,b] [secs] | overlay text <secs> <message>")
+    if verb == 'status':
+        return verb, ()
+    raise ValueError(f"unknown command '{verb}'")
+
+def load_authkey(path=KEY_FILE, create=False):
+    """The control API secret, made (mode 0600) first if create is set."""
+    if create and not os.path.exists(path):
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(os.urandom(32).hex().encode('ascii'))
+    with open(path, "rb") as f:
+        return f.read().strip()
+
+class ControlServer:
+    """
+    Listens on address and hands every valid command to
+    on_command(verb, args), which has to return quickly (queue the work).
+    status() gives the text for "ok" replies to the status command.
+    authkey: clients have to prove they know it, see load_authkey(). The
+    handshake runs in the connection's own thread, under HANDSHAKE_TIMEOUT
+    on Unix sockets, so a client that connects and hangs can't hold up
+    the others.
+    """
+    def __init__(self, address, on_command, effects=(), status=None, authkey=None):
+        self.address = address
+        self.on_command = on_command
+        self.effects = effects
+        self.status = status
+        self.commands = 0
+        self.errors = 0
+        self.rejected = 0
+        self.authkey = authkey
+        self.is_pipe = address.startswith('\\\\')
+        if not self.is_pipe and os.path.exists(address):
+            os.unlink(address)  # left over from a previous run
+        # no authkey here: Listener would run the handshake in accept()
+        self._listener = Listener(address)
+        if not self.is_pipe:
+            os.chmod(address, 0o600)
+
+    def start(self):
+        Thread(target=self._accept, name="control", daemon=True).start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn = self._listener.accept()
+            except OSError as e:
+                logging.error(f"Control API accept failed: {e}")
+                return
+            Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _authenticate(self, conn):
+        # named pipes have no timeout, a silent client only keeps its own thread
+        sock = None if self.is_pipe else socket.fromfd(conn.fileno(), socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            if sock:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, _timeval(HANDSHAKE_TIMEOUT))
+            deliver_challenge(conn, self.authkey)
+            answer_challenge(conn, self.authkey)
+            if sock:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVTIMEO, _timeval(0))
+            return True
+        except (AuthenticationError, EOFError, OSError):
+            # OSError: the timeout, the read fails with EAGAIN
+            return False
+        finally:
+            if sock:
+                sock.close()
+
+    def _serve(self, conn):
+        with conn:
+            if self.authkey is not None and not self._authenticate(conn):
+                self.rejected += 1
+                return
+            while True:
+                try:
+                    message = conn.recv_bytes(MAX_MESSAGE).decode('utf-8')
+                except (EOFError, OSError):
+                    return
+                conn.send_bytes(self.handle(message).encode('utf-8'))
+
+    def handle(self, message):
+        "Returns the reply."
+        try:
+            verb, args = parse(message, self.effects)
+        except (ValueError, UnicodeError) as e:
+            self.errors += 1
+            return f"error {e}"
+        self.commands += 1
+        if verb == 'status':
+            return f"ok {self.status() if self.status else ''}".rstrip()
+        self.on_command(verb, args)
+        return "ok"
+
+    def close(self):
+        self._listener.close()
+
+def _timeval(seconds):
+    return struct.pack("ll", int(seconds), int(seconds % 1 * 1e6))
+
+def send(message, address=DEFAULT_ADDRESS, authkey=None):
+    """Send one command, returns the reply."""
+    with Client(address, authkey=authkey) as conn:
+        conn.send_bytes(message.encode('utf-8'))
+        return conn.recv_bytes().decode('utf-8')
+
+USAGE = """usage: python control.py <command> [args...]
+
+  game <config key or exe>       switch now and stay there
+  game auto                      back to process detection
+  effect <name> [r,g,b] [r,g,b]  LED effect until the next game switch
+  text [message...]              VFD scroll text until the next game switch
+  overlay blink [r,g,b] [secs]   flash the LEDs
+  overlay text <secs> <message>  show a message, then the game's text again
+  status                         current game
+
+PRAS3_CONTROL overrides the address (default {address})."""
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] in ('-h', '--help'):
+        print(USAGE.format(address=DEFAULT_ADDRESS))
+        sys.exit(0 if len(sys.argv) >= 2 else 2)
+    try:
+        authkey = load_authkey()
+    except OSError as e:
+        sys.exit(f"Can't read the control key ({e}), is the daemon running as this user?")
+    reply = send(" ".join(sys.argv[1:]), os.environ.get("PRAS3_CONTROL", DEFAULT_ADDRESS), authkey)
+    print(reply)
+    sys.exit(0 if reply.startswith("ok") else 1)
@@ -29,7 +29,10 @@ def color_sine_effect(num_leds, step, color1, color2, width, reverse=True):
         full_data = data + mirrored_data
     return bytes(full_data)
 
-def animate(leds: LEDs, color1, color2, stop_event=None, speed=0.05, width=5, resolution=0.1):
+def animate(leds: LEDs, color1, color2, stop_event=None, speed=0.05, width=5, resolution=0.1, clock=None):
+    """
+    clock: shared clock of a multi-cabinet group (sync.EffectClock).
+    """
     num_leds = 22
     step = 0.0
     max_step = width * 2
@@ -38,12 +41,21 @@ def animate(leds: LEDs, color1, color2, stop_event=None, speed=0.05, width=5, re
     while True:
         if stop_event and stop_event.is_set():
             break
+        render_start = time.perf_counter()
+        if clock:
+            step = (clock.frame(speed) * resolution) % max_step
 
         pixels = color_sine_effect(num_leds, step, color1, color2, width)
         # Remap to cabinet LED order
         pixels = leds.remap_pixels(leds.NORMAL_MAPPING, pixels)
+        leds.frame_rendered(render_start)
         leds.fade_to_pixels(pixels)
-        time.sleep(speed)
+        sleep_start = time.perf_counter()
+        if clock:
+            clock.wait_next(speed, stop_event)
+        else:
+            time.sleep(speed)
+        leds.trace("sleep", sleep_start)
         step += resolution
         if step >= max_step:
             step = 0.0
@@ -3,13 +3,21 @@
 # This file is in the public domain.
 #
 import argparse
+import bisect
+import itertools
+import json
+import mmap
 import os
 import serial
+import socket
+import stat
 import struct
 import sys
 import time
 import platform
+import threading
 
+from contextlib import contextmanager
 from enum import IntEnum
 from typing import List, Tuple
 
@@ -59,6 +67,267 @@ def unescape_bytes(b: bytes) -> bytes:
 class PRas3Exception(Exception):
     pass
 
+class Histogram:
+    """
+    Fixed-bucket histogram, cumulative like Prometheus wants it.
+    buckets are the upper bounds in seconds, +Inf is implied.
+    """
+    LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        "[(upper bound, count <= bound)], the last bound is inf"
+        result = []
+        total = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            total += n
+            result.append((bound, total))
+        return result
+
+class DeviceStats:
+    """
+    Counters for one device. Plain ints, updated from the write path
+    without locking; a reader may see them a write apart, that's fine
+    for metrics.
+
+      bytes_written  - bytes that made it to the port
+      writes         - port writes (a batch is one write)
+      commands       - commands issued, batched or not
+      frames         - full LED frames / VFD bitmaps
+      errors         - failed writes (timeouts, port errors)
+      payload_bytes  - command bytes before escaping
+      escaped_bytes  - the same after escaping, see expansion
+      dropped_frames - frames skipped by whoever is driving the device
+      write_latency  - seconds spent in each port write
+      render_time    - seconds effects spent building each frame
+    """
+    def __init__(self):
+        self.bytes_written = 0
+        self.writes = 0
+        self.commands = 0
+        self.frames = 0
+        self.errors = 0
+        self.payload_bytes = 0
+        self.escaped_bytes = 0
+        self.dropped_frames = 0
+        self.write_latency = Histogram()
+        self.render_time = Histogram()
+
+    @property
+    def expansion(self) -> float:
+        "Escaped size / raw size of everything escaped so far."
+        if not self.payload_bytes:
+            return 1.0
+        return self.escaped_bytes / self.payload_bytes
+
+    def escaped(self, raw: bytes) -> bytes:
+        "escape_bytes() that keeps count"
+        b = escape_bytes(raw)
+        self.payload_bytes += len(raw)
+        self.escaped_bytes += len(b)
+        return b
+
+class FrameTracer:
+    """
+    Keeps the last `size` spans (render, remap, encode, write, sleep...) in
+    a ring buffer and dumps them as Chrome trace JSON, which opens in
+    chrome://tracing or ui.perfetto.dev.
+
+        leds.tracer = FrameTracer()
+        ...
+        leds.tracer.dump("trace.json")
+
+    Devices only pay for an `is not None` check when no tracer is set.
+    """
+    def __init__(self, size=16384):
+        self.size = size
+        self._spans = [None] * size
+        self._next = itertools.count()  # next() on it is atomic
+        self._threads = {}
+
+    def span(self, name, start, end, category=""):
+        "start/end are time.perf_counter() values"
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        self._spans[next(self._next) % self.size] = (name, category, start, end, tid)
+
+    def events(self):
+        spans = [s for s in self._spans if s is not None]
+        spans.sort(key=lambda s: s[2])
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in list(self._threads.items())]
+        for name, category, start, end, tid in spans:
+            events.append({"name": name, "cat": category, "ph": "X", "pid": pid, "tid": tid,
+                           "ts": start * 1e6, "dur": (end - start) * 1e6})
+        return events
+
+    def dumps(self) -> str:
+        return json.dumps({"traceEvents": self.events(), "displayTimeUnit": "ms"})
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            f.write(self.dumps())
+
+class SerialDevice:
+    """
+    Common write path for the devices.
+
+    Inside a batch() block commands are collected and sent with a single
+    write when the block ends, so there are no gaps between them.
+
+        with vfd.batch():
+            vfd.set_text_window(0, 2, 160)
+            vfd.set_brightness(4)
+
+    Ports are opened with write and read timeouts. A write that times out
+    (e.g. the VFD holding off CTS forever) marks the device as stalled:
+    from then on writes are dropped instead of blocking, and every
+    reopen_interval seconds the port is reopened and tried again. When a
+    write goes through the device is back and on_recover() is called so
+    the owner can restore its state.
+
+    Every device keeps a DeviceStats in .stats, and records spans to
+    .tracer when one is set. port_wrapper, if set, wraps every port
+    opened (used for capturing traffic), see set_port_wrapper().
+    """
+    _batch = None
+    tracer = None
+    port_wrapper = None
+
+    def trace(self, name, start):
+        "Record a span from start (time.perf_counter()) until now, if tracing."
+        if self.tracer is not None:
+            self.tracer.span(name, start, time.perf_counter(), type(self).__name__)
+
+    def frame_rendered(self, start):
+        "Called by effects once a frame is built, start is when they began."
+        self.stats.render_time.observe(time.perf_counter() - start)
+        self.trace("render", start)
+
+    def _open(self, port, baudrate, write_timeout=2.0, timeout=1.0, reopen_interval=5.0, **kwargs):
+        self._port_args = (port, baudrate, dict(kwargs, write_timeout=write_timeout, timeout=timeout))
+        self.reopen_interval = reopen_interval
+        self.on_recover = None
+        self.stall_count = 0
+        self.reopen_count = 0
+        self.dropped_writes = 0
+        self.last_stall_reason = None
+        self._stalled_since = None
+        self._stalled_total = 0.0
+        self._last_reopen = 0.0
+        self.stats = DeviceStats()
+        self._ser = self._connect()
+
+    def _connect(self):
+        port, baudrate, kwargs = self._port_args
+        ser = serial.Serial(port, baudrate, **kwargs)
+        if self.port_wrapper is not None:
+            ser = self.port_wrapper(ser)
+        return ser
+
+    def set_port_wrapper(self, wrapper):
+        """
+        wrapper(port) => object with the same interface. Applied to the open
+        port now and to every reopened one.
+        """
+        self.port_wrapper = wrapper
+        self._ser = wrapper(self._ser)
+
+    @property
+    def stalled(self) -> bool:
+        return self._stalled_since is not None
+
+    @property
+    def stalled_time(self) -> float:
+        "Total seconds spent stalled, including the current stall."
+        if self._stalled_since is None:
+            return self._stalled_total
+        return self._stalled_total + time.monotonic() - self._stalled_since
+
+    def _stall(self, reason):
+        self.last_stall_reason = reason
+        if self._stalled_since is None:
+            self._stalled_since = time.monotonic()
+            self._last_reopen = self._stalled_since
+            self.stall_count += 1
+        self.dropped_writes += 1
+
+    def _reopen(self) -> bool:
+        self._last_reopen = time.monotonic()
+        self.reopen_count += 1
+        try:
+            self._ser.close()
+        except serial.SerialException:
+            pass
+        try:
+            self._ser = self._connect()
+            self._ser.reset_output_buffer()
+        except serial.SerialException:
+            return False
+        return True
+
+    def _send(self, b: bytes):
+        if self._stalled_since is not None:
+            if time.monotonic() - self._last_reopen < self.reopen_interval or not self._reopen():
+                self.dropped_writes += 1
+                return
+        stats = self.stats
+        start = time.perf_counter()
+        try:
+            self._ser.write(b)
+        except serial.SerialTimeoutException:
+            stats.errors += 1
+            self._stall("write timeout")
+            return
+        except serial.SerialException:
+            stats.errors += 1
+            self._stall("port error")
+            return
+        stats.write_latency.observe(time.perf_counter() - start)
+        self.trace("write", start)
+        stats.writes += 1
+        stats.bytes_written += len(b)
+        if self._stalled_since is not None:
+            self._stalled_total += time.monotonic() - self._stalled_since
+            self._stalled_since = None
+            if self.on_recover:
+                self.on_recover(self)
+
+    def _write(self, b: bytes):
+        self.stats.commands += 1
+        if self._batch is not None:
+            self._batch += b
+        else:
+            self._send(b)
+
+    @contextmanager
+    def batch(self):
+        if self._batch is not None:
+            # already batching, the outer block does the write
+            yield self
+            return
+        self._batch = bytearray()
+        try:
+            yield self
+        except BaseException:
+            self._batch = None
+            raise
+        buf, self._batch = self._batch, None
+        if buf:
+            self._send(bytes(buf))
+
 # NFC
 #
 # Code to control a SEGA 837-15396/610-0955 NFC reader/writer.
@@ -216,7 +485,7 @@ class PRas3Exception(Exception):
 #     ...
 # (unfinished)
 
-class NFC:
+class NFC(SerialDevice):
     """
     Be aware that you might need to put some sleeps between calling
     various commands. If you go too fast you'll get errors back.
@@ -227,19 +496,21 @@ class NFC:
         MIFARE = 1
         FeliCa = 2
 
-    def __init__(self, port: str = None) -> None:
+    def __init__(self, port: str = None, write_timeout: float = 2.0, timeout: float = 1.0) -> None:
         if port is None:
             port = 'COM3' if platform.system() == 'Windows' else '/dev/ttyS2'
-        self._ser = serial.Serial(port, 115200)
+        self._open(port, 115200, write_timeout=write_timeout, timeout=timeout)
         self._seq = 0
 
     def _build_cmd(self, cmd: int, payload: bytes) -> bytes:
+        start = time.perf_counter()
         addr = 0
         self._seq += 1
         buf = struct.pack("BBBB", addr, self._seq, cmd, len(payload)) + payload
         buf = struct.pack("B", len(buf) + 1) + buf # +1 for checksum
         checksum = struct.pack("B", sum(buf) % 256)
-        buf = b'\xe0' + escape_bytes(buf + checksum)
+        buf = b'\xe0' + self.stats.escaped(buf + checksum)
+        self.trace("encode", start)
         return buf
 
     def _get_response(self, debug: bool=False) -> bytes:
@@ -251,6 +522,8 @@ class NFC:
         # With all fields being one byte except for the payload.
 
         sync = self._ser.read(1)
+        if not sync:
+            raise PRas3Exception("Timed out waiting for response")
         assert(sync == b'\xe0')
         l = self._ser.read(1)
         l = struct.unpack("B", l)[0]
@@ -281,18 +554,18 @@ class NFC:
         Need to call this after power on before you can do anything.
         Will give an error if given any other time.
         """
-        self._ser.write(self._build_cmd(0x62, b''))
+        self._write(self._build_cmd(0x62, b''))
         self._get_response()
 
     def get_firmware_version(self) -> bytes:
         # response: 0x94
-        self._ser.write(self._build_cmd(0x30, b''))
+        self._write(self._build_cmd(0x30, b''))
         payload = self._get_response()
         return payload
 
     def get_hardware_version(self) -> bytes:
         # response: "837-15396" (version 3?)
-        self._ser.write(self._build_cmd(0x32, b''))
+        self._write(self._build_cmd(0x32, b''))
         payload = self._get_response()
         return payload
 
@@ -303,12 +576,12 @@ class NFC:
         # You can technically scan for both at the same time by OR-ing them
         # together but we're not messing with that here.
         assert card_type == NFC.CardType.MIFARE or card_type == NFC.CardType.FeliCa
-        self._ser.write(self._build_cmd(0x40, struct.pack("B", card_type)))
+        self._write(self._build_cmd(0x40, struct.pack("B", card_type)))
         self._get_response()
 
     def radio_off(self) -> None:
         "Turn the radio off when you're done. Not super important but let's be nice"
-        self._ser.write(self._build_cmd(0x41, b''))
+        self._write(self._build_cmd(0x41, b''))
         self._get_response()
 
     def poll(self) -> List[Tuple[CardType, bytes]]:
@@ -319,7 +592,7 @@ class NFC:
         If you call this too fast you'll get an error back.
         """
         time.sleep(.15)
-        self._ser.write(self._build_cmd(0x42, b''))
+        self._write(self._build_cmd(0x42, b''))
         buf = self._get_response()
         if len(buf) == 0:
             return []
@@ -355,14 +628,14 @@ class NFC:
         # need to truncate the UID before sending. This is
         # what the firmware does internally in 0x44.
         if len(uid) == 4:
-            self._ser.write(self._build_cmd(0x43, uid))
+            self._write(self._build_cmd(0x43, uid))
         else:
-            self._ser.write(self._build_cmd(0x44, uid))
+            self._write(self._build_cmd(0x44, uid))
         self._get_response()
 
     def MIFARE_set_key_A(self, key: bytes) -> None:
         assert len(key) == 6
-        self._ser.write(self._build_cmd(0x54, key))
+        self._write(self._build_cmd(0x54, key))
         self._get_response()
 
     def MIFARE_authenticate_key_A(self, uid: bytes, block: int) -> None:
@@ -382,12 +655,12 @@ class NFC:
         # If key B is not needed, the last 6 bytes of the trailer can be used as data bytes.
         # layout: key A | access bits | key B
         # sector 0 block 0 contains manufacturer data.
-        self._ser.write(self._build_cmd(0x55, uid[:4] + struct.pack("B", block)))
+        self._write(self._build_cmd(0x55, uid[:4] + struct.pack("B", block)))
         self._get_response()
 
     def MIFARE_set_key_B(self, key: bytes) -> None:
         assert len(key) == 6
-        self._ser.write(self._build_cmd(0x50, key))
+        self._write(self._build_cmd(0x50, key))
         self._get_response()
 
     def MIFARE_authenticate_key_B(self, uid: bytes, block: int) -> None:
@@ -395,18 +668,18 @@ class NFC:
         Select the card and authenticate against the block of interest with key B.
         You need to set key B before calling this.
         """
-        self._ser.write(self._build_cmd(0x51, uid[:4] + struct.pack("B", block)))
+        self._write(self._build_cmd(0x51, uid[:4] + struct.pack("B", block)))
         self._get_response()
 
     def MIFARE_read_block(self, uid: bytes, block: int) -> bytes:
         "Reads a 16 byte block from the card given at the block address given"
-        self._ser.write(self._build_cmd(0x52, uid[:4] + struct.pack("B", block)))
+        self._write(self._build_cmd(0x52, uid[:4] + struct.pack("B", block)))
         payload = self._get_response()
         return payload
 
     def MIFARE_write_block(self, uid: bytes, block: int, block_data: bytes) -> None:
         assert len(block_data) == 16
-        self._ser.write(self._build_cmd(0x53, uid[:4] + struct.pack("B", block) + block_data))
+        self._write(self._build_cmd(0x53, uid[:4] + struct.pack("B", block) + block_data))
         self._get_response()
 
     def LED_set_channels(self, intensity, r: bool=False, g: bool=False, b: bool=False) -> None:
@@ -415,16 +688,16 @@ class NFC:
         Other channels are left unchanged.
         """
         bits = (1 if r else 0) | (2 if g else 0) | (4 if b else 0)
-        self._ser.write(self._build_cmd(0x80, struct.pack("BB", bits, intensity)))
+        self._write(self._build_cmd(0x80, struct.pack("BB", bits, intensity)))
         # no reply
 
     def LED_set_color(self, r: int, g: int, b: int) -> None:
         "Sets the color of the LEDs. All values are [0-255]"
-        self._ser.write(self._build_cmd(0x81, struct.pack("BBB", r, g, b)))
+        self._write(self._build_cmd(0x81, struct.pack("BBB", r, g, b)))
         # no reply
 
     def LED_get_info(self) -> bytes:
-        self._ser.write(self._build_cmd(0xf0, b''))
+        self._write(self._build_cmd(0xf0, b''))
         payload = self._get_response()
         return payload
 
@@ -444,9 +717,10 @@ class NFC:
 #
 # Reply format is the same except for the payload structure:
 # payload structure
-# ,--------,-----,---~         ~----------,
-# | status | cmd | optional response data |
-# '--------'-----'---~         ~----------'
+# ,--------,-----,--------,---~         ~----------,
+# | status | cmd | report | optional response data |
+# '--------'-----'--------'---~         ~----------'
+# The reply's dst is the command's src and its src the board's node id.
 #
 # 22 pixels in the whole machine
 # pixel buffer has enough space for three "pages" of pixels
@@ -461,81 +735,104 @@ class NFC:
 # 2                        13
 #   3 4 5 6 7 8 9 10 11 12
 
-class LEDs:
+class LEDs(SerialDevice):
     #                  0   1   2   3   4   5   6   7   8   9  10  11  12  13  14  15  16  17  18  19  20  21]
     LED_MAPPING    = [16, 17, 18,  0,  1,  2,  3,  4,  5,  6,  7,  8,  9, 10, 11, 12, 13, 14, 15, 19, 20, 21]
     NORMAL_MAPPING = [ 3,  4,  5,  6,  7,  8,  9, 10, 11, 12, 13, 14, 15, 16, 17, 18,  0,  1,  2, 19, 20, 21]
-    def __init__(self, port=None):
+    def __init__(self, port=None, write_timeout=2.0, timeout=1.0, dst_node_id=0, src_node_id=0):
+        """
+        dst_node_id: board the commands go to. 0 acts like a wildcard, every
+                     board on the port takes them whatever its real node id.
+        src_node_id: 0 silences replies. If you want replies (read them with
+                     read_reply()) set this to a non-zero id no board has.
+        Both can be changed between commands to talk to several boards
+        sharing a port.
+        """
         if port is None:
             port = "COM2" if platform.system() == "Windows" else "/dev/ttyS1"
-        self._ser = serial.Serial(port, 115200)
+        self.dst_node_id = dst_node_id
+        self.src_node_id = src_node_id
+        self._open(port, 115200, write_timeout=write_timeout, timeout=timeout)
 
     def _build_cmd(self, cmd: int, payload: bytes):
-        # A destination of 0 acts like a wildcard. It won't matter what the real node id is
-        # for the LEDs.
-        dst_node_id = 0
-        # Setting a source id of 0 silences replies.
-        # If you want to get replies you need to set this to a non-zero value.
-        src_node_id = 0
-        buf = struct.pack("BBBB", dst_node_id, src_node_id, len(payload) + 1, cmd) + payload
+        start = time.perf_counter()
+        buf = struct.pack("BBBB", self.dst_node_id, self.src_node_id, len(payload) + 1, cmd) + payload
         checksum = struct.pack("B", sum(buf) % 256)
-        buf = b'\xe0' + escape_bytes(buf + checksum)
+        buf = b'\xe0' + self.stats.escaped(buf + checksum)
+        self.trace("encode", start)
         return buf
 
-    def _get_response(self, debug: bool=False) -> bytes:
-        "Reads a response and extracts the payload and status byte."
-        # The structure of a response is:
-        #
-        # 0xe0 | dst node | src node | payload len | n-byte payload | checksum
-        #
-        # With all fields being one byte except for the payload.
-
-        sync = self._ser.read(1)
-        assert(sync == b'\xe0')
-        l = self._ser.read(1)
-        l = struct.unpack("B", l)[0]
-        buf = b''
-        for i in range(3):
+    def _read_unescaped(self, n: int) -> bytes:
+        buf = bytearray()
+        while len(buf) < n:
             b = self._ser.read(1)
             if b == b'\xd0':
                 b = self._ser.read(1)
-                b = bytes([struct.unpack("B",b)[0] + 1])
+                if b:
+                    b = bytes([b[0] + 1])
+            if not b:
+                raise PRas3Exception("Timed out waiting for response")
             buf += b
+        return bytes(buf)
 
-        dst, src, payload_length = struct.unpack("BBB", buf)
-
-        payload = self._ser.read(payload_length)
-        checksum = struct.unpack("B" , self._ser.read(1))
-        payload = unescape_bytes(payload)
-
-        status, cmd = struct.payload("BB", payload[:2])
-        payload_body = payload[2:]
+    def read_reply(self):
+        """
+        Reads a reply, only sent for commands with a non-zero src_node_id.
+        returns: (node id of the board that replied, cmd, response data)
+        """
+        # The structure of a response is:
+        #
+        # 0xe0 | dst node | src node | payload len | status | cmd | report | data | checksum
+        #
+        # With all fields being one byte except for the data, escaped like commands.
+        sync = self._ser.read(1)
+        if not sync:
+            raise PRas3Exception("Timed out waiting for response")
+        if sync != b'\xe0':
+            raise PRas3Exception(f"Bad sync byte in response: {sync.hex()}")
+        header = self._read_unescaped(3)
+        dst, src, payload_length = header
+        body = self._read_unescaped(payload_length + 1)
+        payload, checksum = body[:-1], body[-1]
+        if (sum(header) + sum(payload)) % 256 != checksum:
+            raise PRas3Exception("Bad checksum in response")
+        if payload_length < 3:
+            raise PRas3Exception(f"Response too short: {payload.hex()}")
+        status, cmd, report = payload[:3]
         if status != 1:
             raise PRas3Exception(f"Got error response: {status}")
+        return src, cmd, payload[3:]
+
+    def _get_response(self, debug: bool=False) -> bytes:
+        "Reads a response and extracts the payload."
+        src, cmd, payload_body = self.read_reply()
         if debug:
-            print(f"src:{src:02x} dst:{dst:02x} cmd:{cmd:02x} "
-                f"status:{status:02x} payload len:{payload_length:02x} payload:{payload_body.hex()}")
+            print(f"src:{src:02x} cmd:{cmd:02x} payload:{payload_body.hex()}")
         return payload_body
 
     def build_pixels(self, left_color: Color, center_color: Color, right_color: Color) -> bytes:
         """
         Constructs a single screen's worth of pixels (22 pixels)
         """
+        start = time.perf_counter()
         pixels = left_color.to_bytes() * 6 + center_color.to_bytes() * 10 + right_color.to_bytes() * 6
         mapped = b''
         for i in range(22):
             pixel_i = self.NORMAL_MAPPING[i] * 3
             mapped += pixels[pixel_i:pixel_i + 3]
+        self.trace("remap", start)
         return mapped
         
     def remap_pixels(self, mapping, pixel_bytes):
         """
         remaps bytes to correct pixel order
         """
+        start = time.perf_counter()
         mapped = b''
         for i in range(22):
             pixel_i = mapping[i] * 3
             mapped += pixel_bytes[pixel_i:pixel_i + 3]
+        self.trace("remap", start)
         return mapped
 
     # Unknown commands
@@ -548,7 +845,7 @@ class LEDs:
         Resets all the settings.
         """
         # arg0: must be 217
-        self._ser.write(self._build_cmd(0x10, struct.pack("B", 217)))
+        self._write(self._build_cmd(0x10, struct.pack("B", 217)))
 
     def set_silent(self, is_silent):
         """
@@ -558,7 +855,7 @@ class LEDs:
         """
         # arg0: <optional> enable or disable silent mode
         # not passing an argument will just get the current mode sent back.
-        self._ser.write(self._build_cmd(0x14, struct.pack("B", is_silent)))
+        self._write(self._build_cmd(0x14, struct.pack("B", is_silent)))
 
     def set_node_id(self, node_id):
         """
@@ -567,14 +864,14 @@ class LEDs:
         node_id: (must be < 0x7f) Only 3 lsb used.
         """
         assert node_id < 8 and node_id >= 0
-        self._ser.write(self._build_cmd(0x18, struct.pack("B", node_id)))
+        self._write(self._build_cmd(0x18, struct.pack("B", node_id)))
 
     def draw_pixels(self):
         """
         Just draws the pixels already in the buffer.
         see: set_pixels
         """
-        self._ser.write(self._build_cmd(0x80, b''))
+        self._write(self._build_cmd(0x80, b''))
 
     def set_pixels(self, pixel_buffer):
         """
@@ -582,21 +879,24 @@ class LEDs:
         see: draw_pixels
         """
         assert len(pixel_buffer) == 66*3
-        self._ser.write(self._build_cmd(0x81, pixel_buffer))
+        self.stats.frames += 1
+        self._write(self._build_cmd(0x81, pixel_buffer))
 
     def set_and_draw_pixels(self, pixel_buffer):
         """
         Immediately change to the pixel values sent.
         """
         #assert len(pixel_buffer) == 66*3
-        self._ser.write(self._build_cmd(0x82, pixel_buffer))
+        self.stats.frames += 1
+        self._write(self._build_cmd(0x82, pixel_buffer))
 
     def fade_to_pixels(self, pixel_buffer):
         """
         Fade to the pixels in the buffer.
         """
         #assert len(pixel_buffer) == 66*3
-        self._ser.write(self._build_cmd(0x83, pixel_buffer))
+        self.stats.frames += 1
+        self._write(self._build_cmd(0x83, pixel_buffer))
 
     def set_blend_timing(self, frame_count, frame_delay):
         """
@@ -610,38 +910,38 @@ class LEDs:
         # Send no arguments to get back the current values.
         assert frame_count > 0
         assert frame_delay > 0
-        self._ser.write(self._build_cmd(0x84, struct.pack("BB", frame_count, frame_delay)))
+        self._write(self._build_cmd(0x84, struct.pack("BB", frame_count, frame_delay)))
 
     def do_offset_blend(self, offset):
         # Blends all pixels with pixel + offset from itself.
         # Restricted by window size set with "set window size" command.
         assert offset < 0x42
-        self._ser.write(self._build_cmd(0x85, struct.pack("B", offset)))
+        self._write(self._build_cmd(0x85, struct.pack("B", offset)))
 
     def set_blend_window_size(self, size):
         # Any size not 20 or 26 will generate an error AND success response
         # but will not set the window size.
         assert size == 20 or size == 26
-        self._ser.write(self._build_cmd(0x86, struct.pack("B", size)))
+        self._write(self._build_cmd(0x86, struct.pack("B", size)))
 
     def set_blend_params(self, frame_count, offset):
-        self._ser.write(self._build_cmd(0x87, struct.pack("BB", frame_count, offset)))
+        self._write(self._build_cmd(0x87, struct.pack("BB", frame_count, offset)))
 
     def get_hw_name(self):
         # won't reply if dst_node_id is "alternate" (0) id
-        self._ser.write(self._build_cmd(0xf0, b''))
+        self._write(self._build_cmd(0xf0, b''))
 
     def get_board_state(self):
-        self._ser.write(self._build_cmd(0xf1, b''))
+        self._write(self._build_cmd(0xf1, b''))
 
     def get_code_checksum(self):
-        self._ser.write(self._build_cmd(0xf2, b''))
+        self._write(self._build_cmd(0xf2, b''))
 
     def enter_bootloader(self):
-        self._ser.write(self._build_cmd(0xfd, b''))
+        self._write(self._build_cmd(0xfd, b''))
 
 
-class VFD:
+class VFD(SerialDevice):
     """
     A class for controlling the Futaba GP1232A02A vacuum fluorescent display (VFD)
     that comes installed in the Sega P-RAS 3 arcade cabinet.
@@ -665,7 +965,7 @@ class VFD:
         SHIFT_JIS = 2
         KSC5601   = 3
 
-    def __init__(self, port=None):
+    def __init__(self, port=None, write_timeout=2.0, timeout=1.0):
         # Requires hardware control flow.
         # RTS: Request To Send
         # CTS: Clear To Send
@@ -676,10 +976,51 @@ class VFD:
         # bytesize = serial.EIGHTBITS
         if port is None:
             port = 'COM1' if platform.system() == 'Windows' else '/dev/ttyS0'
-        self._ser = serial.Serial(port, speed, rtscts=True)
+        # Without a write timeout a display that never raises CTS again
+        # would block the caller forever.
+        self._open(port, speed, write_timeout=write_timeout, timeout=timeout, rtscts=True)
         self._encoding = VFD.Encoding.SHIFT_JIS
-
-    def __encode(self, s: str):
+        # total time spent in wait_ready() and how often it gave up
+        self.ready_wait_time = 0.0
+        self.ready_timeouts = 0
+
+    def _cts(self) -> bool:
+        try:
+            return self._ser.cts
+        except OSError:
+            # no modem status lines (ptys, e.g. the emulator), out_waiting
+            # still shows the backpressure
+            return True
+
+    def wait_ready(self, timeout: float=1.0, settle: float=0.02) -> bool:
+        """
+        Block until everything written so far has left the output buffer
+        and the display has held CTS asserted for `settle` seconds, i.e. it
+        has taken the data and finished chewing on it (a reset drops CTS
+        for a while).
+        Returns False if that didn't happen within timeout.
+        """
+        start = time.monotonic()
+        ready_since = None
+        while True:
+            now = time.monotonic()
+            if self._ser.out_waiting == 0 and self._cts():
+                if ready_since is None:
+                    ready_since = now
+                if now - ready_since >= settle:
+                    # last bytes out of the UART too
+                    self._ser.flush()
+                    self.ready_wait_time += time.monotonic() - start
+                    return True
+            else:
+                ready_since = None
+            if now - start >= timeout:
+                self.ready_wait_time += now - start
+                self.ready_timeouts += 1
+                return False
+            time.sleep(0.002)
+
+    def encode(self, s: str):
         if self._encoding == VFD.Encoding.GB2312:
             return s.encode("GB2312")
         elif self._encoding == VFD.Encoding.BIG5:
@@ -697,7 +1038,7 @@ class VFD:
         cursor position. Drawing text automatically advances the cursor.
         """
         # 0x20 - 0xFF: text
-        self._ser.write(self.__encode(s))
+        self._write(self.encode(s))
 
     #
     # Commands starting with 0x1b (ESC):
@@ -710,7 +1051,7 @@ class VFD:
         # - 0xc: reset state
         #   - args = 0
         b = b'\x1b\x0b'
-        self._ser.write(b)
+        self._write(b)
         self._encoding = VFD.Encoding.SHIFT_JIS
 
     def clear_screen(self):
@@ -718,7 +1059,7 @@ class VFD:
         Clear the main screen.
         """
         b = b'\x1b\x0c'
-        self._ser.write(b)
+        self._write(b)
 
     def set_brightness(self, level: int):
         """
@@ -728,7 +1069,7 @@ class VFD:
         # - 0x20: ??
         #   - args = 1 : 0-4
         b = b'\x1b\x20' + struct.pack(">B", level)
-        self._ser.write(b)
+        self._write(b)
 
     def turn_on(self, on: bool):
         """
@@ -737,7 +1078,7 @@ class VFD:
         # - 0x21: turn screen on
         #   - args = 1 : 0 or 1
         b = b'\x1b\x21' + struct.pack(">B", on)
-        self._ser.write(b)
+        self._write(b)
 
     def set_window_h_scroll(self, x: int):
         """
@@ -748,7 +1089,7 @@ class VFD:
         #     x pos?
         assert x < 512
         b = b'\x1b\x22' + struct.pack(">H", x)
-        self._ser.write(b)
+        self._write(b)
 
     def draw_bitmap(self, x_start, y_start, w, h, bitmap):
         """
@@ -761,7 +1102,9 @@ class VFD:
         #   - args = 6
         #     x start u16-be
         #     y start u8
-        #     x end   u16-be
+        #     x end   u16-be (one past the last column, x start + width;
+        #             at x start 0 that's the width, which is what was
+        #             always sent before bitmaps got drawn at other x)
         #     y end   u8 (this one is checked "<" hence the "- 1"
         #     (then bitmap data)
         assert x_start < 512
@@ -770,9 +1113,10 @@ class VFD:
         assert y_start + h <= 4
         assert len(bitmap) == h * w
 
-        b = b'\x1b\x2e' + struct.pack(">HBHB", x_start, y_start, w, y_start + h - 1)
+        b = b'\x1b\x2e' + struct.pack(">HBHB", x_start, y_start, x_start + w, y_start + h - 1)
         b += bitmap
-        self._ser.write(b)
+        self.stats.frames += 1
+        self._write(b)
 
     def set_cursor_pos(self, x: int, y: int):
         """
@@ -785,7 +1129,7 @@ class VFD:
         #     y pos: u8
         assert x < 512 and y < 3
         b = b'\x1b\x30' + struct.pack(">HB", x, y)
-        self._ser.write(b)
+        self._write(b)
 
     def set_text_encoding(self, encoding: Encoding):
         """
@@ -801,7 +1145,7 @@ class VFD:
         assert encoding in range(4)
         self._encoding = encoding
         b = b'\x1b\x32' + struct.pack(">B", encoding.value)
-        self._ser.write(b)
+        self._write(b)
 
     def set_text_window(self, x, y, w):
         """
@@ -815,7 +1159,7 @@ class VFD:
         #     x end: u16-be
         #     <ignored>: u8
         b = b'\x1b\x40' + struct.pack(">HBHB", x, y, w, 0)
-        self._ser.write(b)
+        self._write(b)
 
     def set_text_scroll_speed(self, speed: int):
         """
@@ -827,20 +1171,24 @@ class VFD:
         #     y: u8
         assert speed in [0,1]
         b = b'\x1b\x41' + struct.pack(">B", speed)
-        self._ser.write(b)
+        self._write(b)
 
-    def write_scroll_text(self, chars: str):
+    def write_scroll_text(self, chars):
         """
         Write text into the scroll buffer.
+        chars can also be already encoded bytes, e.g. with custom
+        glyph codes substituted in (see load_8x16_char).
         """
         # - 0x50: draw chars into buffer
         #   - args = 1: 0x1-0x94 (148). Number of characters
         #     (then data... characters to draw)
         assert len(chars) > 0 and len(chars) < 0x95
-        # TODO: encode from string based on encoding
-        char_bytes = self.__encode(chars)
+        if isinstance(chars, bytes):
+            char_bytes = chars
+        else:
+            char_bytes = self.encode(chars)
         b = b'\x1b\x50' + struct.pack("B", len(char_bytes)) + char_bytes
-        self._ser.write(b)
+        self._write(b)
 
     def set_text_scroll(self, enable: bool):
         """
@@ -852,7 +1200,7 @@ class VFD:
             b = b'\x1b\x51'
         else:
             b = b'\x1b\x52'
-        self._ser.write(b)
+        self._write(b)
 
     def get_version(self):
         """
@@ -862,7 +1210,7 @@ class VFD:
         #   - args = 1
         #     arg0: byte. Must be 99
         b = b'\x1b\x5b' + struct.pack("B", 99)
-        self._ser.write(b)
+        self._write(b)
         return self._ser.read(7)
 
     def flip_xy(self, flip: bool):
@@ -874,13 +1222,13 @@ class VFD:
         #     arg0: byte 0x72 (114) or 0x6e (110)
         v = 114 if flip else 110
         b = b'\x1b\x5d' + struct.pack("B", v)
-        self._ser.write(b)
+        self._write(b)
 
     #
     # commands starting with 0x1a (NB):
     #
 
-    def load_16x16_char(self, index: int, text: str):
+    def load_16x16_char(self, index: int, bits: bytes):
         """
         Store a 16x16 character image into one of 16 slots.
         I have no idea how you indicate what character it
@@ -893,7 +1241,7 @@ class VFD:
         assert index in range(16)
         assert len(bits) == 32
         b = b'\x1a\xa3' + struct.pack("B", index) + bits
-        self._ser.write(b)
+        self._write(b)
 
     def load_8x16_char(self, index: int, char: int, bits: bytes):
         """
@@ -909,7 +1257,7 @@ class VFD:
         assert char <= 0xff
         assert len(bits) == 16
         b = b'\x1a\xa4' + struct.pack("BB", index, char) + bits
-        self._ser.write(b)
+        self._write(b)
 
     @classmethod
     def rotate_bitmap(self, b: bytes, width: int, height: int):
@@ -1037,8 +1385,112 @@ class VFD:
                 byte = 0
         return (width, height, result)
 
+    # _SPREAD[v] places bit (7 - k) of v into the lowest bit of byte k of a
+    # 64-bit big-endian int, so OR-ing 8 shifted rows transposes an 8x8 block.
+    _SPREAD = [sum(((v >> (7 - k)) & 1) << (8 * (7 - k)) for k in range(8)) for v in range(256)]
+
+    @classmethod
+    def transpose_rows(self, buf, offset: int, stride: int, width: int, height: int,
+                        bottom_up: bool=False, invert: bool=False):
+        """
+        Converts packed 1-bit rows (MSB is the leftmost pixel) straight into
+        the column-major layout used by draw_bitmap.
+        Height is padded up to a multiple of 8 with blank rows.
+        """
+        spread = self._SPREAD
+        col_bytes = (height + 7) // 8
+        out = bytearray(width * col_bytes)
+        mask = 0xff if invert else 0
+        for band in range(col_bytes):
+            rows = []
+            for r in range(8):
+                y = band * 8 + r
+                if y >= height:
+                    rows.append(None)
+                elif bottom_up:
+                    rows.append(offset + (height - 1 - y) * stride)
+                else:
+                    rows.append(offset + y * stride)
+            for byte_x in range((width + 7) // 8):
+                block = 0
+                for r in range(8):
+                    if rows[r] is not None:
+                        block |= spread[buf[rows[r] + byte_x] ^ mask] << (7 - r)
+                cols = block.to_bytes(8, "big")
+                x = byte_x * 8
+                n = min(8, width - x)
+                out[x * col_bytes + band:(x + n) * col_bytes:col_bytes] = cols[:n]
+        return bytes(out)
+
+    @classmethod
+    def load_pbm(self, buf):
+        """
+        Decode a binary PBM (P4) image. Black (1) pixels are lit.
+        returns: (width, height, column-major bytes)
+        """
+        assert buf[0:2] == b'P4', "not a binary PBM (P4) file"
+        pos = 2
+        fields = []
+        while len(fields) < 2:
+            c = buf[pos:pos + 1]
+            if c == b'#':
+                while buf[pos:pos + 1] not in (b'\n', b'\r', b''):
+                    pos += 1
+            elif c.isspace():
+                pos += 1
+            else:
+                start = pos
+                while buf[pos:pos + 1].isdigit():
+                    pos += 1
+                fields.append(int(buf[start:pos]))
+        # exactly one whitespace character before the raster
+        pos += 1
+        width, height = fields
+        stride = (width + 7) // 8
+        assert len(buf) >= pos + stride * height, "truncated PBM file"
+        image = self.transpose_rows(buf, pos, stride, width, height)
+        return (width, (height + 7) // 8 * 8, image)
+
+    @classmethod
+    def load_bmp(self, buf):
+        """
+        Decode an uncompressed 1 bit-per-pixel BMP.
+        The darker palette entry is treated as lit, same as PBM and ascii art.
+        returns: (width, height, column-major bytes)
+        """
+        assert buf[0:2] == b'BM', "not a BMP file"
+        pixel_offset, = struct.unpack("<I", buf[10:14])
+        dib_size, width, height, planes, bpp, compression = struct.unpack("<IiiHHI", buf[14:34])
+        assert bpp == 1, f"BMP must be 1 bit-per-pixel, got {bpp}"
+        assert compression == 0, "compressed BMPs are not supported"
+        bottom_up = height > 0
+        height = abs(height)
+        # palette entries are B, G, R, 0
+        palette = 14 + dib_size
+        dark0 = sum(buf[palette:palette + 3]) <= sum(buf[palette + 4:palette + 7])
+        stride = ((width + 31) // 32) * 4
+        assert len(buf) >= pixel_offset + stride * height, "truncated BMP file"
+        image = self.transpose_rows(buf, pixel_offset, stride, width, height,
+                                     bottom_up=bottom_up, invert=dark0)
+        return (width, (height + 7) // 8 * 8, image)
+
+    @classmethod
+    def load_bitmap_file(self, path: str):
+        """
+        Memory-maps a PBM (P4) or 1-bit BMP file and converts it directly
+        to a column-major bitmap suitable for draw_bitmap.
+        returns: (width, height, bytes)
+        """
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                if buf[0:2] == b'BM':
+                    return self.load_bmp(buf)
+                return self.load_pbm(buf)
+
 
 def do_led(args):
+    if args.mode == 'stream':
+        return do_led_stream(args)
     leds = LEDs(args.port)
     left_color = args.left or args.color
     right_color = args.right or args.color
@@ -1047,6 +1499,105 @@ def do_led(args):
     b = leds.build_pixels(left_color, center_color, right_color)
     leds.fade_to_pixels(b * 3)
 
+def frame_sources(spec):
+    """
+    Yields binary files to read frames from, one after the other:
+    "-" is stdin, "tcp:HOST:PORT" and "unix:PATH" listen and yield each
+    client that connects, anything else is a file or FIFO (a FIFO is
+    opened again whenever its writer goes away).
+    """
+    if spec == '-':
+        yield sys.stdin.buffer
+        return
+    if spec.startswith("tcp:") or spec.startswith("unix:"):
+        if spec.startswith("tcp:"):
+            host, port = spec[4:].rsplit(":", 1)
+            server = socket.create_server((host, int(port)))
+        else:
+            path = spec[5:]
+            if os.path.exists(path):
+                os.unlink(path)
+            server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            server.bind(path)
+            server.listen(1)
+        with server:
+            while True:
+                conn, _ = server.accept()
+                with conn, conn.makefile("rb") as f:
+                    yield f
+    while True:
+        with open(spec, "rb") as f:
+            yield f
+        if not stat.S_ISFIFO(os.stat(spec).st_mode):
+            return
+
+def do_led_stream(args):
+    """
+    Pushes frames read from args.input to the LEDs as fast as the link
+    takes them. A reader thread keeps only the newest frame; writes are
+    paced by the time their bytes take on the wire, so when the input
+    is faster than the link the frames in between are dropped rather
+    than queued up behind it.
+    """
+    leds = LEDs(args.port)
+    frame_size = args.frame_size
+    byte_time = 10 / leds._ser.baudrate  # start + 8 data + stop bits
+    cond = threading.Condition()
+    state = {'frame': None, 'done': False, 'received': 0, 'dropped': 0}
+
+    def put(frame):
+        with cond:
+            if state['frame'] is not None:
+                state['dropped'] += 1
+            state['frame'] = frame
+            state['received'] += 1
+            cond.notify()
+
+    def reader():
+        buf = bytearray(frame_size)
+        try:
+            for f in frame_sources(args.input):
+                # buffered readinto fills the whole frame unless the input ended
+                while f.readinto(buf) == frame_size:
+                    put(bytes(buf))
+        except OSError as e:
+            print(f"led stream: {e}", file=sys.stderr)
+        with cond:
+            state['done'] = True
+            cond.notify()
+
+    threading.Thread(target=reader, daemon=True).start()
+    written = 0
+    wire_free = 0.0
+    start = time.monotonic()
+    try:
+        while True:
+            with cond:
+                while state['frame'] is None and not state['done']:
+                    cond.wait()
+                frame, state['frame'] = state['frame'], None
+            if frame is None:
+                break
+            if args.remap:
+                frame = b''.join(leds.remap_pixels(leds.NORMAL_MAPPING, frame[i:i + 66])
+                                 for i in range(0, frame_size, 66))
+            if frame_size == 66:
+                frame = frame * 3
+            delay = wire_free - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            before = leds.stats.bytes_written
+            now = time.monotonic()
+            leds.set_and_draw_pixels(frame)
+            wire_free = max(wire_free, now) + (leds.stats.bytes_written - before) * byte_time
+            written += 1
+    except KeyboardInterrupt:
+        pass
+    elapsed = max(time.monotonic() - start, 1e-9)
+    print(f"{state['received']} frames in, {written} written ({written / elapsed:.1f}/s), "
+          f"{state['dropped']} dropped", file=sys.stderr)
+    return 0
+
 def do_nfc(args):
     nfc = NFC(args.port)
     try:
@@ -1078,11 +1629,15 @@ def do_nfc(args):
         time.sleep(0.25)
     return 1
 
+def is_bitmap_file(path: str):
+    return os.path.splitext(path)[1].lower() in (".pbm", ".bmp")
+
 def do_vfd(args):
     vfd = VFD(args.port)
 
     if args.reset:
         vfd.reset()
+        vfd.wait_ready()
     vfd.turn_on(not args.off)
     if args.text is not None:
         if args.text:
@@ -1093,12 +1648,15 @@ def do_vfd(args):
             vfd.set_text_scroll(False)
     if args.image is not None:
         image_path = args.image
-        with open(args.image, "r") as f:
-            lines = f.readlines()
-        if lines[-1] == "":
-            lines.pop()
-        w, h, image = vfd.convert_ascii_art(lines)
-        image = vfd.rotate_bitmap(image, w, h)
+        if is_bitmap_file(image_path):
+            w, h, image = vfd.load_bitmap_file(image_path)
+        else:
+            with open(args.image, "r") as f:
+                lines = f.readlines()
+            if lines[-1] == "":
+                lines.pop()
+            w, h, image = vfd.convert_ascii_art(lines)
+            image = vfd.rotate_bitmap(image, w, h)
         vfd.draw_bitmap(0, 0, w, h//8, image)
     if args.brightness is not None:
         vfd.set_brightness(args.brightness)
@@ -1122,11 +1680,19 @@ if __name__ == "__main__":
     subparsers = parser.add_subparsers(dest='device')
     subparsers.required = True
     led_parser = subparsers.add_parser('led')
+    led_parser.add_argument("mode", nargs='?', choices=['set', 'stream'], default='set',
+        help="set: one static color (default). stream: raw frames from --input, as fast as the link allows.")
     led_parser.add_argument("--port", help="serial port", default='COM2' if is_windows else '/dev/ttyS1')
     led_parser.add_argument("--color", type=color_from_string, help="color to set LEDs to", default=Color(255,0,0))
     led_parser.add_argument("--left", type=color_from_string, help="color to set left LEDs to")
     led_parser.add_argument("--right", type=color_from_string, help="color to set right LEDs to")
     led_parser.add_argument("--center", type=color_from_string, help="color to set center LEDs to")
+    led_parser.add_argument("--input", default='-',
+        help="stream: - for stdin (default), a file or FIFO, tcp:HOST:PORT or unix:PATH to listen on")
+    led_parser.add_argument("--frame-size", type=int, choices=[66, 198], default=66,
+        help="stream: bytes per frame, 66 (22 RGB pixels, sent as all 3 pages) or 198 (3 pages)")
+    led_parser.add_argument("--remap", action='store_true',
+        help="stream: pixels come left to right, put them in the board's order")
     led_parser.set_defaults(func=do_led)
 
     nfc_parser = subparsers.add_parser('nfc')
@@ -1140,7 +1706,7 @@ if __name__ == "__main__":
     vfd_parser = subparsers.add_parser('vfd')
     vfd_parser.add_argument("--port", help="serial port", default='COM1' if is_windows else '/dev/ttyS0')
     vfd_parser.add_argument("--text", help="Text to scroll. English or Japanese only. Use empty string to turn off.")
-    vfd_parser.add_argument("--image", help="Text file with image to use as background.")
+    vfd_parser.add_argument("--image", help="Text file with image to use as background, or a 1-bit .pbm/.bmp image.")
     vfd_parser.add_argument("--brightness", type=int, help="Brightness level (0-4).")
     vfd_parser.add_argument("--off", action='store_true', default=False,
         help="Turn the display off. All other commands turn the screen on implicitly.")
@@ -2,9 +2,10 @@ import time
 import math
 from pras3 import LEDs, Color
 
-def animate(leds: LEDs, color_list, stop_event=None, speed=0.02):
+def animate(leds: LEDs, color_list, stop_event=None, speed=0.02, clock=None):
     """
     Gently pulses the entire 22 LEDs from black to color_list (R,G,B).
+    clock: shared clock of a multi-cabinet group (sync.EffectClock).
     """
     c = Color(*color_list)  # Convert [R,G,B] to a Color object
     num_leds = 22
@@ -12,6 +13,9 @@ def animate(leds: LEDs, color_list, stop_event=None, speed=0.02):
     while True:
         if stop_event and stop_event.is_set():
             break
+        render_start = time.perf_counter()
+        if clock:
+            step = clock.frame(speed) * 0.1
 
         # Sine wave from 0..1
         intensity = (math.sin(step) + 1) / 2.0
@@ -29,6 +33,12 @@ def animate(leds: LEDs, color_list, stop_event=None, speed=0.02):
         data = leds.remap_pixels(leds.NORMAL_MAPPING, data)
         # Triple up if you do that for your hardware:
         # data = data * 3  # if needed for immediate draw commands
+        leds.frame_rendered(render_start)
         leds.set_and_draw_pixels(data)
 
-        time.sleep(speed)
+        sleep_start = time.perf_counter()
+        if clock:
+            clock.wait_next(speed, stop_event)
+        else:
+            time.sleep(speed)
+        leds.trace("sleep", sleep_start)
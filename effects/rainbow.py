@@ -24,13 +24,20 @@ def rainbow(num_leds, step):
         data.extend([r, g, b])
     return data
 
-def animate(leds: LEDs, speed=0.01, stop_event=None):
+def animate(leds: LEDs, speed=0.01, stop_event=None, clock=None):
+    """
+    clock: shared clock of a multi-cabinet group (sync.EffectClock), the
+    step then comes from it so all cabinets show the same frame.
+    """
     num_leds = 22
     step = 0
 
     while True:
         if stop_event and stop_event.is_set():
             break
+        render_start = time.perf_counter()
+        if clock:
+            step = clock.frame(speed) % 256
 
         # Build the 22-LED rainbow, etc...
         ...
@@ -43,8 +50,14 @@ def animate(leds: LEDs, speed=0.01, stop_event=None):
         # *** Replicate the array 3× to match the hardware’s 198-byte format
         big_pixels_66 = pixels_22 * 3  # 66 bytes * 3 = 198 bytes total
 
+        leds.frame_rendered(render_start)
         # Update the hardware instantly
         leds.set_and_draw_pixels(big_pixels_66)
 
         step = (step + 1) % 256
-        time.sleep(speed)
+        sleep_start = time.perf_counter()
+        if clock:
+            clock.wait_next(speed, stop_event)
+        else:
+            time.sleep(speed)
+        leds.trace("sleep", sleep_start)
@@ -1,9 +1,10 @@
 import time
 from pras3 import LEDs
 
-def animate(leds: LEDs, color_list, stop_event=None, speed=0.05):
+def animate(leds: LEDs, color_list, stop_event=None, speed=0.05, clock=None):
     """
     Theater chase effect: dotted lights moving across the 22 LEDs.
+    clock: shared clock of a multi-cabinet group (sync.EffectClock).
     """
     num_leds = 22
     c_r, c_g, c_b = color_list
@@ -12,6 +13,9 @@ def animate(leds: LEDs, color_list, stop_event=None, speed=0.05):
     while True:
         if stop_event and stop_event.is_set():
             break
+        render_start = time.perf_counter()
+        if clock:
+            offset = clock.frame(speed) % 3
 
         data = bytearray()
         for i in range(num_leds):
@@ -23,7 +27,13 @@ def animate(leds: LEDs, color_list, stop_event=None, speed=0.05):
 
         # Remap
         data = leds.remap_pixels(leds.NORMAL_MAPPING, data)
+        leds.frame_rendered(render_start)
         leds.set_and_draw_pixels(data)
 
         offset = (offset + 1) % 3
-        time.sleep(speed)
+        sleep_start = time.perf_counter()
+        if clock:
+            clock.wait_next(speed, stop_event)
+        else:
+            time.sleep(speed)
+        leds.trace("sleep", sleep_start)
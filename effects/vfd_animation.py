@@ -0,0 +1,170 @@
+import time
+from pras3 import VFD, is_bitmap_file
+
+def load_sprite_sheet(path, frame_height=32):
+    """
+    Load a sprite sheet: frames stacked vertically, each frame_height rows
+    tall. Either ASCII art or a 1-bit .pbm/.bmp image. Every frame is
+    converted and rotated once so playback only has to slice bytes.
+    returns: (width, height, frames) with frames in column-major order.
+    """
+    assert frame_height % 8 == 0
+    if is_bitmap_file(path):
+        return _split_bitmap(path, frame_height)
+
+    with open(path, "r", encoding='utf-8') as f:
+        lines = [l.rstrip("\n") for l in f.readlines()]
+    while lines and lines[-1].strip() == "":
+        lines.pop()
+    assert lines and len(lines) % frame_height == 0
+
+    # pad every row to a common, byte-aligned width
+    width = max([len(l) for l in lines])
+    width = (width + 7) // 8 * 8
+    lines = [l.ljust(width) for l in lines]
+
+    frames = []
+    for i in range(0, len(lines), frame_height):
+        w, h, image = VFD.convert_ascii_art(lines[i:i + frame_height])
+        frames.append(VFD.rotate_bitmap(image, w, h))
+    return (width, frame_height, frames)
+
+def load_frame_sequence(paths):
+    """
+    Load a sequence of single-frame ASCII art files (frame0.txt, frame1.txt, ...).
+    All frames must have the same size.
+    returns: (width, height, frames) with frames in column-major order.
+    """
+    width = height = None
+    frames = []
+    for path in paths:
+        w, h, sheet = load_sprite_sheet(path, frame_height=_count_rows(path))
+        if width is None:
+            width, height = w, h
+        assert (w, h) == (width, height), f"{path} is {w}x{h}, expected {width}x{height}"
+        frames.extend(sheet)
+    return (width, height, frames)
+
+def _split_bitmap(path, frame_height):
+    # The decoded image is column-major over its full height, so each
+    # frame is a band of bytes taken out of every column.
+    width, height, image = VFD.load_bitmap_file(path)
+    assert height % frame_height == 0
+    col_bytes = height // 8
+    frame_bytes = frame_height // 8
+    frames = []
+    for f in range(height // frame_height):
+        y = f * frame_bytes
+        frames.append(b''.join(image[x * col_bytes + y:x * col_bytes + y + frame_bytes]
+                               for x in range(width)))
+    return (width, frame_height, frames)
+
+def _count_rows(path):
+    if is_bitmap_file(path):
+        return VFD.load_bitmap_file(path)[1]
+    with open(path, "r", encoding='utf-8') as f:
+        lines = f.readlines()
+    while lines and lines[-1].strip() == "":
+        lines.pop()
+    return len(lines)
+
+
+class FrameCache:
+    """
+    Holds pre-rotated frames and the column ranges that differ between them.
+    The delta between two frames is only computed the first time it's needed.
+    """
+    def __init__(self, width, height, frames):
+        self.width = width
+        self.height = height
+        self.frames = frames
+        self.col_bytes = height // 8
+        self._deltas = {}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def delta(self, prev_index, index):
+        """
+        Returns (x_start, x_end) of the columns that change when going from
+        prev_index to index, or None if nothing changes.
+        A prev_index of None means the whole frame.
+        """
+        if prev_index is None:
+            return (0, self.width)
+        key = (prev_index, index)
+        if key not in self._deltas:
+            self._deltas[key] = self._changed_columns(self.frames[prev_index], self.frames[index])
+        return self._deltas[key]
+
+    def _changed_columns(self, prev, cur):
+        n = len(cur)
+        start = 0
+        while start < n and prev[start] == cur[start]:
+            start += 1
+        if start == n:
+            return None
+        end = n
+        while prev[end - 1] == cur[end - 1]:
+            end -= 1
+        return (start // self.col_bytes, (end + self.col_bytes - 1) // self.col_bytes)
+
+    def upload(self, vfd: VFD, prev_index, index, x=0):
+        """
+        Send only the changed columns of frame `index` to the display.
+        Returns the number of bitmap bytes sent.
+        """
+        cols = self.delta(prev_index, index)
+        if cols is None:
+            return 0
+        x_start, x_end = cols
+        data = self.frames[index][x_start * self.col_bytes:x_end * self.col_bytes]
+        vfd.draw_bitmap(x + x_start, 0, x_end - x_start, self.col_bytes, data)
+        return len(data)
+
+
+def animate(vfd: VFD, cache: FrameCache, fps=10, stop_event=None, loop=True, x=0, lock=None):
+    """
+    Play the cached frames at a fixed rate.
+    Frame deadlines are fixed to the start time, so if the display (which
+    is throttled by CTS) falls behind we skip ahead to the frame that should
+    be showing now instead of drifting.
+    returns: dict with shown/dropped frame counts and bytes sent.
+    """
+    period = 1.0 / fps
+    stats = {'shown': 0, 'dropped': 0, 'bytes': 0}
+    shown = None
+    index = 0
+    start = time.monotonic()
+
+    while True:
+        if stop_event and stop_event.is_set():
+            break
+
+        # drop frames we are already too late for
+        due = int((time.monotonic() - start) / period)
+        if due > index:
+            stats['dropped'] += due - index
+            vfd.stats.dropped_frames += due - index
+            index = due
+
+        if not loop and index >= len(cache):
+            break
+        frame = index % len(cache)
+
+        if lock:
+            with lock:
+                stats['bytes'] += cache.upload(vfd, shown, frame, x)
+        else:
+            stats['bytes'] += cache.upload(vfd, shown, frame, x)
+        shown = frame
+        stats['shown'] += 1
+
+        index += 1
+        delay = start + index * period - time.monotonic()
+        if delay > 0:
+            if stop_event:
+                stop_event.wait(delay)
+            else:
+                time.sleep(delay)
+    return stats
@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from enum import IntEnum
+from pras3 import VFD
+
+class Priority(IntEnum):
+    URGENT = 0  # brightness, turn_on, scroll text...
+    NORMAL = 1
+    BULK   = 2  # bitmap upload chunks
+
+class VFDQueue:
+    """
+    Serializes VFD commands on a worker thread in priority order.
+    Large bitmaps are split into column ranges so urgent commands only
+    ever wait for one chunk instead of a whole full-screen upload on the
+    CTS-throttled link.
+    """
+    def __init__(self, vfd: VFD, chunk_columns=32, lock=None):
+        self.vfd = vfd
+        self.chunk_columns = chunk_columns
+        self._lock = lock or threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+        # priority -> [count, total latency, max latency]
+        self._stats = {p: [0, 0.0, 0.0] for p in Priority}
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, func, *args, priority=Priority.NORMAL, locked=True):
+        """
+        Queue func(*args) to run on the worker.
+        locked: hold the device lock while it runs. Jobs that wait for
+        another lock holder (e.g. join an animation thread) pass False.
+        returns: an Event that is set once it ran (or was cancelled).
+        """
+        done = threading.Event()
+        self._push(priority, func, args, done, locked=locked)
+        return done
+
+    def _push(self, priority, func, args, done, last=True, locked=True):
+        with self._cond:
+            heapq.heappush(self._heap, (priority, next(self._seq), time.monotonic(), func, args, done, last, locked))
+            self._cond.notify()
+
+    def draw_bitmap(self, x_start, y_start, w, h, bitmap, priority=Priority.BULK):
+        """
+        Same arguments as VFD.draw_bitmap, sent as chunk_columns wide pieces.
+        returns: an Event that is set once the last chunk was written.
+        """
+        assert len(bitmap) == h * w
+        done = threading.Event()
+        with self._cond:
+            for x in range(0, w, self.chunk_columns):
+                n = min(self.chunk_columns, w - x)
+                chunk = bitmap[x * h:(x + n) * h]
+                self._push(priority, self.vfd.draw_bitmap, (x_start + x, y_start, n, h, chunk),
+                           done, last=(x + n == w))
+        return done
+
+    def clear(self):
+        """
+        Drop everything still waiting, e.g. a stale image when switching games.
+        Returns right away; a command in progress still finishes on the
+        worker before anything queued after this.
+        """
+        with self._cond:
+            pending, self._heap = self._heap, []
+        for item in pending:
+            item[5].set()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        self._thread.join()
+
+    def latency_stats(self):
+        """
+        returns: {priority name: {'count', 'mean', 'max'}} in seconds,
+        measured from submit to the write finishing.
+        """
+        with self._cond:
+            return {p.name: {'count': c, 'mean': (t / c) if c else 0.0, 'max': m}
+                    for p, (c, t, m) in self._stats.items()}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                priority, _, queued, func, args, done, last, locked = heapq.heappop(self._heap)
+            try:
+                if locked:
+                    with self._lock:
+                        func(*args)
+                else:
+                    func(*args)
+            except Exception as e:
+                logging.error(f"Error in VFD queue ({func.__name__}): {e}")
+            if last:
+                latency = time.monotonic() - queued
+                with self._cond:
+                    stat = self._stats[priority]
+                    stat[0] += 1
+                    stat[1] += latency
+                    stat[2] = max(stat[2], latency)
+                done.set()
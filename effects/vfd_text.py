@@ -0,0 +1,182 @@
+from collections import OrderedDict
+from PIL import Image, ImageDraw, ImageFont
+from pras3 import VFD
+
+class GlyphAtlas:
+    """
+    Renders text to column-major bitmaps for the VFD.
+    Each character is rasterized once and kept in the atlas. Because the
+    VFD layout is column-major, a string is just its glyphs' bytes joined
+    together, so re-rendering cached text is only a dict lookup.
+
+    font_path: a TrueType font, ideally one that covers the text shown
+    (e.g. MS Gothic, 8 columns for Latin and 16 for CJK at 16 px). Without
+    one it's Pillow's default font, which is mostly Latin, at 13 px: its
+    ascent and descent (13 + 3) fill 16 rows. size=None picks that for the
+    default font and height for a TrueType one.
+    Characters the font has no glyph for come out as '?'.
+    """
+    # private use, no font has it: whatever this draws is the "no glyph" box
+    NOTDEF_PROBE = '\U0010fffd'
+
+    def __init__(self, font_path=None, size=None, height=16, max_strings=64):
+        assert height % 8 == 0
+        if font_path:
+            self.font = ImageFont.truetype(font_path, size or height)
+        else:
+            # size= needs Pillow 10.1, older ones only have the 11 px bitmap font
+            try:
+                self.font = ImageFont.load_default(size=size or 13)
+            except TypeError:
+                self.font = ImageFont.load_default()
+        self.height = height
+        self.col_bytes = height // 8
+        self._glyphs = {}
+        self._strings = OrderedDict()
+        self._max_strings = max_strings
+        self.hits = 0
+        self.misses = 0
+        self._notdef = self._rasterize(self.NOTDEF_PROBE)
+
+    def glyph(self, ch: str):
+        """
+        returns: (width, column-major bytes) for a single character, or
+        None if the font has no glyph for it.
+        """
+        if ch in self._glyphs:
+            self.hits += 1
+            return self._glyphs[ch]
+        self.misses += 1
+        g = self._rasterize(ch)
+        if g == self._notdef and not ch.isspace():
+            g = None
+        self._glyphs[ch] = g
+        return g
+
+    def _rasterize(self, ch: str):
+        try:
+            width = max(1, int(round(self.font.getlength(ch))))
+            img = Image.new("1", (width, self.height), 0)
+            ImageDraw.Draw(img).text((0, 0), ch, fill=1, font=self.font)
+        except UnicodeError:
+            # the old bitmap default font only does Latin-1
+            return None
+        # mode "1" tobytes() is packed rows, MSB first
+        return (width, VFD.transpose_rows(img.tobytes(), 0, (width + 7) // 8, width, self.height))
+
+    def render(self, text: str):
+        """
+        Render a string into a column-major bitmap, e.g. for draw_bitmap.
+        returns: (width, height, bytes)
+        """
+        cached = self._strings.get(text)
+        if cached is not None:
+            self._strings.move_to_end(text)
+            return cached
+        glyphs = [self.glyph(ch) or self.glyph('?') for ch in text]
+        width = sum(w for w, _ in glyphs)
+        result = (width, self.height, b''.join(bits for _, bits in glyphs))
+        self._strings[text] = result
+        if len(self._strings) > self._max_strings:
+            self._strings.popitem(last=False)
+        return result
+
+    def glyph_slot(self, ch: str, columns: int):
+        """
+        Returns the bytes for a hardware character slot columns wide (8 or
+        16) and 16 rows high, or None if the font has no glyph for ch or it
+        doesn't fit.
+        The slot data is assumed to be column-major like draw_bitmap.
+        """
+        assert self.height == 16
+        g = self.glyph(ch)
+        if g is None or g[0] > columns:
+            return None
+        width, bits = g
+        return bits + bytes(columns * 2 - len(bits))
+
+
+class GlyphSlots:
+    """
+    Manages the hardware character slots: 16 of 8x16 and 16 of 16x16.
+    Characters the display can't encode are rasterized by the atlas and
+    loaded into a slot, substituting for a spare code: an 8-bit one for
+    glyphs up to 8 columns wide, a 2-byte one for wider glyphs up to 16.
+    Slots stay loaded between calls so repeated text is never re-uploaded;
+    when all slots of a size are taken the least used glyph is evicted.
+    """
+    # half-width katakana codes in SHIFT-JIS, rarely needed on this cabinet
+    DEFAULT_CODES = list(range(0xa1, 0xb1))
+    # first row of the SHIFT-JIS user-defined area. load_16x16_char doesn't
+    # say which codes its slots stand for, pass wide_codes if it's others
+    DEFAULT_WIDE_CODES = list(range(0xf040, 0xf050))
+
+    def __init__(self, vfd: VFD, atlas: GlyphAtlas, codes=None, wide_codes=None):
+        self.vfd = vfd
+        self.atlas = atlas
+        self.codes = codes or self.DEFAULT_CODES
+        self.wide_codes = wide_codes or self.DEFAULT_WIDE_CODES
+        assert len(self.codes) <= 16 and len(self.wide_codes) <= 16
+        self._slots = {}  # char -> (wide, slot index)
+        self._uses = {}   # char -> use count
+        self.uploads = 0
+
+    def forget(self):
+        """
+        Call after a VFD reset, which may clear the loaded characters.
+        """
+        self._slots.clear()
+        self._uses.clear()
+
+    def _slot_for(self, ch: str, keep):
+        if ch in self._slots:
+            return self._slots[ch]
+        wide = False
+        bits = self.atlas.glyph_slot(ch, 8)
+        if bits is None:
+            wide = True
+            bits = self.atlas.glyph_slot(ch, 16)
+            if bits is None:
+                return None
+        codes = self.wide_codes if wide else self.codes
+        used = {index for w, index in self._slots.values() if w == wide}
+        if len(used) < len(codes):
+            index = min(set(range(len(codes))) - used)
+        else:
+            candidates = [c for c, (w, _) in self._slots.items() if w == wide and c not in keep]
+            if not candidates:
+                return None
+            victim = min(candidates, key=lambda c: self._uses.get(c, 0))
+            _, index = self._slots.pop(victim)
+        if wide:
+            self.vfd.load_16x16_char(index, bits)
+        else:
+            self.vfd.load_8x16_char(index, codes[index], bits)
+        self.uploads += 1
+        self._slots[ch] = (wide, index)
+        return (wide, index)
+
+    def encode(self, text: str) -> bytes:
+        """
+        Encode text for write_scroll_text, loading custom glyphs for any
+        characters the hardware encoding can't represent.
+        Characters the font has no glyph for, or that don't get a slot,
+        are replaced with '?'.
+        """
+        keep = set(text)
+        result = b''
+        for ch in text:
+            try:
+                result += self.vfd.encode(ch)
+                continue
+            except UnicodeEncodeError:
+                pass
+            self._uses[ch] = self._uses.get(ch, 0) + 1
+            slot = self._slot_for(ch, keep)
+            if slot is None:
+                result += b'?'
+            elif slot[0]:
+                result += self.wide_codes[slot[1]].to_bytes(2, 'big')
+            else:
+                result += bytes([self.codes[slot[1]]])
+        return result
@@ -78,6 +78,7 @@ def animate_symmetric(leds: LEDs, base_color, stop_event=None, scale_factor=1.3)
         while True:
             if stop_event and stop_event.is_set():
                 break
+            render_start = time.perf_counter()
 
             amp = amplitude_container.get_value()
             # partial smoothing
@@ -117,10 +118,14 @@ def animate_symmetric(leds: LEDs, base_color, stop_event=None, scale_factor=1.3)
                 pixel_data[idx:idx+3] = bytes([r, g, b])
 
             pixel_data = leds.remap_pixels(leds.NORMAL_MAPPING, pixel_data)
-            leds.set_blend_timing(2,1)
-            leds.fade_to_pixels(pixel_data)
+            leds.frame_rendered(render_start)
+            with leds.batch():
+                leds.set_blend_timing(2,1)
+                leds.fade_to_pixels(pixel_data)
 
+            sleep_start = time.perf_counter()
             time.sleep(0.03)
+            leds.trace("sleep", sleep_start)
 
     except KeyboardInterrupt:
         pass
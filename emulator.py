@@ -0,0 +1,494 @@
+import os
+import time
+import tty
+import select
+import struct
+import logging
+import argparse
+from threading import Thread, Event, Lock
+
+###############################################################################
+# Virtual P-RAS3 devices on ptys (Linux/macOS)
+###############################################################################
+# python emulator.py --link /tmp/pras3
+#   => /tmp/pras3/leds, /tmp/pras3/vfd, /tmp/pras3/nfc
+#
+#   PRAS3_LED_PORT=/tmp/pras3/leds PRAS3_VFD_PORT=/tmp/pras3/vfd python main.py
+#   python effects/pras3.py vfd --port /tmp/pras3/vfd --text hello
+#
+# Each device reads its pty no faster than the baud rate allows, so writers
+# block on a full pty buffer the way they would on a real UART. The VFD
+# stops reading while it is busy (e.g. after a reset), which is what CTS
+# hold-off looks like to the host: out_waiting stays up and writes stall.
+class EmulatedDevice(Thread):
+    """
+    One device on a pty. Subclasses implement feed(byte) and keep their
+    own state; commands report in with command() / frame().
+    """
+    def __init__(self, name, baudrate=115200, chunk=64):
+        super().__init__(name=f"emu-{name}", daemon=True)
+        self.device_name = name
+        self.byte_time = 10 / baudrate  # start + 8 data + stop bits
+        self.chunk = chunk              # bytes taken per read, like a UART FIFO
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.path = os.ttyname(self._slave)
+        self._stop = Event()
+        self._lock = Lock()
+        self._wire = 0.0
+        self._busy_until = 0.0
+        self._frame_start = None
+        self._last_frame = None
+        self._now = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self.started = time.monotonic()
+            self.bytes_in = 0
+            self.bytes_out = 0
+            self.commands = 0
+            self.frames = 0
+            self.errors = 0
+            self.cts_hold_time = 0.0
+            self.frame_latency = []   # first byte of a frame => frame applied
+            self.frame_interval = []  # between applied frames
+
+    # --- for subclasses ------------------------------------------------------
+    def feed(self, byte):
+        raise NotImplementedError
+
+    def start_of_command(self):
+        "Call on the first byte of a command, frame latency is taken from here."
+        self._frame_start = self._now
+
+    def command(self):
+        self.commands += 1
+
+    def frame(self):
+        "The command just finished updated the display/LEDs."
+        now = self._now
+        self.frames += 1
+        if self._frame_start is not None:
+            self.frame_latency.append(now - self._frame_start)
+        if self._last_frame is not None:
+            self.frame_interval.append(now - self._last_frame)
+        self._last_frame = now
+        del self.frame_latency[:-1000]
+        del self.frame_interval[:-1000]
+
+    def busy(self, seconds):
+        "Stop taking data for a while, the host sees CTS held off."
+        self._busy_until = max(self._busy_until, self._now + seconds)
+
+    def reply(self, b: bytes):
+        self.bytes_out += len(b)
+        os.write(self._master, b)
+
+    # --- pty loop ------------------------------------------------------------
+    def run(self):
+        while not self._stop.is_set():
+            hold = self._busy_until - time.monotonic()
+            if hold > 0:
+                self.cts_hold_time += hold
+                time.sleep(hold)
+            r, _, _ = select.select([self._master], [], [], 0.1)
+            if not r:
+                continue
+            try:
+                data = os.read(self._master, self.chunk)
+            except OSError:
+                continue
+            now = time.monotonic()
+            # the bytes can't have arrived faster than the wire carries them
+            self._wire = max(self._wire, now) + len(data) * self.byte_time
+            delay = self._wire - now
+            if delay > 0:
+                time.sleep(delay)
+            with self._lock:
+                self._now = time.monotonic()
+                self.bytes_in += len(data)
+                for byte in data:
+                    self.feed(byte)
+
+    def stop(self):
+        self._stop.set()
+        self.join()
+        os.close(self._master)
+        os.close(self._slave)
+
+    def stats(self):
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            lat = self.frame_latency
+            gaps = self.frame_interval
+            return {
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'throughput': self.bytes_in / elapsed,              # bytes/s
+                'wire_busy': self.bytes_in * self.byte_time / elapsed,  # 0..1
+                'commands': self.commands,
+                'frames': self.frames,
+                'fps': self.frames / elapsed,
+                'frame_latency_mean': sum(lat) / len(lat) if lat else 0.0,
+                'frame_latency_max': max(lat, default=0.0),
+                'frame_interval_max': max(gaps, default=0.0),
+                'cts_hold_time': self.cts_hold_time,
+                'errors': self.errors,
+            }
+
+class _EscapedFramer:
+    """
+    Collects the 0xe0-framed, 0xd0-escaped packets the LED board and NFC
+    reader use. frame_length(buf) returns the full unescaped length once
+    enough of the header is in, else None.
+    """
+    def __init__(self, device, frame_length, on_frame):
+        self._device = device
+        self._frame_length = frame_length
+        self._on_frame = on_frame
+        self._buf = None
+        self._escape = False
+
+    def feed(self, byte):
+        if byte == 0xe0:
+            if self._buf:
+                self._device.errors += 1  # cut short by the next packet
+            self._buf = bytearray()
+            self._escape = False
+            self._device.start_of_command()
+            return
+        if self._buf is None:
+            return  # noise between packets
+        if self._escape:
+            byte += 1
+            self._escape = False
+        elif byte == 0xd0:
+            self._escape = True
+            return
+        self._buf.append(byte)
+        n = self._frame_length(self._buf)
+        if n is not None and len(self._buf) >= n:
+            buf, self._buf = bytes(self._buf), None
+            if sum(buf[:-1]) % 256 != buf[-1]:
+                self._device.errors += 1
+                return
+            self._device.command()
+            self._on_frame(buf)
+
+def _framed(buf: bytes) -> bytes:
+    checksum = struct.pack("B", sum(buf) % 256)
+    out = bytearray(b'\xe0')
+    for byte in buf + checksum:
+        if byte == 0xd0 or byte == 0xe0:
+            out += bytes([0xd0, byte - 1])
+        else:
+            out.append(byte)
+    return bytes(out)
+
+###############################################################################
+# LED board (837-15093)
+###############################################################################
+class LEDNode:
+    """
+    One board's state. .pixels is what the LEDs show, 66 pixels x RGB.
+    Fades complete at once.
+    """
+    def __init__(self, node_id):
+        self.node_id = node_id
+        self.buffer = bytearray(198)
+        self.pixels = bytearray(198)
+        self.silent = False
+        self.blend = (0x20, 0x8)
+        self.frames = 0
+
+class LEDBoard(EmulatedDevice):
+    """
+    0xe0 | dst | src | len | cmd | payload | checksum
+    Replies (0xe0 | dst | src | len | status | cmd | report | data | checksum)
+    only when src isn't 0, dst isn't the 0 wildcard and silent mode is off.
+
+    node_ids: boards sharing the port, each takes the commands for its id
+    and the 0 wildcard. .nodes has their state, .pixels is the first one's.
+    """
+    def __init__(self, name="leds", node_ids=(1,), **kwargs):
+        super().__init__(name, **kwargs)
+        self.nodes = [LEDNode(node_id) for node_id in node_ids]
+        self._framer = _EscapedFramer(self, lambda b: b[2] + 4 if len(b) >= 3 else None, self._command)
+
+    @property
+    def pixels(self):
+        return self.nodes[0].pixels
+
+    def feed(self, byte):
+        self._framer.feed(byte)
+
+    def _command(self, buf):
+        dst, src, n, cmd = buf[0], buf[1], buf[2], buf[3]
+        payload = buf[4:3 + n]
+        frame = False
+        for node in self.nodes:
+            if dst not in (0, node.node_id):
+                continue
+            data = b''
+            drawn = False
+            if cmd in (0x81, 0x82, 0x83):
+                node.buffer[:len(payload)] = payload
+                if cmd != 0x81:
+                    node.pixels[:] = node.buffer
+                    drawn = True
+            elif cmd == 0x80:
+                node.pixels[:] = node.buffer
+                drawn = True
+            elif cmd == 0x10:
+                node.buffer = bytearray(198)
+                node.pixels = bytearray(198)
+            elif cmd == 0x14:
+                node.silent = bool(payload[0]) if payload else node.silent
+                data = bytes([node.silent])
+            elif cmd == 0x18:
+                node.node_id = payload[0] & 7
+            elif cmd == 0x84:
+                node.blend = (payload[0], payload[1])
+            elif cmd == 0xf0:
+                data = b"15093-06"
+            if drawn:
+                node.frames += 1
+                frame = True
+            if src != 0 and dst != 0 and not node.silent:
+                body = bytes([1, cmd, 1]) + data
+                self.reply(_framed(bytes([src, node.node_id, len(body)]) + body))
+        if frame:
+            self.frame()
+
+###############################################################################
+# NFC reader (837-15396)
+###############################################################################
+class NFCReader(EmulatedDevice):
+    """
+    0xe0 | len | addr | seq | cmd | payload len | payload | checksum
+    Every command gets 0xe0 | len | addr | seq | cmd | status | payload len | payload | checksum.
+
+    cards: [(type byte 0x10/0x20, uid bytes)] returned by a poll while the
+    radio is on.
+    """
+    def __init__(self, name="nfc", cards=(), **kwargs):
+        super().__init__(name, **kwargs)
+        self.cards = list(cards)
+        self.radio = 0
+        self._framer = _EscapedFramer(self, lambda b: b[0] + 1, self._command)
+
+    def feed(self, byte):
+        self._framer.feed(byte)
+
+    def _command(self, buf):
+        addr, seq, cmd = buf[1], buf[2], buf[3]
+        data = b''
+        if cmd == 0x30:
+            data = b'\x94'
+        elif cmd == 0x32:
+            data = b'837-15396'
+        elif cmd == 0x40:
+            self.radio = buf[5] if len(buf) > 6 else 0
+        elif cmd == 0x41:
+            self.radio = 0
+        elif cmd == 0x42:
+            cards = [c for c in self.cards if self.radio & (1 if c[0] == 0x10 else 2)]
+            data = bytes([len(cards)]) + b''.join(bytes([t, len(uid)]) + uid for t, uid in cards)
+            self.frame()
+        body = bytes([addr, seq, cmd, 0, len(data)]) + data
+        self.reply(_framed(bytes([len(body) + 1]) + body))
+
+###############################################################################
+# VFD (Futaba GP1232A02A)
+###############################################################################
+class VFDDisplay(EmulatedDevice):
+    """
+    ESC (0x1b) and 0x1a commands as documented on pras3.VFD, anything else
+    is text.
+
+    .fb is the 512 column background plane, 4 bytes per column, bit 7 at
+    the top. draw_bitmap's "x end" is one past the last column, so the
+    width is x end - x start.
+
+    reset_time/draw_time model how long the display holds CTS off after a
+    reset and per bitmap column.
+    """
+    ESC_ARGS = {0x0b: 0, 0x0c: 0, 0x20: 1, 0x21: 1, 0x22: 2, 0x30: 3, 0x32: 1,
+                0x40: 6, 0x41: 1, 0x51: 0, 0x52: 0, 0x5b: 1, 0x5d: 1}
+    NB_ARGS = {0xa3: 33, 0xa4: 18}
+
+    def __init__(self, name="vfd", reset_time=0.05, draw_time=0.00002, **kwargs):
+        super().__init__(name, **kwargs)
+        self.reset_time = reset_time
+        self.draw_time = draw_time
+        self._buf = bytearray()
+        self._reset()
+
+    def _reset(self):
+        self.fb = bytearray(512 * 4)
+        self.h_scroll = 0
+        self.brightness = 4
+        self.on = True
+        self.cursor = (0, 0)
+        self.encoding = 2
+        self.text_window = None
+        self.scroll_text = b''
+        self.scrolling = False
+        self.text = b''
+        self.glyphs = {}
+
+    def _need(self):
+        """Bytes the command at the head of the buffer needs, or None if unknown yet."""
+        buf = self._buf
+        if buf[0] == 0x1b:
+            if len(buf) < 2:
+                return None
+            cmd = buf[1]
+            if cmd == 0x2e:
+                if len(buf) < 8:
+                    return None
+                x, y, x_end, y_end = struct.unpack(">HBHB", buf[2:8])
+                return 8 + max(0, x_end - x) * (y_end - y + 1)
+            if cmd == 0x50:
+                return 3 + buf[2] if len(buf) >= 3 else None
+            return 2 + self.ESC_ARGS.get(cmd, 0)
+        if buf[0] == 0x1a:
+            if len(buf) < 2:
+                return None
+            return 2 + self.NB_ARGS.get(buf[1], 0)
+        # Shift-JIS lead bytes take two
+        if self.encoding == 2 and (0x81 <= buf[0] <= 0x9f or 0xe0 <= buf[0] <= 0xfc):
+            return 2
+        return 1
+
+    def feed(self, byte):
+        if not self._buf:
+            self.start_of_command()
+        self._buf.append(byte)
+        need = self._need()
+        if need is None or len(self._buf) < need:
+            return
+        cmd, self._buf = bytes(self._buf), bytearray()
+        self.command()
+        self._apply(cmd)
+
+    def _apply(self, b):
+        if b[0] == 0x1a:
+            if b[1] in self.NB_ARGS:
+                self.glyphs[(b[1], b[2])] = b[3:]
+            else:
+                self.errors += 1
+            return
+        if b[0] != 0x1b:
+            self.text += b
+            return
+        cmd, args = b[1], b[2:]
+        if cmd == 0x0b:
+            self._reset()
+            self.busy(self.reset_time)
+        elif cmd == 0x0c:
+            self.fb = bytearray(512 * 4)
+            self.frame()
+        elif cmd == 0x20:
+            self.brightness = args[0]
+        elif cmd == 0x21:
+            self.on = bool(args[0])
+        elif cmd == 0x22:
+            self.h_scroll = struct.unpack(">H", args)[0]
+        elif cmd == 0x2e:
+            x, y, x_end, y_end = struct.unpack(">HBHB", args[:6])
+            w = max(0, x_end - x)
+            h = y_end - y + 1
+            data = args[6:]
+            for col in range(w):
+                if x + col >= 512:
+                    break
+                base = (x + col) * 4 + y
+                self.fb[base:base + h] = data[col * h:col * h + h]
+            self.busy(w * self.draw_time)
+            self.frame()
+        elif cmd == 0x30:
+            self.cursor = struct.unpack(">HB", args)
+        elif cmd == 0x32:
+            self.encoding = args[0]
+        elif cmd == 0x40:
+            self.text_window = struct.unpack(">HBHB", args)[:3]
+        elif cmd == 0x41:
+            pass  # scroll speed
+        elif cmd == 0x50:
+            self.scroll_text = args[1:]
+        elif cmd == 0x51:
+            self.scrolling = True
+        elif cmd == 0x52:
+            self.scrolling = False
+        elif cmd == 0x5b:
+            self.reply(b'\x0201.20\x03')
+        elif cmd == 0x5d:
+            pass  # flip
+        else:
+            self.errors += 1
+
+    def render(self):
+        "The visible 160x32 window as 32 lines of '#' and ' '."
+        with self._lock:
+            lines = []
+            for y in range(32):
+                row = []
+                for x in range(160):
+                    col = (self.h_scroll + x) % 512
+                    byte = self.fb[col * 4 + y // 8]
+                    row.append('#' if byte & (0x80 >> (y % 8)) else ' ')
+                lines.append("".join(row))
+            return lines
+
+###############################################################################
+# Runner
+###############################################################################
+def format_stats(name, s):
+    return (f"{name}: {s['throughput']:.0f} B/s ({s['wire_busy'] * 100:.0f}% of the wire), "
+            f"{s['commands']} commands, {s['frames']} frames ({s['fps']:.1f}/s), "
+            f"latency mean {s['frame_latency_mean'] * 1000:.1f} ms max {s['frame_latency_max'] * 1000:.1f} ms, "
+            f"CTS held {s['cts_hold_time']:.2f}s, {s['errors']} errors")
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Emulated P-RAS3 LED board, VFD and NFC reader on ptys")
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument("--link", help="directory to put leds/vfd/nfc symlinks to the ptys in")
+    parser.add_argument("--report", type=float, default=5.0, help="seconds between stats reports")
+    parser.add_argument("--show-vfd", action='store_true', help="print the VFD contents with each report")
+    parser.add_argument("--card", help="hex UID of a MIFARE card the NFC reader sees")
+    parser.add_argument("--led-nodes", default="1", help="node ids of the LED boards sharing the port, e.g. 1,2,3")
+    args = parser.parse_args()
+
+    cards = [(0x10, bytes.fromhex(args.card))] if args.card else []
+    node_ids = [int(n) for n in args.led_nodes.split(",")]
+    devices = [LEDBoard(node_ids=node_ids, baudrate=args.baud), VFDDisplay(baudrate=args.baud),
+               NFCReader(baudrate=args.baud, cards=cards)]
+    for dev in devices:
+        dev.start()
+        path = dev.path
+        if args.link:
+            os.makedirs(args.link, exist_ok=True)
+            path = os.path.join(args.link, dev.device_name)
+            if os.path.lexists(path):
+                os.unlink(path)
+            os.symlink(dev.path, path)
+        logging.info(f"{dev.device_name} on {path}")
+
+    try:
+        while True:
+            time.sleep(args.report)
+            for dev in devices:
+                logging.info(format_stats(dev.device_name, dev.stats()))
+            if args.show_vfd:
+                print("\n".join(devices[1].render()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for dev in devices:
+            dev.stop()
+
+if __name__ == "__main__":
+    main()
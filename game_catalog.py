@@ -0,0 +1,107 @@
+import json
+import sqlite3
+import sys
+import time
+
+###############################################################################
+# Catalog of seen games
+###############################################################################
+class GameCatalog:
+    """
+    SQLite table of every game exe the watchdog has switched to, keyed
+    (and so B-tree indexed) by lowercased exe name.
+
+    Unknown games get a random look assigned the first time they're seen
+    and keep it, so a game always comes back with the same colors/effect.
+    export_config() turns the catalog into games.json entries instead of
+    hand-merging a text file.
+    """
+    def __init__(self, path):
+        self._db = sqlite3.connect(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS games (
+                exe         TEXT PRIMARY KEY,
+                name        TEXT NOT NULL,
+                path        TEXT,
+                first_seen  REAL NOT NULL,
+                last_seen   REAL NOT NULL,
+                sessions    INTEGER NOT NULL DEFAULT 0,
+                known       INTEGER NOT NULL DEFAULT 0,
+                led_effect  TEXT,
+                led_color   TEXT,
+                led_color_2 TEXT
+            )""")
+        self._db.commit()
+
+    def _row(self, row):
+        if row is None:
+            return None
+        entry = dict(row)
+        for col in ('led_color', 'led_color_2'):
+            if entry[col]:
+                entry[col] = json.loads(entry[col])
+        return entry
+
+    def get(self, name):
+        return self._row(self._db.execute(
+            "SELECT * FROM games WHERE exe = ?", (name.lower(),)).fetchone())
+
+    def record_session(self, name, path=None, known=False, make_look=None):
+        """
+        Count a session for this exe, adding it if it's new.
+        make_look() => (effect, color, color_2) is only called for an
+        unknown game that has no look yet: a new one, or one that was in
+        the config when it was first seen.
+        returns: the catalog entry
+        """
+        now = time.time()
+        with self._db:
+            cur = self._db.execute(
+                "UPDATE games SET last_seen = ?, sessions = sessions + 1, path = COALESCE(?, path), "
+                "known = ? WHERE exe = ?", (now, path, int(known), name.lower()))
+            if cur.rowcount == 0:
+                effect = color = color_2 = None
+                if not known and make_look:
+                    effect, color, color_2 = make_look()
+                self._db.execute(
+                    "INSERT INTO games (exe, name, path, first_seen, last_seen, sessions, known, "
+                    "led_effect, led_color, led_color_2) VALUES (?, ?, ?, ?, ?, 1, ?, ?, ?, ?)",
+                    (name.lower(), name, path, now, now, int(known), effect,
+                     json.dumps(color) if color else None, json.dumps(color_2) if color_2 else None))
+            elif not known and make_look and self._db.execute(
+                    "SELECT 1 FROM games WHERE exe = ? AND led_effect IS NULL", (name.lower(),)).fetchone():
+                effect, color, color_2 = make_look()
+                self._db.execute(
+                    "UPDATE games SET led_effect = ?, led_color = ?, led_color_2 = ? WHERE exe = ?",
+                    (effect, json.dumps(color), json.dumps(color_2), name.lower()))
+        return self.get(name)
+
+    def export_config(self, unknown_only=True):
+        """
+        returns: {exe: games_config entry} ready to paste into games.json
+        """
+        query = "SELECT * FROM games"
+        if unknown_only:
+            query += " WHERE known = 0"
+        config = {}
+        for row in self._db.execute(query + " ORDER BY sessions DESC"):
+            entry = self._row(row)
+            cfg = {
+                'launch_path': entry['path'],
+                'scroll_text': f"Playing {entry['name']}",
+            }
+            if entry['led_effect']:
+                cfg['led_effect'] = entry['led_effect']
+                cfg['led_color'] = entry['led_color']
+                cfg['led_color_2'] = entry['led_color_2']
+            config[entry['name']] = cfg
+        return config
+
+    def close(self):
+        self._db.close()
+
+if __name__ == "__main__":
+    # python game_catalog.py <catalog.sqlite3> => games.json snippet of unknown games
+    catalog = GameCatalog(sys.argv[1])
+    print(json.dumps(catalog.export_config(), indent=4))
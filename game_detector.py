@@ -0,0 +1,124 @@
+import os
+import socket
+import struct
+import logging
+from threading import Thread, Event, Lock
+
+###############################################################################
+# Event-driven game detection
+###############################################################################
+# Linux process events connector (needs root / CAP_NET_ADMIN)
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+NLMSG_DONE = 3
+PROC_CN_MCAST_LISTEN = 1
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSG_HDR = struct.Struct("=IHHII")      # len, type, flags, seq, pid
+CN_MSG = struct.Struct("=IIIIHH")        # idx, val, seq, ack, len, flags
+PROC_EVENT_HDR = struct.Struct("=IIQ")   # what, cpu, timestamp_ns
+PROC_EVENT_PIDS = struct.Struct("=II")   # pid, tgid (first fields of exec/exit data)
+
+
+class GameDetector:
+    """
+    Wakes the watchdog as soon as a process under one of the target
+    folders starts or a known game process exits, instead of waiting for
+    the next poll.
+
+    Uses the proc connector on Linux. If that isn't available (Windows,
+    no privileges) available is False and the caller keeps polling.
+
+    tracker: a ProcessTracker to tell about every exec, so its next scan
+    inspects the new program instead of the cached one (launcher scripts
+    exec into the game and keep their pid).
+
+        detector = GameDetector(targets, tracker)
+        if detector.start():
+            ...
+        detector.wake.wait(timeout)
+    """
+    def __init__(self, targets, tracker=None):
+        self.targets = tuple(t.lower() for t in targets)
+        self.tracker = tracker
+        self.wake = Event()
+        self.available = False
+        self.events = 0
+        self._game_pids = set()
+        self._lock = Lock()
+        self._sock = None
+
+    def watch(self, pids):
+        """Tell the detector which pids are games so their exit wakes us too."""
+        with self._lock:
+            self._game_pids = set(pids)
+
+    def start(self) -> bool:
+        try:
+            self._sock = self._open_proc_connector()
+        except (OSError, AttributeError) as e:
+            # AttributeError => no AF_NETLINK on this platform
+            logging.info(f"Process events unavailable ({e}), polling instead.")
+            return False
+        self.available = True
+        Thread(target=self._run, daemon=True).start()
+        logging.info("Process events enabled, game switches are event-driven.")
+        return True
+
+    def _open_proc_connector(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            sock.bind((os.getpid(), CN_IDX_PROC))
+            payload = struct.pack("=I", PROC_CN_MCAST_LISTEN)
+            cn = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+            msg = NLMSG_HDR.pack(NLMSG_HDR.size + len(cn), NLMSG_DONE, 0, 0, os.getpid()) + cn
+            sock.send(msg)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _is_game_exe(self, pid):
+        try:
+            exe = os.readlink(f"/proc/{pid}/exe")
+        except OSError:
+            return False
+        return exe.lower().startswith(self.targets)
+
+    def _handle(self, what, pid, tgid):
+        # only whole processes, not threads
+        if pid != tgid:
+            return
+        if what == PROC_EVENT_EXEC:
+            if self.tracker is not None:
+                self.tracker.forget(pid)
+            if self._is_game_exe(pid):
+                with self._lock:
+                    self._game_pids.add(pid)
+                self.events += 1
+                self.wake.set()
+        elif what == PROC_EVENT_EXIT:
+            with self._lock:
+                if pid not in self._game_pids:
+                    return
+                self._game_pids.discard(pid)
+            self.events += 1
+            self.wake.set()
+
+    def _run(self):
+        offset = NLMSG_HDR.size + CN_MSG.size
+        while True:
+            try:
+                data = self._sock.recv(4096)
+            except OSError as e:
+                logging.error(f"Process events stopped: {e}")
+                self.available = False
+                self.wake.set()
+                return
+            if len(data) < offset + PROC_EVENT_HDR.size + PROC_EVENT_PIDS.size:
+                continue
+            what, _, _ = PROC_EVENT_HDR.unpack_from(data, offset)
+            pid, tgid = PROC_EVENT_PIDS.unpack_from(data, offset + PROC_EVENT_HDR.size)
+            self._handle(what, pid, tgid)
@@ -5,6 +5,10 @@ games_config = {
         'launch_path': None,
         'scroll_text': '       Casa de Tathan       ',
         'ascii_file': None,
+        # optional: sprite sheet (frames stacked vertically, 32 rows each)
+        # or a list of single-frame files, played at ascii_animation_fps
+        'ascii_animation': None,
+        'ascii_animation_fps': 10,
         'led_color': [255, 255, 0],
         'led_color_2': [255, 255, 0],
         'led_effect': 'solid',
@@ -0,0 +1,252 @@
+import time
+import logging
+import argparse
+from threading import Thread, Event, Condition
+
+from pras3 import LEDs, Histogram, PRas3Exception
+
+###############################################################################
+# Several LED boards by node id, on one or more serial ports
+###############################################################################
+# Boards sharing a port take the commands addressed to their node id (set
+# with their DIP switches). A frame is about 205 bytes on the wire, 18 ms
+# at 115200 baud, so the boards of one port share roughly 55 frames/s.
+#
+#   bus = LEDBus({'p1': ('COM2', 1), 'p2': ('COM2', 2), 'marquee': ('COM3', 1)})
+#   bus.start()
+#   bus.submit('p1', frame)  # 198 bytes, like set_and_draw_pixels
+#
+#   python led_bus.py --board p1=/tmp/pras3/leds:1 --board p2=/tmp/pras3/leds:2 --confirm
+#   (python emulator.py --link /tmp/pras3 --led-nodes 1,2)
+BAUDRATE = 115200    # what pras3.LEDs opens ports at
+HOST_NODE_ID = 0x10  # src id replies come back to, no board can have it
+CMD_SET_AND_DRAW = 0x82
+WIRE_LEAD = 0.002    # seconds of data kept queued ahead of the wire
+MAX_MISSES = 3       # replies missed in a row before a board counts as absent
+PROBE_INTERVAL = 2.0 # seconds between frames sent to an absent board
+
+class _Board:
+    def __init__(self, name, port, node_id):
+        self.name = name
+        self.port = port
+        self.node_id = node_id
+        self.pending = None
+        self.submitted = 0
+        self.superseded = 0  # replaced by a newer frame before it went out
+        self.written = 0
+        self.dropped = 0     # the port was stalled
+        self.delivered = 0
+        self.lost = 0        # no reply in time
+        self.reply_latency = Histogram()  # write => reply, with confirm
+        self.misses = 0      # replies missed in a row
+        self.absent_until = 0.0
+
+    @property
+    def absent(self):
+        return self.misses >= MAX_MISSES
+
+class _Port:
+    def __init__(self, leds):
+        self.leds = leds
+        self.boards = []
+        self.cond = Condition()
+        self.wire_free = 0.0
+        self._next = 0
+
+    def next_pending(self):
+        """
+        Round robin over the boards that have a frame waiting. Absent
+        boards are skipped until their next probe is due.
+        """
+        n = len(self.boards)
+        now = time.monotonic()
+        for i in range(n):
+            board = self.boards[(self._next + i) % n]
+            if board.pending is not None and board.absent_until <= now:
+                self._next = (self._next + i + 1) % n
+                return board
+        return None
+
+class LEDBus:
+    """
+    Drives LED boards by name. boards: {name: (port, node id)}.
+
+    submit() only swaps in the board's pending frame (one that hasn't gone
+    out yet is dropped and counted as superseded), so producers never wait
+    on the wire. Each port has a writer thread that goes round its boards
+    in turn, one frame each, skipping boards with nothing new: a board
+    animating flat out gets its share of the port and no more. Writes are
+    paced by the time their bytes take on the wire, so little more than
+    one frame sits in the OS buffer and what goes out is never stale.
+
+    confirm: commands are sent with a reply address and every frame waits
+    for its board's reply, up to reply_timeout; it then counts as delivered
+    or lost. Boards don't reply to the 0 wildcard, so node ids must be 1-7.
+    A board that doesn't answer at startup or misses MAX_MISSES replies in
+    a row counts as absent: it's left out of the round robin so it doesn't
+    hold its port up for reply_timeout on every frame, and only its newest
+    frame goes out every PROBE_INTERVAL seconds to see if it's back.
+    """
+    def __init__(self, boards, confirm=False, reply_timeout=0.1, write_timeout=2.0):
+        self.confirm = confirm
+        self.reply_timeout = reply_timeout
+        self.boards = {}
+        self._ports = {}
+        self._threads = []
+        self._stop = Event()
+        for name, (port, node_id) in boards.items():
+            if not 0 <= node_id <= 7:
+                raise ValueError(f"{name}: node id {node_id} out of range 0-7")
+            if confirm and node_id == 0:
+                raise ValueError(f"{name}: confirm needs node ids 1-7, boards don't reply to 0")
+            if port not in self._ports:
+                leds = LEDs(port, write_timeout=write_timeout, timeout=reply_timeout,
+                            src_node_id=HOST_NODE_ID if confirm else 0)
+                self._ports[port] = _Port(leds)
+            board = _Board(name, self._ports[port], node_id)
+            board.port.boards.append(board)
+            self.boards[name] = board
+
+    def submit(self, name, frame):
+        "Queue frame (198 bytes) for the board, replacing one not yet written."
+        board = self.boards[name]
+        with board.port.cond:
+            if board.pending is not None:
+                board.superseded += 1
+            board.pending = frame
+            board.submitted += 1
+            board.port.cond.notify()
+
+    def start(self):
+        for port in self._ports.values():
+            thread = Thread(target=self._run, args=(port,), name="led-bus", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for port in self._ports.values():
+            with port.cond:
+                port.cond.notify()
+        for thread in self._threads:
+            thread.join()
+
+    # --- writer --------------------------------------------------------------
+    def _run(self, port):
+        if self.confirm:
+            for board in port.boards:
+                self._hello(port.leds, board)
+        while not self._stop.is_set():
+            with port.cond:
+                board = port.next_pending()
+                if board is None:
+                    port.cond.wait(0.25)
+                    continue
+                frame, board.pending = board.pending, None
+            delay = port.wire_free - WIRE_LEAD - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self._write(port, board, frame)
+            except Exception as e:
+                logging.error(f"LED bus write to {board.name} failed: {e}")
+
+    def _hello(self, leds, board):
+        "Turn off silent mode, which would stop the replies, and check the board is there."
+        leds.dst_node_id = board.node_id
+        leds.set_silent(False)
+        if not self._reply(leds, board, 0x14):
+            board.misses = MAX_MISSES
+            board.absent_until = time.monotonic() + PROBE_INTERVAL
+            logging.warning(f"LED board {board.name} (node {board.node_id}) didn't answer")
+
+    def _reply(self, leds, board, cmd):
+        "Wait for board's reply to cmd, skipping late replies to earlier commands."
+        deadline = time.monotonic() + self.reply_timeout
+        while True:
+            try:
+                src, reply_cmd, _ = leds.read_reply()
+            except PRas3Exception:
+                return False
+            if src == board.node_id and reply_cmd == cmd:
+                return True
+            if time.monotonic() > deadline:
+                return False
+
+    def _write(self, port, board, frame):
+        leds = port.leds
+        leds.dst_node_id = board.node_id
+        before = leds.stats.bytes_written
+        start = time.monotonic()
+        leds.set_and_draw_pixels(frame)
+        sent = leds.stats.bytes_written - before
+        if not sent:
+            board.dropped += 1
+            return
+        board.written += 1
+        port.wire_free = max(port.wire_free, start) + sent * 10 / BAUDRATE
+        if self.confirm:
+            if self._reply(leds, board, CMD_SET_AND_DRAW):
+                board.delivered += 1
+                board.reply_latency.observe(time.monotonic() - start)
+                if board.absent:
+                    logging.info(f"LED board {board.name} (node {board.node_id}) is back")
+                board.misses = 0
+                board.absent_until = 0.0
+            else:
+                board.lost += 1
+                board.misses += 1
+                if board.absent:
+                    if board.misses == MAX_MISSES:
+                        logging.warning(f"LED board {board.name} (node {board.node_id}) stopped answering")
+                    board.absent_until = time.monotonic() + PROBE_INTERVAL
+
+    def stats(self):
+        return {name: {'submitted': b.submitted, 'superseded': b.superseded, 'written': b.written,
+                       'dropped': b.dropped, 'delivered': b.delivered, 'lost': b.lost, 'absent': b.absent}
+                for name, b in self.boards.items()}
+
+###############################################################################
+# CLI: a rainbow on every board, to try a bus out
+###############################################################################
+def parse_board(spec):
+    "name=port:node => (name, (port, node))"
+    name, rest = spec.split("=", 1)
+    port, node_id = rest.rsplit(":", 1)
+    return name, (port, int(node_id))
+
+def main():
+    from effects import rainbow
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run a rainbow on several LED boards")
+    parser.add_argument("--board", action='append', required=True, metavar="NAME=PORT:NODE",
+                        help="e.g. p1=/dev/ttyS1:1, repeat for more boards")
+    parser.add_argument("--confirm", action='store_true', help="have the boards reply to every frame")
+    parser.add_argument("--fps", type=float, default=60.0, help="frames submitted per board per second")
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    bus = LEDBus(dict(parse_board(spec) for spec in args.board), confirm=args.confirm)
+    bus.start()
+    names = list(bus.boards)
+    leds = bus.boards[names[0]].port.leds
+    start = time.monotonic()
+    step = 0
+    while time.monotonic() - start < args.seconds:
+        for i, name in enumerate(names):
+            pixels = leds.remap_pixels(leds.NORMAL_MAPPING, rainbow.rainbow(22, (step + i * 64) & 255))
+            bus.submit(name, pixels * 3)
+        step += 1
+        time.sleep(1 / args.fps)
+    bus.stop()
+    elapsed = time.monotonic() - start
+    for name, s in bus.stats().items():
+        line = (f"{name}: {s['written']} written ({s['written'] / elapsed:.1f}/s) of {s['submitted']}, "
+                f"{s['superseded']} superseded, {s['dropped']} dropped")
+        if args.confirm:
+            line += f", {s['delivered']} delivered, {s['lost']} lost" + (" (absent)" if s['absent'] else "")
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
-import psutil
 import time
 import random
 import sys
 import os
 import logging
-from threading import Thread, Event, Lock
+import queue
+from threading import Thread, Event, Lock, Timer
+from concurrent.futures import ThreadPoolExecutor
 
 ###############################################################################
 # CONFIG: Debug mode toggle
@@ -19,30 +20,161 @@ else:
 ###############################################################################
 # Local Imports
 ###############################################################################
-from pras3 import LEDs, VFD, Color
-from effects import rainbow, vu_meter, color_sine
+from pras3 import LEDs, VFD, Color, Histogram, FrameTracer
+from effects import rainbow, vu_meter, color_sine, vfd_animation, vfd_text
+from effects.vfd_queue import VFDQueue, Priority
 from gameconfig import games_config, possible_effects
+from process_tracker import ProcessTracker
+from game_detector import GameDetector
+from config_store import ConfigStore, load_vfd_image
+from switch_filter import SwitchFilter
+from game_catalog import GameCatalog
+from session_log import SessionLog
+from metrics import MetricsRegistry, serve as serve_metrics
+from capture import CaptureLog
+import control
+from pixel_receiver import PixelReceiver
+import sync
 
 ###############################################################################
 # Global Variables
 ###############################################################################
-watchdog_poll_rate = 5  # seconds
+watchdog_poll_rate = 5  # seconds, safety net when process events are on
+fallback_poll_rate = 1  # seconds, when process events aren't available
 current_game_exe = 'NO_GAME'
 
+# a detected change must hold this long before the devices are touched
+switch_enter_delay = 0.5  # seconds, switching to a game
+switch_exit_delay = 3.0   # seconds, going back to NO_GAME
+switch_filter = SwitchFilter('NO_GAME', switch_enter_delay, switch_exit_delay)
+
+# serial timeouts, so a wedged device can't block everything else
+serial_write_timeout = 2.0  # seconds
+serial_read_timeout = 1.0   # seconds
+
+# None => the default ports (COM2/COM1, /dev/ttyS1//dev/ttyS0); set these
+# to emulator.py's ptys to run without a cabinet
+led_port = os.environ.get("PRAS3_LED_PORT")
+vfd_port = os.environ.get("PRAS3_VFD_PORT")
+
 led_thread = None
 stop_event = Event()
 led_lock = Lock()
 
-leds = LEDs()
-vfd = VFD()
+leds = LEDs(led_port, write_timeout=serial_write_timeout, timeout=serial_read_timeout)
+vfd = VFD(vfd_port, write_timeout=serial_write_timeout, timeout=serial_read_timeout)
+
+# local socket / named pipe launchers can send commands to (see
+# control.py), None = off
+control_address = os.environ.get("PRAS3_CONTROL", control.DEFAULT_ADDRESS)
+control_queue = queue.Queue()
+forced_game = None  # set by "game <name>", detection is skipped meanwhile
+current_vfd_text = ('', None)  # (text, char_bytes) overlays go back to
+
+# take LED frames from lighting software (E1.31/sACN, Art-Net, DDP) on this
+# universe while it sends; the game's effect comes back when it stops.
+# None = off
+pixel_input_universe = None
+pixel_input_start_channel = 1
+pixel_receiver = None
+current_led_settings = ('solid', [215, 230, 0], [0, 0, 0], None)  # (effect, c1, c2, frame)
+
+# cabinets in a group run the same effect on the same frame: the 'leader'
+# multicasts its effect and clock, 'follower's show that instead of their
+# own game's effect while a leader is around. None = off
+sync_role = os.environ.get("PRAS3_SYNC")
+sync_group = sync.DEFAULT_GROUP
+sync_port = int(os.environ.get("PRAS3_SYNC_PORT", sync.DEFAULT_PORT))
+sync_leader = None
+sync_follower = None
+
+# record everything sent to / read from the devices (python capture.py
+# info/compare/replay), None = off
+capture_file = os.environ.get("PRAS3_CAPTURE")
+serial_capture = None
+if capture_file:
+    serial_capture = CaptureLog(capture_file)
+    serial_capture.attach(leds, "leds")
+    serial_capture.attach(vfd, "vfd")
+
+# LED work for a game switch runs here, VFD work goes through vfd_queue,
+# so the two devices are set up in parallel
+led_worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="led")
+switch_generation = 0
+
+# seconds from switch detected to device updated, most recent last
+switch_latency = {'LED': [], 'VFD': []}
+switch_latency_lock = Lock()
+switch_latency_target = 0.5
+switch_latency_hist = {'LED': Histogram(), 'VFD': Histogram()}
+
+# Prometheus text on http://127.0.0.1:9108/metrics; a path here serves it
+# on a Unix socket instead, None turns it off
+metrics_address = "127.0.0.1:9108"
+metrics_registry = MetricsRegistry()
+
+# spans kept for the frame tracer, 0 turns it off. When on, the last
+# spans are at /trace on the metrics endpoint and written to
+# frame_trace_file on exit; open them in ui.perfetto.dev
+frame_trace_size = 0
+frame_trace_file = os.path.join(os.path.expanduser("~"), "pras3_trace.json")
+
+# set when a stalled device comes back so the main loop re-applies the game
+resync_event = Event()
+
+vfd_thread = None
+vfd_stop_event = Event()
+vfd_lock = Lock()
+
+# all VFD commands go through here so text/brightness can cut in
+# between the chunks of a big image upload
+vfd_queue = VFDQueue(vfd, lock=vfd_lock)
+
+# characters the VFD can't encode are drawn with this font into its
+# custom glyph slots. MS Gothic has Latin at 8 columns and CJK at 16, the
+# two slot sizes; None (or a font that won't load) falls back to Pillow's
+# default font, which has little beyond ASCII
+vfd_font_path = r"C:\Windows\Fonts\msgothic.ttc"
+try:
+    glyph_atlas = vfd_text.GlyphAtlas(vfd_font_path)
+except OSError as e:
+    logging.warning(f"Can't load VFD font {vfd_font_path} ({e}), using Pillow's default font")
+    glyph_atlas = vfd_text.GlyphAtlas()
+glyph_slots = vfd_text.GlyphSlots(vfd, glyph_atlas)
 
 coin_thread = None
 coin_stop_event = Event()
 
-unknown_games_file = os.path.join(os.path.expanduser("~"), "unknown_games.txt")
+# only new processes get inspected on each poll
+game_folders = [r"c:\games", r"c:\emulators"]
+process_tracker = ProcessTracker(game_folders)
+# wakes the main loop on game start/exit where the OS supports it
+game_detector = GameDetector(game_folders, process_tracker)
+
+# every game seen, with a fixed random look for unknown ones
+# (python game_catalog.py <file> prints them as games.json entries)
+game_catalog = GameCatalog(os.path.join(os.path.expanduser("~"), "game_catalog.sqlite3"))
+# last exe path seen for each detected game
+game_paths = {}
+
+# start/stop of every play session, with per-game daily totals
+session_log = SessionLog(os.path.join(os.path.expanduser("~"), "game_sessions.log"),
+                         os.path.join(os.path.expanduser("~"), "game_sessions.json"))
 
 CASA_SPACING = "           Casa de Tathan           "
 
+def scroll_text_for(text):
+    """If blank => show CASA_SPACING. Else => text + CASA_SPACING."""
+    if not text.strip():
+        return CASA_SPACING
+    return f"{text}   {CASA_SPACING}"
+
+# games.json next to this file (a .toml path works too) overrides
+# gameconfig.py and is reloaded when it changes. Entries are compiled once
+# into device data.
+games_config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "games.json")
+config_store = ConfigStore(games_config_file, games_config, possible_effects, leds, vfd, scroll_text_for)
+
 ###############################################################################
 # Coin blink logic
 ###############################################################################
@@ -80,25 +212,29 @@ def coin_watcher():
 ###############################################################################
 # LED effect with built-in hardware fade
 ###############################################################################
-def run_led_effect(effect_name, led_color, led_color_2):
+def run_led_effect(effect_name, led_color, led_color_2, init_buf=None, started=None, clock=None):
     """
     Stop old effect, set blend timing, do fade_to_pixels to an initial pattern,
     then start the infinite effect if needed (rainbow, etc.).
+    init_buf: precompiled initial pattern (198 bytes), skips building it here.
+    started: when the switch was detected, to record the LED switch latency.
+    clock: shared clock of the cabinet group (sync.EffectClock), or None.
     """
     global led_thread
 
-    if led_thread and led_thread.is_alive():
-        stop_event.set()
-        led_thread.join()
-        stop_event.clear()
+    stop_led_effect()
 
-    with led_lock:
+    # blend timing + first frame go out as one write
+    with led_lock, leds.batch():
         # set a more gentle fade
         # e.g. 60 frames, 2 ms each => 120ms total, you can adjust to preference
         leds.set_blend_timing(60, 2)
 
         # Build initial buffer for the new effect
-        if effect_name == 'solid':
+        if init_buf is not None:
+            leds.fade_to_pixels(init_buf)
+
+        elif effect_name == 'solid':
             c = Color(*led_color)
             init_px = leds.build_pixels(c, c, c)  # 66 bytes
             big_buf = init_px * 3
@@ -132,6 +268,9 @@ def run_led_effect(effect_name, led_color, led_color_2):
             big_buf = init_px * 3
             leds.fade_to_pixels(big_buf)
 
+    if started is not None:
+        record_switch_latency('LED', started)
+
     # wait for fade to finish
     time.sleep(0.5)
 
@@ -139,24 +278,33 @@ def run_led_effect(effect_name, led_color, led_color_2):
         try:
             if effect_name == 'solid':
                 while not stop_event.is_set():
-                    time.sleep(0.25)
+                    stop_event.wait(0.25)
             elif effect_name == 'two color':
-                color_sine.animate(leds, led_color, led_color_2, stop_event=stop_event)
+                color_sine.animate(leds, led_color, led_color_2, stop_event=stop_event, clock=clock)
             elif effect_name == 'rainbow':
                 # start the actual rainbow loop
-                rainbow.animate(leds, speed=0.01, stop_event=stop_event)
+                rainbow.animate(leds, speed=0.01, stop_event=stop_event, clock=clock)
             elif effect_name == 'vu meter':
                 c_obj = Color(*led_color)
                 vu_meter.animate_symmetric(leds, c_obj, stop_event=stop_event)
             else:
                 while not stop_event.is_set():
-                    time.sleep(0.25)
+                    stop_event.wait(0.25)
         except Exception as e:
             logging.error(f"Error in effect_runner: {e}")
 
     led_thread = Thread(target=effect_runner, daemon=True)
     led_thread.start()
 
+def stop_led_effect():
+    global led_thread
+
+    if led_thread and led_thread.is_alive():
+        stop_event.set()
+        led_thread.join()
+        stop_event.clear()
+    led_thread = None
+
 def build_rainbow_frame(num_leds, step=0):
     """
     Build a single "rainbow" frame (22 * 3 bytes) so we can fade into it initially.
@@ -188,145 +336,429 @@ def wheel(pos):
 ###############################################################################
 def set_vfd_image(path):
     try:
-        vfd.turn_on(True)
-        with open(path, "r", encoding='utf-8') as f:
-            lines = f.readlines()
-        if lines and lines[-1].strip() == "":
-            lines.pop()
-        w, h, image = vfd.convert_ascii_art(lines)
-        image = vfd.rotate_bitmap(image, w, h)
-        vfd.draw_bitmap(0, 0, w, h // 8, image)
+        show_vfd_image(*load_vfd_image(path))
     except Exception as e:
         logging.error(f"Error in set_vfd_image: {e}")
 
-def set_vfd_text(text):
+def show_vfd_image(w, h, image):
+    """Queue an already column-major image for upload."""
+    vfd_queue.submit(vfd.turn_on, True, priority=Priority.URGENT)
+    vfd_queue.draw_bitmap(0, 0, w, h // 8, image)
+
+def stop_vfd_animation():
+    global vfd_thread
+
+    if vfd_thread and vfd_thread.is_alive():
+        vfd_stop_event.set()
+        vfd_thread.join()
+        vfd_stop_event.clear()
+    vfd_thread = None
+
+def run_vfd_animation(cache, fps):
     """
-    If blank => show CASA_SPACING. Else => text + CASA_SPACING.
-    Write it twice with a short sleep to ensure it's displayed.
+    Play back a decoded animation (FrameCache) on its own thread until the
+    next game switch.
     """
-    try:
-        if not text.strip():
-            final_text = CASA_SPACING
-        else:
-            final_text = f"{text}   {CASA_SPACING}"
+    global vfd_thread
 
-        vfd.set_text_window(0, 2, 160)
-        vfd.set_text_scroll_speed(1)
-        vfd.set_brightness(4)
+    stop_vfd_animation()
 
-        vfd.write_scroll_text(final_text)
-        time.sleep(0.3)
-        vfd.write_scroll_text(final_text)
+    def animation_runner():
+        try:
+            stats = vfd_animation.animate(vfd, cache, fps=fps, stop_event=vfd_stop_event, lock=vfd_lock)
+            logging.info(f"VFD animation stopped => {stats}")
+        except Exception as e:
+            logging.error(f"Error in animation_runner: {e}")
+
+    vfd_thread = Thread(target=animation_runner, daemon=True)
+    vfd_thread.start()
+
+def set_vfd_text(text, char_bytes=None):
+    """
+    If blank => show CASA_SPACING. Else => text + CASA_SPACING.
+    Written once; the queue worker waits for the VFD to take it.
+    char_bytes: precompiled encoding of the final text, if there is one.
+    """
+    try:
+        final_text = scroll_text_for(text)
+
+        def write_text():
+            # glyph uploads (if any) and the text setup go out as one write
+            with vfd.batch():
+                encoded = char_bytes
+                if encoded is None:
+                    encoded = glyph_slots.encode(final_text)
+                vfd.set_text_window(0, 2, 160)
+                vfd.set_text_scroll_speed(1)
+                vfd.set_brightness(4)
+                vfd.write_scroll_text(encoded)
+            if not vfd.wait_ready():
+                logging.warning("VFD did not accept scroll text in time")
+
+        vfd_queue.submit(write_text, priority=Priority.URGENT)
 
         logging.info(f"VFD text => '{text}' => '{final_text}'")
 
     except Exception as e:
         logging.error(f"Error in set_vfd_text: {e}")
 
-def write_unknown_game(game_exe):
+def catalog_session(game_exe, known):
+    """Count a session in the catalog. Returns the entry, or None on error."""
     try:
-        if not os.path.exists(unknown_games_file):
-            with open(unknown_games_file, "w") as f:
-                f.write("# Unknown Games\n\n")
-
-        with open(unknown_games_file, "a") as f:
-            f.write(
-                f"'{game_exe}': {{\n"
-                f"    'launch_path': r'C:\\Games\\Unknown\\{game_exe}',\n"
-                f"    'scroll_text': 'Playing Unknown Game ({game_exe})',\n"
-                f"}},\n\n"
-            )
+        return game_catalog.record_session(game_exe, game_paths.get(game_exe), known=known,
+                                           make_look=random_look)
     except Exception as e:
-        logging.error(f"Error in write_unknown_game: {e}")
+        logging.error(f"Error in catalog_session: {e}")
+        return None
+
+
+def log_session_change(old_game, new_game):
+    try:
+        if old_game != 'NO_GAME':
+            session_log.stop(old_game)
+        if new_game != 'NO_GAME':
+            session_log.start(new_game)
+    except Exception as e:
+        logging.error(f"Error in log_session_change: {e}")
+
+
+###############################################################################
+# Device stalls
+###############################################################################
+def device_recovered(dev):
+    logging.warning(f"{type(dev).__name__} recovered after {dev.stalled_time:.1f}s stalled "
+                    f"({dev.last_stall_reason}), restoring state")
+    resync_event.set()
+
+def check_device_stalls():
+    for dev in (leds, vfd):
+        if dev.stalled:
+            logging.warning(f"{type(dev).__name__} stalled ({dev.last_stall_reason}): "
+                            f"{dev.stalled_time:.1f}s total, {dev.dropped_writes} writes dropped, "
+                            f"{dev.reopen_count} reopens")
+
+leds.on_recover = device_recovered
+vfd.on_recover = device_recovered
+
+
+###############################################################################
+# Switch latency
+###############################################################################
+def record_switch_latency(device, started):
+    """Time from the switch being detected to the device showing the new game."""
+    latency = time.monotonic() - started
+    with switch_latency_lock:
+        history = switch_latency[device]
+        history.append(latency)
+        del history[:-100]
+        switch_latency_hist[device].observe(latency)
+    if latency > switch_latency_target:
+        logging.warning(f"{device} switch took {latency * 1000:.0f} ms "
+                        f"(target {switch_latency_target * 1000:.0f} ms)")
+    else:
+        logging.info(f"{device} switch took {latency * 1000:.0f} ms")
+
+def switch_latency_stats():
+    with switch_latency_lock:
+        return {device: {'count': len(h), 'last': h[-1] if h else 0.0,
+                         'mean': sum(h) / len(h) if h else 0.0, 'max': max(h, default=0.0)}
+                for device, h in switch_latency.items()}
+
+def random_color():
+    return [random.randint(0, 255) for _ in range(3)]
+
+def random_look():
+    return (random.choice(possible_effects), random_color(), random_color())
+
+
+###############################################################################
+# Metrics
+###############################################################################
+def daemon_metrics():
+    """Collector for metrics_registry, everything that isn't per device."""
+    with switch_latency_lock:
+        latency = [({'device': d}, h) for d, h in switch_latency_hist.items()]
+    queue = vfd_queue.latency_stats()
+    return [
+        ("pras3_switch_latency_seconds", "histogram",
+         "Time from a switch being detected to the device showing it.", latency),
+        ("pras3_switches_total", "counter", "Game switches applied.", [({}, switch_filter.switches)]),
+        ("pras3_switches_suppressed_total", "counter", "Switches dropped because the game came back.",
+         [({}, switch_filter.suppressed)]),
+        ("pras3_switches_coalesced_total", "counter", "Switches replaced by another before applying.",
+         [({}, switch_filter.coalesced)]),
+        ("pras3_vfd_queue_jobs_total", "counter", "VFD queue jobs finished.",
+         [({'priority': p}, q['count']) for p, q in queue.items()]),
+        ("pras3_vfd_queue_latency_mean_seconds", "gauge", "Mean submit to done time of VFD queue jobs.",
+         [({'priority': p}, q['mean']) for p, q in queue.items()]),
+        ("pras3_vfd_queue_latency_max_seconds", "gauge", "Worst submit to done time of VFD queue jobs.",
+         [({'priority': p}, q['max']) for p, q in queue.items()]),
+        ("pras3_config_reloads_total", "counter", "Game config reloads.", [({}, config_store.reloads)]),
+        ("pras3_current_game", "gauge", "1 for the game currently applied.", [({'game': current_game_exe}, 1)]),
+    ]
+
+metrics_registry.add_device('leds', leds)
+metrics_registry.add_device('vfd', vfd)
+metrics_registry.add_collector(daemon_metrics)
+
+if frame_trace_size:
+    leds.tracer = vfd.tracer = metrics_registry.tracer = FrameTracer(frame_trace_size)
 
 
 ###############################################################################
 # apply_game_settings
 ###############################################################################
-def apply_game_settings(game_exe):
+def setup_vfd(started, image, text, char_bytes, animation, fps):
     """
-    If it's NO_GAME => forcibly set text to blank => we show CASA_SPACING,
-    led_color => [255,255,0], effect => 'solid', etc.
-    Otherwise, read from gameconfig or do unknown fallback.
+    Everything here only queues work for the VFD worker, in order:
+    stopping the old animation, reset, image chunks, text, then the
+    animation start and the latency marker once the rest went out.
+    Nothing waits, so this returns to the watchdog right away.
     """
-    try:
-        # reset the VFD
+    global current_vfd_text
+
+    # reset the VFD, dropping whatever is left of the previous game's image
+    def reset_vfd():
+        # the VFD holds off CTS while it resets, so anything sent right
+        # after is only safe once it's ready again
         vfd.reset()
+        if not vfd.wait_ready():
+            logging.warning("VFD still busy after reset")
         vfd.turn_on(True)
+        glyph_slots.forget()
 
-        if game_exe == 'NO_GAME':
+    # drop the previous game's pending work; a job already running (even
+    # one starting the old animation) finishes before the stop below runs.
+    # The stop joins the animation thread, which takes vfd_lock per frame,
+    # so it must not hold the lock itself
+    vfd_queue.clear()
+    vfd_queue.submit(stop_vfd_animation, priority=Priority.URGENT, locked=False)
+    vfd_queue.submit(reset_vfd, priority=Priority.URGENT)
 
+    if image:
+        show_vfd_image(*image)
 
-            # Force the color to [255,255,0] (yellow)
-            # Force the text to blank so set_vfd_text => CASA_SPACING
-#            set_vfd_text('                      {CASA_SPACING}                      ')
-#            time.sleep(1.0)
-#            txt = cfg.get('scroll_text', '')
-#            ascii_file = cfg.get('ascii_file', None)
-#
-#            if ascii_file:
-#                set_vfd_image(ascii_file)
+    current_vfd_text = (text, char_bytes)
+    set_vfd_text(text, char_bytes)
 
-#            set_vfd_text(txt)
-#            time.sleep(1.0)
+    # started from the queue so no frame can land before the reset
+    if animation:
+        vfd_queue.submit(run_vfd_animation, animation, fps, priority=Priority.BULK)
+    vfd_queue.submit(record_switch_latency, 'VFD', started, priority=Priority.BULK)
 
-#            eff = cfg.get('led_effect', 'solid')
-#            c1 = cfg.get('led_color', [255, 255, 255])
-#            c2 = cfg.get('led_color_2', [0, 0, 0])
-#            txt = cfg.get('scroll_text', 'CASA DE TATHAN')
+def setup_leds(generation, started, eff, c1, c2, led_frame):
+    """
+    Runs on the LED worker. Skipped if another switch came in meanwhile,
+    and held back while network pixel input or a sync leader has the LEDs.
+    """
+    global current_led_settings
+
+    if generation != switch_generation:
+        return
+    current_led_settings = (eff, c1, c2, led_frame)
+    if pixel_receiver and pixel_receiver.active:
+        return
+    if sync_follower and sync_follower.active:
+        return
+    try:
+        logging.info(f"Starting effect => {eff}, c1={c1}, c2={c2}")
+        clock = sync_leader.set_state(eff, c1, c2) if sync_leader else None
+        run_led_effect(eff, c1, c2, led_frame, started, clock)
+    except Exception as e:
+        logging.error(f"Error in setup_leds: {e}")
 
-            if ascii_file:
-                set_vfd_image(ascii_file)
+def apply_game_settings(game_exe, catalog_entry=None):
+    """
+    If it's NO_GAME => forcibly set text to blank => we show CASA_SPACING,
+    led_color => [255,255,0], effect => 'solid', etc.
+    Otherwise, read from gameconfig or do unknown fallback, with the look
+    from catalog_entry (see catalog_session) for unknown games.
 
-            set_vfd_text(txt)
-            time.sleep(1.0)
+    Only works out the settings; the VFD and LED work is handed to their
+    workers so this returns to the watchdog right away.
+    """
+    global switch_generation
 
+    started = time.monotonic()
+    switch_generation += 1
+    try:
+        logging.info(f"VFD queue latency => {vfd_queue.latency_stats()}")
+        logging.info(f"Switch latency => {switch_latency_stats()}")
 
+        image = animation = char_bytes = led_frame = None
+        fps = 10
+
+        if game_exe == 'NO_GAME':
+            # Force the color to [215,230,0] (yellow)
+            # Force the text to blank so set_vfd_text => CASA_SPACING
+            game = config_store.get('NO_GAME')
+            if game:
+                image = game.vfd_image
+            txt = ''
 
             # run_led_effect => 'solid'
-            c1 = [215,230,0]
+            eff, c1, c2 = 'solid', [215,230,0], [0,0,0]
             logging.info("Applying NO_GAME => solid yellow + Casa de Tathan text")
-            run_led_effect('solid', c1, [0,0,0])
-            return
 
-        # Else, check known config
-        cfg = games_config.get(game_exe)
-        if cfg:
-            eff = cfg.get('led_effect', 'solid')
-            c1 = cfg.get('led_color', [255, 255, 255])
-            c2 = cfg.get('led_color_2', [0, 0, 0])
-            txt = cfg.get('scroll_text', '')
-            ascii_file = cfg.get('ascii_file', None)
+        else:
+            # Else, check known config
+            game = config_store.get(game_exe)
+            if game:
+                eff = game.led_effect
+                c1 = game.led_color
+                c2 = game.led_color_2
+                txt = game.scroll_text
+                char_bytes = game.scroll_bytes
+                image = game.vfd_image
+                animation = game.animation
+                fps = game.animation_fps
+                led_frame = game.led_frame
+
+                # If effect == 'solid', maybe turn off scroll
+#                if eff == 'solid':
+#                    vfd.set_text_scroll(False)
 
-            if ascii_file:
-                set_vfd_image(ascii_file)
+            else:
+                # unknown game => same random look every time it's played
+                if catalog_entry and catalog_entry['led_effect']:
+                    eff = catalog_entry['led_effect']
+                    c1 = catalog_entry['led_color']
+                    c2 = catalog_entry['led_color_2']
+                    logging.warning(f"Unknown game: {game_exe} (session {catalog_entry['sessions']})")
+                else:
+                    eff, c1, c2 = random_look()
+                    logging.warning(f"Unknown game: {game_exe}")
+                txt = f"Playing Unknown Game ({game_exe})"
 
-            set_vfd_text(txt)
-            time.sleep(1.0)
+        setup_vfd(started, image, txt, char_bytes, animation, fps)
+        led_worker.submit(setup_leds, switch_generation, started, eff, c1, c2, led_frame)
 
-            # If effect == 'solid', maybe turn off scroll
-#            if eff == 'solid':
-#                vfd.set_text_scroll(False)
+    except Exception as e:
+        logging.error(f"Error in apply_game_settings: {e}")
 
-            logging.info(f"Starting effect => {eff}, c1={c1}, c2={c2}")
-            run_led_effect(eff, c1, c2)
 
-        else:
-            # unknown game
-            logging.warning(f"Unknown game: {game_exe}")
-            write_unknown_game(game_exe)
+###############################################################################
+# Control API
+###############################################################################
+def queue_control(verb, args):
+    """Called from the control connections: hand over to the main loop."""
+    control_queue.put((verb, args))
+    game_detector.wake.set()
+
+def show_overlay_text(message, seconds):
+    """Show message, then the current text again unless a switch came first."""
+    generation = switch_generation
+    set_vfd_text(message)
+
+    def restore():
+        if generation == switch_generation:
+            set_vfd_text(*current_vfd_text)
+
+    timer = Timer(seconds, restore)
+    timer.daemon = True
+    timer.start()
+
+def handle_control():
+    """Run the queued control commands, on the main loop."""
+    global forced_game, current_vfd_text
+    while True:
+        try:
+            verb, args = control_queue.get_nowait()
+        except queue.Empty:
+            return
+        logging.info(f"Control => {verb} {args}")
+        try:
+            if verb == 'game':
+                forced_game = None if args[0] == 'auto' else args[0]
+            elif verb == 'effect':
+                eff, c1, c2 = args
+                led_worker.submit(setup_leds, switch_generation, None, eff, c1, c2, None)
+            elif verb == 'text':
+                current_vfd_text = (args[0], None)
+                set_vfd_text(args[0])
+            elif verb == 'overlay' and args[0] == 'blink':
+                blink_once(tuple(args[1]), args[2])
+            elif verb == 'overlay' and args[0] == 'text':
+                show_overlay_text(args[2], args[1])
+        except Exception as e:
+            logging.error(f"Error in handle_control: {e}")
+
 
-            c1 = random_color()
-            c2 = random_color()
-            eff = random.choice(possible_effects)
-            txt = f"Playing Unknown Game ({game_exe})"
+###############################################################################
+# Network pixel input
+###############################################################################
+def pixel_input_changed(active):
+    """The receiver took over the LEDs, or gave them back."""
+    if active:
+        led_worker.submit(stop_led_effect)
+    else:
+        led_worker.submit(setup_leds, switch_generation, None, *current_led_settings)
+
+def pixel_input_metrics():
+    s = pixel_receiver.stats()
+    return [
+        ("pras3_pixel_input_packets_total", "counter", "Network pixel packets received.",
+         [({'result': k}, s[k]) for k in ('frames', 'out_of_order', 'ignored', 'malformed', 'superseded')]),
+        ("pras3_pixel_input_active", "gauge", "1 while network pixel input has the LEDs.",
+         [({}, int(pixel_receiver.active))]),
+        ("pras3_pixel_input_latency_seconds", "histogram", "Packet received to frame written.",
+         [({}, pixel_receiver.latency)]),
+    ]
+
+if pixel_input_universe is not None:
+    try:
+        pixel_receiver = PixelReceiver(leds, pixel_input_universe, pixel_input_start_channel,
+                                       lock=led_lock, on_active=pixel_input_changed)
+        metrics_registry.add_collector(pixel_input_metrics)
+    except OSError as e:
+        logging.error(f"Couldn't open network pixel input: {e}")
 
-            set_vfd_text(txt)
-            time.sleep(1.0)
-            run_led_effect(eff, c1, c2)
 
+###############################################################################
+# Multi-cabinet sync
+###############################################################################
+def run_synced_effect(eff, c1, c2, clock):
+    """Runs on the LED worker: the leader's effect, on its clock."""
+    if pixel_receiver and pixel_receiver.active:
+        return
+    try:
+        logging.info(f"Following effect => {eff}, c1={c1}, c2={c2}")
+        run_led_effect(eff, c1, c2, clock=clock)
     except Exception as e:
-        logging.error(f"Error in apply_game_settings: {e}")
+        logging.error(f"Error in run_synced_effect: {e}")
+
+def sync_state_changed(eff, c1, c2, clock):
+    """The leader switched effect, or went away (eff is None)."""
+    if eff is None:
+        led_worker.submit(setup_leds, switch_generation, None, *current_led_settings)
+    else:
+        led_worker.submit(run_synced_effect, eff, c1, c2, clock)
+
+def sync_metrics():
+    if sync_leader:
+        return [("pras3_sync_beacons_sent_total", "counter", "Sync beacons sent as leader.",
+                 [({}, sync_leader.sent)])]
+    return [
+        ("pras3_sync_beacons_received_total", "counter", "Sync beacons received as follower.",
+         [({'result': 'ok'}, sync_follower.received), ({'result': 'out_of_order'}, sync_follower.out_of_order)]),
+        ("pras3_sync_following", "gauge", "1 while a sync leader has the LEDs.",
+         [({}, int(sync_follower.active))]),
+        ("pras3_sync_clock_offset_seconds", "gauge", "Leader clock minus local monotonic clock.",
+         [({}, sync_follower.clock.offset)]),
+    ]
+
+if sync_role:
+    try:
+        if sync_role == 'leader':
+            sync_leader = sync.SyncLeader(possible_effects, sync_group, sync_port)
+        elif sync_role == 'follower':
+            sync_follower = sync.SyncFollower(possible_effects, sync_state_changed, sync_group, sync_port)
+        else:
+            logging.error(f"Unknown sync role '{sync_role}', expected leader or follower")
+        if sync_leader or sync_follower:
+            metrics_registry.add_collector(sync_metrics)
+    except OSError as e:
+        logging.error(f"Couldn't open cabinet sync on {sync_group}:{sync_port}: {e}")
 
 
 ###############################################################################
@@ -335,22 +767,22 @@ def apply_game_settings(game_exe):
 def find_game_exe_in_target_folders():
     """
     Look for a process whose exe path starts with c:\\games or c:\\emulators.
-    Return .name if found, else None.
+    Return its games_config key if one matches (by launch_path, then name),
+    else the .name of the first one found, else None.
     """
     try:
-        targets = [r"c:\games", r"c:\emulators"]
-        for proc in psutil.process_iter(['pid','name','exe']):
-            try:
-                pexe = proc.info['exe']
-                if not pexe:
-                    continue
-                pexe_lower = pexe.lower()
-                for t in targets:
-                    if pexe_lower.startswith(t.lower()):
-                        logging.info(f"Found game: {proc.info['name']} => {pexe}")
-                        return proc.info['name']
-            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                pass
+        games = process_tracker.scan()
+        game_detector.watch([pid for pid, name, pexe in games])
+        for pid, name, pexe in games:
+            key = config_store.index.lookup(name, pexe)
+            if key:
+                game_paths[key] = pexe
+                logging.info(f"Found game: {name} => {pexe} => '{key}'")
+                return key
+        for pid, name, pexe in games:
+            game_paths[name] = pexe
+            logging.info(f"Found unknown game: {name} => {pexe}")
+            return name
     except Exception as e:
         logging.error(f"Error in find_game_exe_in_target_folders: {e}")
     return None
@@ -361,7 +793,35 @@ def find_game_exe_in_target_folders():
 ###############################################################################
 if __name__ == "__main__":
     try:
-        logging.info(f"Game detection started, checking every {watchdog_poll_rate} secs.")
+        if metrics_address:
+            try:
+                serve_metrics(metrics_registry, metrics_address)
+                logging.info(f"Metrics on {metrics_address}")
+            except OSError as e:
+                logging.error(f"Couldn't start metrics endpoint on {metrics_address}: {e}")
+
+        if control_address:
+            try:
+                control_server = control.ControlServer(control_address, queue_control, possible_effects,
+                                                       status=lambda: current_game_exe,
+                                                       authkey=control.load_authkey(create=True))
+                control_server.start()
+                logging.info(f"Control API on {control_address}")
+            except OSError as e:
+                logging.error(f"Couldn't start control API on {control_address}: {e}")
+
+        if pixel_receiver:
+            pixel_receiver.start()
+            logging.info(f"Network pixel input on universe {pixel_input_universe}")
+
+        if sync_leader or sync_follower:
+            (sync_leader or sync_follower).start()
+            logging.info(f"Cabinet sync as {sync_role} on {sync_group}:{sync_port}")
+
+        game_detector.start()
+        poll_rate = watchdog_poll_rate if game_detector.available else fallback_poll_rate
+        logging.info(f"Game detection started, checking every {poll_rate} secs.")
+        logging.info(f"Top games this week => {session_log.top_games()}")
 
         # Start coin watcher
         coin_thread = Thread(target=coin_watcher, daemon=True)
@@ -370,31 +830,63 @@ if __name__ == "__main__":
         # Start with NO_GAME
         apply_game_settings('NO_GAME')
         current_game_exe = 'NO_GAME'
+        catalog_entry = None
 
         while True:
-            new_game_exe = find_game_exe_in_target_folders()
-            logging.info(f"Detected game exe: {new_game_exe}")
-
-            if new_game_exe:
-                if new_game_exe != current_game_exe:
-                    logging.info(f"Switching from '{current_game_exe}' to '{new_game_exe}'")
-                    apply_game_settings(new_game_exe)
-                    current_game_exe = new_game_exe
-                else:
-                    logging.info(f"{new_game_exe} is already active. No action.")
+            handle_control()
+            if forced_game:
+                # a launcher said so, no need to wait for it to settle
+                switch_to = switch_filter.force(forced_game)
             else:
-                if current_game_exe != 'NO_GAME':
-                    logging.info("No recognized game => applying NO_GAME.")
-                    apply_game_settings('NO_GAME')
-                    current_game_exe = 'NO_GAME'
-                else:
-                    logging.info("Still NO_GAME => no action.")
-
-            time.sleep(watchdog_poll_rate)
+                new_game_exe = find_game_exe_in_target_folders()
+                logging.info(f"Detected game exe: {new_game_exe}")
+
+                # only the final, stable result of a burst of changes gets applied
+                switch_to = switch_filter.observe(new_game_exe or 'NO_GAME')
+            if switch_to:
+                logging.info(f"Switching from '{current_game_exe}' to '{switch_to}' "
+                             f"(suppressed {switch_filter.suppressed}, coalesced {switch_filter.coalesced} so far)")
+                # counted here only, re-applying after a device recovery
+                # isn't a new session
+                catalog_entry = None
+                if switch_to != 'NO_GAME':
+                    catalog_entry = catalog_session(switch_to, known=config_store.get(switch_to) is not None)
+                apply_game_settings(switch_to, catalog_entry)
+                log_session_change(current_game_exe, switch_to)
+                current_game_exe = switch_to
+            elif switch_filter.pending is not None:
+                logging.info(f"'{switch_filter.pending}' pending, "
+                             f"{switch_filter.time_to_decision():.1f}s until it's applied.")
+            else:
+                logging.info(f"{current_game_exe} is already active. No action.")
+
+            # pick up edits to games.json without restarting
+            config_store.poll()
+
+            if resync_event.is_set():
+                resync_event.clear()
+                logging.info(f"Re-applying '{current_game_exe}' after device recovery.")
+                apply_game_settings(current_game_exe, catalog_entry)
+            check_device_stalls()
+
+            # a process event cuts the wait short, a pending switch is
+            # re-checked when its delay is up
+            poll_rate = watchdog_poll_rate if game_detector.available else fallback_poll_rate
+            pending = switch_filter.time_to_decision()
+            if pending is not None:
+                poll_rate = min(poll_rate, pending)
+            game_detector.wake.wait(poll_rate)
+            game_detector.wake.clear()
 
     except KeyboardInterrupt:
         logging.info("Exiting on Ctrl+C")
         coin_stop_event.set()
+        session_log.close()
+        if serial_capture:
+            serial_capture.close()
+        if metrics_registry.tracer is not None:
+            metrics_registry.tracer.dump(frame_trace_file)
+            logging.info(f"Frame trace written to {frame_trace_file}")
     except Exception as exc:
         logging.error(f"ERROR: {exc}")
         coin_stop_event.set()
@@ -0,0 +1,175 @@
+import os
+import time
+import socket
+import socketserver
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread, Lock
+
+from pras3 import Histogram
+
+###############################################################################
+# Prometheus metrics endpoint
+###############################################################################
+def _labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+def _number(v):
+    if v == float('inf'):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(int(v))
+
+def format_metric(name, kind, help_text, samples):
+    """
+    One metric family in the Prometheus text format.
+    samples: [(labels dict, value)], a value can be a Histogram.
+    """
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for labels, value in samples:
+        if isinstance(value, Histogram):
+            for bound, count in value.cumulative():
+                lines.append(f"{name}_bucket{_labels(dict(labels, le=_number(bound)))} {count}")
+            lines.append(f"{name}_sum{_labels(labels)} {_number(value.sum)}")
+            lines.append(f"{name}_count{_labels(labels)} {value.count}")
+        else:
+            lines.append(f"{name}{_labels(labels)} {_number(value)}")
+    return lines
+
+class MetricsRegistry:
+    """
+    Collects the DeviceStats of each device plus whatever collectors the
+    daemon adds, and renders them as Prometheus text.
+
+    A collector is a function returning [(name, kind, help, samples)] in
+    the form format_metric() takes; it's called on every scrape.
+
+    Commands/frames per second are worked out over the time since the
+    previous scrape. With a Prometheus server scraping, rate() over the
+    _total counters is the better number.
+
+    If .tracer is set to a FrameTracer, /trace returns its spans as
+    Chrome trace JSON.
+    """
+    def __init__(self):
+        self.tracer = None
+        self._devices = {}
+        self._collectors = []
+        self._lock = Lock()
+        self._last = {}  # device name -> (time, commands, frames)
+
+    def add_device(self, name, device):
+        self._devices[name] = device
+
+    def add_collector(self, func):
+        self._collectors.append(func)
+
+    def _rates(self, name, stats, now):
+        prev = self._last.get(name)
+        self._last[name] = (now, stats.commands, stats.frames)
+        if prev is None or now <= prev[0]:
+            return 0.0, 0.0
+        elapsed = now - prev[0]
+        return (stats.commands - prev[1]) / elapsed, (stats.frames - prev[2]) / elapsed
+
+    def _device_metrics(self):
+        now = time.monotonic()
+        families = {}
+        def add(name, kind, help_text, labels, value):
+            families.setdefault(name, (kind, help_text, []))[2].append((labels, value))
+
+        for name, device in self._devices.items():
+            stats = device.stats
+            labels = {'device': name}
+            commands_rate, frames_rate = self._rates(name, stats, now)
+            add("pras3_bytes_written_total", "counter", "Bytes written to the port.", labels, stats.bytes_written)
+            add("pras3_writes_total", "counter", "Port writes, a batch counts once.", labels, stats.writes)
+            add("pras3_commands_total", "counter", "Commands issued.", labels, stats.commands)
+            add("pras3_commands_per_second", "gauge", "Commands per second since the previous scrape.", labels, commands_rate)
+            add("pras3_frames_total", "counter", "LED frames / VFD bitmaps sent.", labels, stats.frames)
+            add("pras3_frames_per_second", "gauge", "Frames per second since the previous scrape.", labels, frames_rate)
+            add("pras3_dropped_frames_total", "counter", "Frames skipped to keep up.", labels, stats.dropped_frames)
+            add("pras3_dropped_writes_total", "counter", "Writes dropped while the device was stalled.", labels, device.dropped_writes)
+            add("pras3_errors_total", "counter", "Failed port writes.", labels, stats.errors)
+            add("pras3_escape_expansion_ratio", "gauge", "Escaped size / raw size of framed commands.", labels, stats.expansion)
+            add("pras3_stalled", "gauge", "1 while the device is stalled.", labels, int(device.stalled))
+            add("pras3_stalls_total", "counter", "Times the device stalled.", labels, device.stall_count)
+            add("pras3_stalled_seconds_total", "counter", "Time spent stalled.", labels, device.stalled_time)
+            add("pras3_write_latency_seconds", "histogram", "Time spent in each port write.", labels, stats.write_latency)
+            if stats.render_time.count:
+                add("pras3_effect_render_seconds", "histogram", "Time effects spent building a frame.", labels, stats.render_time)
+        return [(name, kind, help_text, samples) for name, (kind, help_text, samples) in families.items()]
+
+    def render(self) -> str:
+        with self._lock:
+            families = self._device_metrics()
+            for collector in self._collectors:
+                try:
+                    families.extend(collector())
+                except Exception as e:
+                    logging.error(f"Metrics collector failed: {e}")
+        lines = []
+        for family in families:
+            lines.extend(format_metric(*family))
+        return "\n".join(lines) + "\n"
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        registry = self.server.registry
+        if path in ('/', '/metrics'):
+            body = registry.render().encode('utf-8')
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        elif path == '/trace' and registry.tracer is not None:
+            body = registry.tracer.dumps().encode('utf-8')
+            content_type = "application/json"
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+if hasattr(socket, 'AF_UNIX'):
+    class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            # http.server expects a (host, port) client address
+            request, _ = super().get_request()
+            return request, ("local", 0)
+
+def serve(registry, address):
+    """
+    Serve /metrics (and /trace) from a background thread.
+    address: "host:port" for HTTP (keep it on 127.0.0.1), or a filesystem
+             path for HTTP over a Unix socket, e.g.
+             curl --unix-socket /tmp/pras3-metrics.sock http://x/metrics
+    returns: the server, call shutdown() to stop it
+    raises: OSError if it can't listen there
+    """
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        server = _HTTPServer((host, int(port)), _Handler)
+    else:
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError(f"no Unix sockets here for metrics on '{address}', use host:port")
+        if os.path.exists(address):
+            os.unlink(address)  # left over from a previous run
+        server = _UnixHTTPServer(address, _Handler)
+    server.registry = registry
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
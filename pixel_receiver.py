@@ -0,0 +1,248 @@
+import time
+import errno
+import select
+import socket
+import struct
+import logging
+import operator
+from threading import Thread, Event
+
+from pras3 import Histogram
+
+###############################################################################
+# Network pixel input: E1.31 (sACN), Art-Net, DDP
+###############################################################################
+SACN_PORT = 5568
+ARTNET_PORT = 6454
+DDP_PORT = 4048
+
+SACN_ID = b"ASC-E1.17\x00\x00\x00"
+ARTNET_ID = b"Art-Net\x00"
+ARTNET_OP_DMX = 0x5000
+DDP_PUSH = 0x01
+DDP_TIMECODE = 0x10
+
+NUM_PIXELS = 22
+PACKET_SIZE = 1500
+
+def _newer(seq, last, bits, window):
+    """
+    Sequence check as E1.31 describes it: a packet is out of order if it
+    is at most `window` behind the last one, anything further back is
+    taken as the sender starting over.
+    """
+    half = 1 << (bits - 1)
+    diff = ((seq - last + half) % (1 << bits)) - half
+    return diff > 0 or diff <= -window
+
+class PixelReceiver:
+    """
+    Receives pixel data from lighting software and draws it on the LEDs.
+
+    The universe's channels from start_channel (1-based, like a DMX
+    address) on are RGB for the 22 LEDs in left to right order; they are
+    put in the board's order with NORMAL_MAPPING. DDP has no universes,
+    its byte offsets count like channels (offset 0 = channel 1).
+
+    Packets go into one preallocated buffer and are parsed in place, the
+    frame is gathered straight from it into the 198-byte page the board
+    takes. If packets come in faster than the wire takes frames, only the
+    newest frame is written (superseded counts the rest).
+
+    on_active(True/False) is called when data starts, and when it stops
+    for `timeout` seconds or an sACN source says it's done.
+    """
+    def __init__(self, leds, universe=1, start_channel=1, protocols=('sacn', 'artnet', 'ddp'),
+                 bind='0.0.0.0', timeout=2.5, lock=None, on_active=None):
+        self.leds = leds
+        self.universe = universe
+        self.timeout = timeout
+        self.lock = lock
+        self.on_active = on_active
+        self.active = False
+
+        # source byte for each of the 198 output bytes: remapped, 3 copies
+        first = start_channel - 1
+        order = [first + leds.NORMAL_MAPPING[i] * 3 + c for i in range(NUM_PIXELS) for c in range(3)]
+        self._gather = operator.itemgetter(*(order * 3))
+        self._needed = first + NUM_PIXELS * 3
+        self._pixels = bytearray(max(self._needed, 512))
+
+        self._buf = bytearray(PACKET_SIZE)
+        self._view = memoryview(self._buf)
+        self._seq = {}
+        self._last_packet = 0.0
+        self._stop = Event()
+        self._sockets = {}
+        for proto in protocols:
+            self._sockets[self._open(proto, bind)] = proto
+
+        self.packets = 0
+        self.frames = 0
+        self.out_of_order = 0
+        self.ignored = 0
+        self.malformed = 0
+        self.superseded = 0
+        self.latency = Histogram()  # packet received => frame written
+
+    def _open(self, proto, bind):
+        port = {'sacn': SACN_PORT, 'artnet': ARTNET_PORT, 'ddp': DDP_PORT}[proto]
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((bind, port))
+        if proto == 'sacn':
+            # sACN is multicast to 239.255.<universe hi>.<universe lo>
+            group = f"239.255.{self.universe >> 8}.{self.universe & 0xff}"
+            mreq = socket.inet_aton(group) + socket.inet_aton(bind)
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+            except OSError as e:
+                logging.warning(f"sACN: couldn't join {group}, unicast only: {e}")
+        sock.setblocking(False)
+        return sock
+
+    # --- parsing -------------------------------------------------------------
+    def _copy(self, v, start, offset, count):
+        """
+        Copy count bytes of packet data from v[start] to the pixels at
+        offset, clipped so the pixel buffer never changes size.
+        """
+        count = max(0, min(count, len(self._pixels) - offset))
+        self._pixels[offset:offset + count] = v[start:start + count]
+
+    def _in_order(self, key, seq, bits, window, now):
+        last = self._seq.get(key)
+        self._seq[key] = seq
+        if last is None or now - self._last_packet > self.timeout:
+            return True
+        if _newer(seq, last, bits, window):
+            return True
+        self._seq[key] = last
+        self.out_of_order += 1
+        return False
+
+    def _parse_sacn(self, v, n, src, now):
+        """returns: True if a frame is ready"""
+        if n < 126 or v[4:16] != SACN_ID or v[117] != 0x02 or v[125] != 0:
+            self.malformed += 1
+            return False
+        if struct.unpack_from(">H", v, 113)[0] != self.universe:
+            self.ignored += 1
+            return False
+        if v[112] & 0x40:
+            # stream terminated
+            self._set_active(False)
+            return False
+        if not self._in_order(('sacn', src), v[111], 8, 20, now):
+            return False
+        prop_count = struct.unpack_from(">H", v, 123)[0]
+        if prop_count < 1:
+            # no start code, so not a DMX frame
+            self.malformed += 1
+            return False
+        self._copy(v, 126, 0, min(prop_count - 1, n - 126))
+        return True
+
+    def _parse_artnet(self, v, n, src, now):
+        if n < 18 or v[0:8] != ARTNET_ID:
+            self.malformed += 1
+            return False
+        if struct.unpack_from("<H", v, 8)[0] != ARTNET_OP_DMX:
+            self.ignored += 1  # polls etc.
+            return False
+        if (v[14] | (v[15] << 8)) != self.universe:
+            self.ignored += 1
+            return False
+        seq = v[12]
+        if seq and not self._in_order(('artnet', src), seq, 8, 20, now):
+            return False
+        self._copy(v, 18, 0, min(struct.unpack_from(">H", v, 16)[0], n - 18))
+        return True
+
+    def _parse_ddp(self, v, n, src, now):
+        if n < 10 or v[0] & 0xc0 != 0x40:
+            self.malformed += 1
+            return False
+        flags = v[0]
+        header = 14 if flags & DDP_TIMECODE else 10
+        seq = v[1] & 0x0f
+        if seq and not self._in_order(('ddp', src), seq, 4, 4, now):
+            return False
+        offset, length = struct.unpack_from(">IH", v, 4)
+        length = min(length, n - header)
+        if offset < len(self._pixels):
+            self._copy(v, header, offset, length)
+        # without push every packet is a frame
+        return bool(flags & DDP_PUSH) or offset + length >= self._needed
+
+    # --- loop ----------------------------------------------------------------
+    def _set_active(self, active):
+        if active != self.active:
+            self.active = active
+            logging.info(f"Pixel input {'started' if active else 'stopped'}")
+            if self.on_active:
+                self.on_active(active)
+
+    def _receive(self, sock, proto):
+        """Drain one socket. returns: when the newest complete frame arrived, or None"""
+        ready = None
+        while True:
+            try:
+                n, addr = sock.recvfrom_into(self._buf)
+            except BlockingIOError:
+                return ready
+            except OSError as e:
+                if e.errno not in (errno.ECONNRESET,):
+                    logging.error(f"Pixel input {proto}: {e}")
+                return ready
+            now = time.perf_counter()
+            self.packets += 1
+            parse = getattr(self, f"_parse_{proto}")
+            if parse(self._view, n, addr[0], now):
+                if ready is not None:
+                    self.superseded += 1
+                ready = now
+            self._last_packet = now
+
+    def _write(self, received):
+        frame = bytes(self._gather(self._pixels))
+        if self.lock:
+            with self.lock:
+                self.leds.set_and_draw_pixels(frame)
+        else:
+            self.leds.set_and_draw_pixels(frame)
+        self.frames += 1
+        self.latency.observe(time.perf_counter() - received)
+
+    def _run(self):
+        sockets = list(self._sockets)
+        while not self._stop.is_set():
+            readable, _, _ = select.select(sockets, [], [], 0.25)
+            received = None
+            for sock in readable:
+                ready = self._receive(sock, self._sockets[sock])
+                if ready is not None:
+                    if received is not None:
+                        self.superseded += 1
+                    received = ready
+            if received is not None:
+                self._set_active(True)
+                try:
+                    self._write(received)
+                except Exception as e:
+                    logging.error(f"Pixel input write failed: {e}")
+            elif self.active and time.perf_counter() - self._last_packet > self.timeout:
+                self._set_active(False)
+        for sock in sockets:
+            sock.close()
+
+    def start(self):
+        Thread(target=self._run, name="pixel-input", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        return {'packets': self.packets, 'frames': self.frames, 'out_of_order': self.out_of_order,
+                'ignored': self.ignored, 'malformed': self.malformed, 'superseded': self.superseded,
+                'latency_mean': self.latency.sum / self.latency.count if self.latency.count else 0.0}
@@ -0,0 +1,141 @@
+import psutil
+import time
+import sys
+import subprocess
+from threading import Lock
+
+###############################################################################
+# Incremental process tracking
+###############################################################################
+class ProcessTracker:
+    """
+    Keeps a table of pid => (create_time, name, lowercase exe, exe) between
+    scans so only processes that appeared since the last scan get their exe
+    resolved. Resolving exe is the expensive part (and often AccessDenied),
+    so on a steady machine a scan is little more than listing the pids.
+
+    PIDs can be reused and exec() swaps the program behind a pid while
+    keeping its create time, so the matched games are re-checked every scan
+    and the whole table every full_rescan_every scans, by create time, name
+    and exe. Processes that couldn't be inspected are retried every scan.
+    forget(pid) drops a pid so the next scan inspects it again, e.g. when
+    the GameDetector sees it exec.
+    """
+    def __init__(self, targets, full_rescan_every=12):
+        self.targets = tuple(t.lower() for t in targets)
+        self.full_rescan_every = full_rescan_every
+        self._procs = {}   # pid -> (create_time, name, exe lowercase, exe) or None
+        self._forgotten = set()
+        self._lock = Lock()
+        self._scans = 0
+        # counters for logging/benchmarks
+        self.inspected = 0
+        self.denied = 0
+
+    def _inspect(self, pid):
+        self.inspected += 1
+        try:
+            p = psutil.Process(pid)
+            with p.oneshot():
+                create_time = p.create_time()
+                name = p.name()
+                try:
+                    exe = p.exe()
+                except psutil.AccessDenied:
+                    # cached as None, no point asking again for this process
+                    self.denied += 1
+                    exe = None
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return None
+        return (create_time, name, exe.lower() if exe else None, exe)
+
+    def _is_same(self, pid, entry):
+        create_time, name, _, exe = entry
+        try:
+            p = psutil.Process(pid)
+            with p.oneshot():
+                if p.create_time() != create_time or p.name() != name:
+                    return False
+                # a denied exe stays denied, the name has to do for those
+                return exe is None or p.exe() == exe
+        except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+            return False
+
+    def forget(self, pid):
+        """Have the next scan inspect pid again. Safe to call from any thread."""
+        with self._lock:
+            self._forgotten.add(pid)
+
+    def _matches(self, entry):
+        return entry is not None and entry[2] is not None and entry[2].startswith(self.targets)
+
+    def scan(self):
+        """
+        Update the table and return [(pid, name, exe)] of processes
+        under the target folders, sorted by pid.
+        """
+        self._scans += 1
+        pids = set(psutil.pids())
+        known = self._procs.keys()
+
+        with self._lock:
+            forgotten, self._forgotten = self._forgotten, set()
+        for pid in (known - pids) | (forgotten & known):
+            del self._procs[pid]
+
+        # catch reused pids: always for games, every so often for the rest
+        if self._scans % self.full_rescan_every == 0:
+            recheck = list(self._procs.items())
+        else:
+            recheck = [(pid, e) for pid, e in self._procs.items() if e is None or self._matches(e)]
+        for pid, entry in recheck:
+            if entry is None or not self._is_same(pid, entry):
+                del self._procs[pid]
+
+        for pid in pids - self._procs.keys():
+            self._procs[pid] = self._inspect(pid)
+
+        return [(pid, e[1], e[3]) for pid, e in sorted(self._procs.items()) if self._matches(e)]
+
+    def __len__(self):
+        return len(self._procs)
+
+
+###############################################################################
+# Benchmark: full process_iter scan vs. incremental scan
+###############################################################################
+def full_scan(targets):
+    """The old way: resolve exe for every process on every poll."""
+    targets = [t.lower() for t in targets]
+    found = []
+    for proc in psutil.process_iter(['pid', 'name', 'exe']):
+        pexe = proc.info['exe']
+        if pexe and pexe.lower().startswith(tuple(targets)):
+            found.append(proc.info['name'])
+    return found
+
+def benchmark(extra_counts=(0, 100, 400), repeat=5):
+    targets = [r"c:\games", r"c:\emulators"]
+    print(f"{'processes':>10} {'full scan ms':>14} {'incremental ms':>16}")
+    for extra in extra_counts:
+        children = [subprocess.Popen([sys.executable, "-c", "import time; time.sleep(600)"])
+                    for _ in range(extra)]
+        try:
+            time.sleep(0.5)
+            tracker = ProcessTracker(targets)
+            tracker.scan()  # warm up the table
+            t0 = time.perf_counter()
+            for _ in range(repeat):
+                full_scan(targets)
+            t1 = time.perf_counter()
+            for _ in range(repeat):
+                tracker.scan()
+            t2 = time.perf_counter()
+            print(f"{len(tracker):>10} {(t1 - t0) / repeat * 1000:>14.2f} {(t2 - t1) / repeat * 1000:>16.2f}")
+        finally:
+            for c in children:
+                c.kill()
+                c.wait()
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,158 @@
+import os
+import json
+import struct
+import time
+import datetime
+
+###############################################################################
+# Play session telemetry
+###############################################################################
+# Log records, little-endian:
+#   NAME:  type(1) | game id u16 | name len u8 | utf-8 name
+#   START: type(1) | unix time u32 | game id u16
+#   STOP:  type(1) | unix time u32 | game id u16
+REC_NAME = 0
+REC_START = 1
+REC_STOP = 2
+EVENT = struct.Struct("<BIH")
+NAME = struct.Struct("<BHB")
+
+class SessionLog:
+    """
+    Records game start/stop events to an append-only log (7 bytes per
+    event, game names are written once and referenced by id) and keeps
+    per-game daily totals in a small rollup file.
+
+    The rollup remembers how far into the log it has counted, so startup
+    only replays what was appended since, and queries like top_games()
+    only ever look at the rollup.
+    """
+    def __init__(self, log_path, rollup_path):
+        self.log_path = log_path
+        self.rollup_path = rollup_path
+        self._ids = {}       # name -> id
+        self._names = []     # id -> name
+        self.daily = {}      # 'YYYY-MM-DD' -> {name: seconds}
+        self._open = None    # (name, start time)
+        self._offset = 0
+        self._load()
+        # a session still open here ended while we weren't running, and we
+        # can't tell when, so it isn't counted
+        self._open = None
+        self._log = open(log_path, "ab")
+
+    # --- persistence ---------------------------------------------------------
+    def _load(self):
+        if os.path.exists(self.rollup_path):
+            with open(self.rollup_path, "r", encoding='utf-8') as f:
+                saved = json.load(f)
+            self.daily = saved['daily']
+            self._offset = saved['offset']
+        if os.path.exists(self.log_path):
+            with open(self.log_path, "rb") as f:
+                data = f.read()
+            self._replay(data)
+            self._offset = len(data)
+
+    def _replay(self, data):
+        # names are needed from the start, counting only past the offset
+        pos = 0
+        while pos < len(data):
+            kind = data[pos]
+            if kind == REC_NAME:
+                if pos + NAME.size > len(data):
+                    break
+                _, game_id, n = NAME.unpack_from(data, pos)
+                end = pos + NAME.size + n
+                if end > len(data):
+                    break
+                name = data[pos + NAME.size:end].decode('utf-8', 'replace')
+                self._ids[name] = game_id
+                self._names.append(name)
+                pos = end
+            else:
+                if pos + EVENT.size > len(data):
+                    break  # torn write at the end
+                _, t, game_id = EVENT.unpack_from(data, pos)
+                if pos >= self._offset:
+                    self._apply(kind, t, self._names[game_id])
+                pos += EVENT.size
+
+    def _save(self):
+        tmp = self.rollup_path + ".tmp"
+        with open(tmp, "w", encoding='utf-8') as f:
+            json.dump({'offset': self._offset, 'daily': self.daily}, f)
+        os.replace(tmp, self.rollup_path)
+
+    def _append(self, b):
+        self._log.write(b)
+        self._log.flush()
+        self._offset += len(b)
+
+    # --- rollup --------------------------------------------------------------
+    def _add(self, name, start, stop):
+        # split the session at local midnight so each day gets its part
+        while start < stop:
+            day = datetime.date.fromtimestamp(start)
+            next_day = time.mktime((day + datetime.timedelta(days=1)).timetuple())
+            end = min(stop, next_day)
+            totals = self.daily.setdefault(day.isoformat(), {})
+            totals[name] = totals.get(name, 0) + (end - start)
+            start = end
+
+    def _apply(self, kind, t, name):
+        if kind == REC_START:
+            self._open = (name, t)
+        elif kind == REC_STOP and self._open and self._open[0] == name:
+            self._add(name, self._open[1], t)
+            self._open = None
+
+    # --- recording -----------------------------------------------------------
+    @staticmethod
+    def _fit(name):
+        "The name as it's logged: at most 255 bytes, cut between characters."
+        return name.encode('utf-8')[:255].decode('utf-8', 'ignore')
+
+    def _event(self, kind, name):
+        if name not in self._ids:
+            game_id = len(self._names)
+            self._ids[name] = game_id
+            self._names.append(name)
+            encoded = name.encode('utf-8')
+            self._append(NAME.pack(REC_NAME, game_id, len(encoded)) + encoded)
+        t = int(time.time())
+        self._append(EVENT.pack(kind, t, self._ids[name]))
+        self._apply(kind, t, name)
+
+    def start(self, name):
+        name = self._fit(name)
+        if self._open:
+            self.stop(self._open[0])
+        self._event(REC_START, name)
+
+    def stop(self, name):
+        name = self._fit(name)
+        if not self._open or self._open[0] != name:
+            return
+        self._event(REC_STOP, name)
+        self._save()
+
+    def close(self):
+        if self._open:
+            self.stop(self._open[0])
+        self._log.close()
+
+    # --- queries -------------------------------------------------------------
+    def totals(self, days=7):
+        """Seconds played per game over the last `days` days, today included."""
+        today = datetime.date.today()
+        result = {}
+        for i in range(days):
+            day = (today - datetime.timedelta(days=i)).isoformat()
+            for name, seconds in self.daily.get(day, {}).items():
+                result[name] = result.get(name, 0) + seconds
+        return result
+
+    def top_games(self, days=7, n=10):
+        """[(name, seconds)] most played first."""
+        return sorted(self.totals(days).items(), key=lambda kv: kv[1], reverse=True)[:n]
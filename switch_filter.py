@@ -0,0 +1,77 @@
+import time
+
+###############################################################################
+# Game switch hysteresis
+###############################################################################
+class SwitchFilter:
+    """
+    Decides when a change in the detected game is real.
+
+    State is the current (applied) game plus at most one pending candidate.
+    A candidate only becomes current once it has been seen continuously for
+    enter_delay (switching to a game) or exit_delay (going back to
+    NO_GAME). Launchers that spawn and kill helpers would otherwise flip the
+    cabinet between games and NO_GAME on every poll.
+
+    Counters:
+      switches   - changes that went through
+      suppressed - candidates dropped because the current game came back
+      coalesced  - candidates replaced by a different one before committing
+    """
+    def __init__(self, current='NO_GAME', enter_delay=0.5, exit_delay=3.0, no_game='NO_GAME'):
+        self.current = current
+        self.enter_delay = enter_delay
+        self.exit_delay = exit_delay
+        self.no_game = no_game
+        self.pending = None
+        self.pending_since = None
+        self.switches = 0
+        self.suppressed = 0
+        self.coalesced = 0
+
+    def _delay(self, candidate):
+        return self.exit_delay if candidate == self.no_game else self.enter_delay
+
+    def observe(self, candidate, now=None):
+        """
+        Feed the latest detection result.
+        returns: the game to switch to, or None to stay put.
+        """
+        if now is None:
+            now = time.monotonic()
+        if candidate == self.current:
+            if self.pending is not None:
+                self.suppressed += 1
+                self.pending = None
+            return None
+        if candidate != self.pending:
+            if self.pending is not None:
+                self.coalesced += 1
+            self.pending = candidate
+            self.pending_since = now
+        if now - self.pending_since < self._delay(candidate):
+            return None
+        self.current = candidate
+        self.pending = None
+        self.switches += 1
+        return candidate
+
+    def force(self, candidate):
+        """
+        Switch without waiting (e.g. told to by a launcher).
+        returns: candidate, or None if it's already current.
+        """
+        self.pending = None
+        if candidate == self.current:
+            return None
+        self.current = candidate
+        self.switches += 1
+        return candidate
+
+    def time_to_decision(self, now=None):
+        """Seconds until the pending candidate would commit, or None."""
+        if self.pending is None:
+            return None
+        if now is None:
+            now = time.monotonic()
+        return max(0.0, self.pending_since + self._delay(self.pending) - now)
@@ -0,0 +1,237 @@
+import sys
+import time
+import random
+import socket
+import struct
+import logging
+import argparse
+from threading import Thread, Event, Lock
+
+###############################################################################
+# Multi-cabinet effect sync over UDP multicast
+###############################################################################
+# The leader sends a beacon once a second and whenever its effect changes:
+#
+#   magic "P3SY" | session u16 | seq u16 | leader clock f64 | effect u8 |
+#   color rgb | color 2 rgb | effect epoch f64          (31 bytes)
+#
+# Followers work out the leader's clock from the beacons and run the same
+# effect with the same epoch, so every cabinet computes the same frame
+# index from the shared time instead of counting its own frames.
+#
+#   python sync.py lead --effect rainbow      one per terminal, to try it
+#   python sync.py follow                     on localhost
+BEACON = struct.Struct("<4sHHdB3s3sd")
+MAGIC = b"P3SY"
+DEFAULT_GROUP = "239.255.83.51"
+DEFAULT_PORT = 5571
+
+class SyncClock:
+    """The leader's clock: local monotonic time plus an offset."""
+    def __init__(self):
+        self.offset = 0.0
+
+    def now(self):
+        return time.monotonic() + self.offset
+
+class EffectClock:
+    """
+    Passed to effects as clock=. Frame n of an effect is due at
+    epoch + n * period on the shared clock.
+    """
+    def __init__(self, clock, epoch):
+        self.clock = clock
+        self.epoch = epoch
+
+    def frame(self, period):
+        return max(0, int((self.clock.now() - self.epoch) / period))
+
+    def wait_next(self, period, stop_event=None):
+        "Sleep until the next frame is due."
+        delay = self.epoch + (self.frame(period) + 1) * period - self.clock.now()
+        if delay <= 0:
+            return
+        if stop_event:
+            stop_event.wait(delay)
+        else:
+            time.sleep(delay)
+
+def _socket(group, port, receive):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, 'SO_REUSEPORT'):
+        # several followers on one box
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if receive:
+        sock.bind(('', port))
+        mreq = socket.inet_aton(group) + socket.inet_aton('0.0.0.0')
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
+        sock.settimeout(0.5)
+    else:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+    return sock
+
+class SyncLeader:
+    """
+    Sends the effect state. set_state() returns the EffectClock the
+    leader's own effect should run with.
+    effects: list of effect names, the index goes over the wire.
+    lead: how far ahead of now a new effect starts, so followers get the
+    beacon before its first frame.
+    """
+    def __init__(self, effects, group=DEFAULT_GROUP, port=DEFAULT_PORT, interval=1.0, lead=0.1):
+        self.effects = list(effects)
+        self.address = (group, port)
+        self.interval = interval
+        self.lead = lead
+        self.clock = SyncClock()
+        self.session = random.randrange(1 << 16)
+        self.sent = 0
+        self._seq = 0
+        self._state = None
+        self._lock = Lock()
+        self._stop = Event()
+        self._sock = _socket(group, port, receive=False)
+
+    def set_state(self, effect, color, color_2):
+        epoch = self.clock.now() + self.lead
+        with self._lock:
+            self._state = (self.effects.index(effect), bytes(color), bytes(color_2), epoch)
+        self._send()
+        return EffectClock(self.clock, epoch)
+
+    def _send(self):
+        with self._lock:
+            if self._state is None:
+                return
+            effect, color, color_2, epoch = self._state
+            self._seq = (self._seq + 1) & 0xffff
+            b = BEACON.pack(MAGIC, self.session, self._seq, self.clock.now(), effect, color, color_2, epoch)
+        try:
+            self._sock.sendto(b, self.address)
+            self.sent += 1
+        except OSError as e:
+            logging.error(f"Sync beacon failed: {e}")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._send()
+
+    def start(self):
+        Thread(target=self._run, name="sync-leader", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+class SyncFollower:
+    """
+    Follows a leader. on_state(effect, color, color_2, effect_clock) is
+    called when the leader's effect changes, on_state(None, ...) when no
+    beacon came for `timeout` seconds.
+
+    The clock offset is the largest (leader time - receive time) of the
+    last `window` beacons: that's the one that spent the least time on the
+    network, and redoing it every beacon follows clock drift.
+    """
+    def __init__(self, effects, on_state, group=DEFAULT_GROUP, port=DEFAULT_PORT, timeout=5.0, window=8):
+        self.effects = list(effects)
+        self.on_state = on_state
+        self.timeout = timeout
+        self.window = window
+        self.clock = SyncClock()
+        self.active = False
+        self.received = 0
+        self.out_of_order = 0
+        self._samples = []
+        self._session = None
+        self._seq = None
+        self._state = None
+        self._last = 0.0
+        self._stop = Event()
+        self._sock = _socket(group, port, receive=True)
+
+    def _beacon(self, data, received):
+        if len(data) != BEACON.size:
+            return
+        magic, session, seq, leader_time, effect, color, color_2, epoch = BEACON.unpack(data)
+        if magic != MAGIC or effect >= len(self.effects):
+            return
+        if session != self._session:
+            # new leader or it restarted: its clock has nothing to do with the old one
+            self._session = session
+            self._samples = []
+            self._seq = None
+            self._state = None
+        elif self._seq is not None and ((seq - self._seq) & 0xffff) >= 0x8000:
+            self.out_of_order += 1
+            return
+        self._seq = seq
+        self.received += 1
+        self._last = received
+
+        self._samples.append(leader_time - received)
+        del self._samples[:-self.window]
+        self.clock.offset = max(self._samples)
+
+        state = (effect, color, color_2, epoch)
+        if state != self._state:
+            self._state = state
+            self.active = True
+            self.on_state(self.effects[effect], list(color), list(color_2), EffectClock(self.clock, epoch))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                data, _ = self._sock.recvfrom(64)
+                self._beacon(data, time.monotonic())
+            except socket.timeout:
+                pass
+            except OSError as e:
+                logging.error(f"Sync receive failed: {e}")
+                time.sleep(1)
+            if self.active and time.monotonic() - self._last > self.timeout:
+                logging.warning("Sync leader lost")
+                self.active = False
+                self._state = None
+                self.on_state(None, None, None, None)
+
+    def start(self):
+        Thread(target=self._run, name="sync-follower", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+
+if __name__ == "__main__":
+    # no LEDs needed: prints the rainbow step each cabinet would show
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Try effect sync on localhost")
+    parser.add_argument("role", choices=['lead', 'follow'])
+    parser.add_argument("--effect", default='rainbow')
+    parser.add_argument("--group", default=DEFAULT_GROUP)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    args = parser.parse_args()
+    effects = ['solid', 'two color', 'rainbow', 'vu meter']
+    current = {}
+
+    def on_state(effect, color, color_2, clock):
+        current['clock'] = clock
+        logging.info(f"Following => {effect} {color} {color_2}")
+
+    if args.role == 'lead':
+        node = SyncLeader(effects, args.group, args.port)
+        current['clock'] = node.set_state(args.effect, [255, 0, 0], [0, 0, 255])
+    else:
+        node = SyncFollower(effects, on_state, args.group, args.port)
+    node.start()
+    try:
+        while True:
+            clock = current.get('clock')
+            if not clock:
+                time.sleep(0.5)
+                continue
+            # on each whole second of the shared clock, so the lines compare
+            time.sleep(1 - clock.clock.now() % 1)
+            print(f"rainbow step {clock.frame(0.01) % 256:3d}  frame {clock.frame(0.01)}", flush=True)
+    except KeyboardInterrupt:
+        sys.exit(0)